@@ -0,0 +1,222 @@
+import asyncio
+import time
+from dataclasses import asdict, dataclass
+from ratelimit import TokenBucket
+
+"""
+Details:
+    2020-04-23
+
+Module details:
+    Admission control of chat commands.
+
+Synposis:
+    Every command takes a slot in the dispatcher, and a
+    single user or a spam bot repeating an expensive query
+    can fill them all, making everyone else wait. Commands
+    are therefore admitted by a token bucket per user and
+    one per channel, and no more than a fixed number of
+    queries are answered at once, so that the wait for a slot
+    stays short. A query arriving while the same one is being
+    answered waits for that answer rather than running again.
+    A refused command is answered with a canned reply the
+    first time, and later ones are dropped without a reply
+    until the user or channel is admitted again, so that
+    throttling a flood does not flood the channel.
+"""
+
+
+@dataclass
+class AdmissionStats:
+    """
+    Counters for an AdmissionControl.
+
+    :deduplicated:
+        commands answered with the answer to the same query,
+        already in progress when they arrived
+
+    :repeated:
+        commands dropped without a reply since the same user
+        sent the same command in the same channel, and it was
+        still in progress
+
+    :limited:
+        commands refused by the rate limit of a user or
+        channel
+
+    :shed:
+        commands refused since too many were in progress
+
+    :replied:
+        canned replies given to refused commands
+    """
+    admitted: int = 0
+    deduplicated: int = 0
+    repeated: int = 0
+    limited: int = 0
+    shed: int = 0
+    replied: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class AdmissionControl:
+    """
+    Decide which chat commands to run, see run.
+
+    :user_rate:
+        commands per second a user may send over time
+
+    :user_burst:
+        commands a user may send at once
+
+    :channel_rate:
+        commands per second admitted in a channel over time
+
+    :channel_burst:
+        commands admitted in a channel at once
+
+    :max_in_flight:
+        maximum number of commands in progress at once,
+        further commands are refused
+
+    :prune_interval:
+        seconds between removals of the buckets of users and
+        channels which have been idle long enough to be full
+
+    :personal_words:
+        words of commands whose answer depends on who sends
+        them and where, such as subscribing a channel, which
+        are only shared with the same user in the same channel
+    """
+
+    LIMITED_RESPONSE = 'Du ställer frågor för tätt, vänta en stund innan du frågar igen.'
+    BUSY_RESPONSE = 'Jag har många frågor att svara på just nu, försök igen om en stund.'
+
+    def __init__(self, user_rate = 0.2, user_burst = 5, channel_rate = 1, channel_burst = 10,
+                 max_in_flight = 32, prune_interval = 300, personal_words = ()):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.max_in_flight = max_in_flight
+        self.prune_interval = prune_interval
+        self.personal_words = frozenset(personal_words)
+        self.stats = AdmissionStats()
+        self._users = {}
+        self._channels = {}
+        self._in_flight = {}
+        self._askers = {}
+        self._refused = set()
+        self._next_prune = time.monotonic() + prune_interval
+
+    @staticmethod
+    def _bucket(buckets: dict, key, rate: float, capacity: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.prune_interval
+        for kind, buckets in (('user', self._users), ('channel', self._channels)):
+            for key in [key for key, bucket in buckets.items() if bucket.full]:
+                del buckets[key]
+                self._refused.discard((kind, key))
+
+    def _refuse(self, refused: tuple, response: str) -> str:
+        if refused in self._refused:
+            return None
+        self._refused.add(refused)
+        self.stats.replied += 1
+        return response
+
+    def _done(self, key: tuple, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+            del self._askers[key]
+        # Retrieved, should every caller waiting for it have
+        # given up.
+        if not task.cancelled():
+            task.exception()
+
+    def _key(self, user, channel, content: str) -> tuple:
+        query = ' '.join(content.lower().split())
+        if self.personal_words.intersection(i.strip('!?.,') for i in query.split()):
+            return query, channel, user
+        return (query,)
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Number of queries being answered.
+        """
+        return len(self._in_flight)
+
+    @property
+    def tracked(self) -> int:
+        """
+        Number of users and channels holding a bucket.
+        """
+        return len(self._users) + len(self._channels)
+
+    async def run(self, user, channel, content: str, func):
+        """
+        Run a command if it is admitted. A command whose query
+        is already being answered is not run, but is given the
+        same answer, unless the same user sent it in the same
+        channel, in which case it is dropped without a reply.
+        :param user:
+            hashable identifying the sender, such as the id
+            of the member
+        :param channel:
+            hashable identifying the channel
+        :param content:
+            string, the message holding the command
+        :param func:
+            coroutine function answering the command
+        :returns:
+            the return value of func if the command was
+            answered, a canned reply the first time a user or
+            channel is refused, otherwise None
+        """
+        self._prune()
+        key = self._key(user, channel, content)
+        leader = self._in_flight.get(key)
+        if leader is not None and leader.done():
+            leader = None
+        if leader is not None and (channel, user) in self._askers[key]:
+            self.stats.repeated += 1
+            return None
+
+        user_bucket = self._bucket(self._users, user, self.user_rate, self.user_burst)
+        if user_bucket.delay() > 0:
+            self.stats.limited += 1
+            return self._refuse(('user', user), AdmissionControl.LIMITED_RESPONSE)
+        channel_bucket = self._bucket(self._channels, channel, self.channel_rate, self.channel_burst)
+        if channel_bucket.delay() > 0:
+            self.stats.limited += 1
+            return self._refuse(('channel', channel), AdmissionControl.BUSY_RESPONSE)
+        if leader is None and len(self._in_flight) >= self.max_in_flight:
+            self.stats.shed += 1
+            return self._refuse(('channel', channel), AdmissionControl.BUSY_RESPONSE)
+
+        user_bucket.try_acquire()
+        channel_bucket.try_acquire()
+        self._refused.discard(('user', user))
+        self._refused.discard(('channel', channel))
+        if leader is None:
+            self.stats.admitted += 1
+            leader = self._in_flight[key] = asyncio.ensure_future(func())
+            self._askers[key] = set()
+            leader.add_done_callback(lambda task: self._done(key, task))
+        else:
+            self.stats.deduplicated += 1
+        self._askers[key].add((channel, user))
+        # Shielded, so that a caller giving up does not cancel
+        # the answer for the others waiting for it.
+        return await asyncio.shield(leader)
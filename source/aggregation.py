@@ -0,0 +1,87 @@
+from array import array
+from operator import itemgetter
+
+"""
+Details:
+    2020-04-11
+
+Module details:
+    Rankings and aggregates over one column of a snapshot.
+
+Synposis:
+    Questions such as which country has the most deaths, the
+    ten countries with the most cases or the global total
+    are all answered from the same ordering of a column. The
+    ordering and the sum are computed once when a snapshot is
+    built, after which top and bottom lists are slices and
+    percentiles are index lookups.
+"""
+
+
+class ColumnRanking:
+    """
+    The known values of one column, ordered from highest to
+    lowest once upon construction. Ties are ordered by key.
+
+    :keys:
+        tuple of country keys in ranking order
+
+    :values:
+        array of the values in ranking order
+
+    :total:
+        the sum of the values
+    """
+
+    __slots__ = ('keys', 'values', 'total', '_positions')
+
+    def __init__(self, pairs, typecode = 'q'):
+        # Sorted by key, then by value with the stable sort,
+        # which keeps ties in key order.
+        ordered = [pair for pair in pairs if pair[1] is not None]
+        ordered.sort(key = itemgetter(0))
+        ordered.sort(key = itemgetter(1), reverse = True)
+        self.keys = tuple(key for key, _ in ordered)
+        self.values = array(typecode, (value for _, value in ordered))
+        self.total = sum(self.values)
+        self._positions = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def top(self, k: int) -> list:
+        """
+        Return the k highest (key, value) pairs, highest first.
+        """
+        return list(zip(self.keys[:k], self.values[:k]))
+
+    def bottom(self, k: int) -> list:
+        """
+        Return the k lowest (key, value) pairs, lowest first.
+        """
+        if k <= 0:
+            return []
+        return list(zip(self.keys[-k:], self.values[-k:]))[::-1]
+
+    def percentile(self, p: float) -> float:
+        """
+        Return the p:th percentile of the values, 0 to 100,
+        interpolating linearly between the closest ranks.
+        """
+        if not self.values:
+            return None
+        position = (100 - p) / 100 * (len(self.values) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(self.values) - 1)
+        fraction = position - lower
+        return self.values[lower] + (self.values[upper] - self.values[lower]) * fraction
+
+    def rank_of(self, key: str) -> int:
+        """
+        Return the 1-based rank of a key, highest value first.
+        :raises:
+            KeyError if the key has no value in this column
+        """
+        if self._positions is None:
+            self._positions = {key: i for i, key in enumerate(self.keys)}
+        return self._positions[key] + 1
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import threading
+import time
+
+"""
+Details:
+    2020-04-19
+
+Module details:
+    Cache of the text files sent by the bot.
+
+Synposis:
+    Texts such as the greeting to new members are kept in
+    files so that they can be edited without restarting the
+    bot. Rather than reading the file every time the text is
+    sent, which during a wave of joins means hundreds of reads
+    on the event loop, each file is read once and read again
+    only when it has been modified, which is checked at most
+    every few seconds.
+"""
+
+
+class _Asset:
+
+    __slots__ = ('text', 'mtime', 'next_check')
+
+    def __init__(self, text: str, mtime: float, next_check: float):
+        self.text = text
+        self.mtime = mtime
+        self.next_check = next_check
+
+
+class AssetCache:
+    """
+    Text files read once and reloaded when modified. Should
+    a reload fail, the text previously read is kept.
+
+    :directory:
+        directory the names of the files are relative to
+
+    :check_interval:
+        seconds between checks of whether a file changed
+    """
+
+    def __init__(self, directory: str = '', check_interval = 5):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _due(self, name: str) -> bool:
+        asset = self._assets.get(name)
+        return asset is None or time.monotonic() >= asset.next_check
+
+    def get(self, name: str) -> str:
+        """
+        Return the text of a file, reading it if it is not
+        cached or has been modified.
+        :param name:
+            string, name of the file
+        :returns:
+            string
+        :raises:
+            OSError if the file was never read and cannot be
+        """
+        asset = self._assets.get(name)
+        if asset is not None and time.monotonic() < asset.next_check:
+            return asset.text
+
+        with self._lock:
+            asset = self._assets.get(name)
+            next_check = time.monotonic() + self.check_interval
+            try:
+                mtime = os.stat(self._path(name)).st_mtime
+                if asset is None or mtime != asset.mtime:
+                    with open(self._path(name), 'r', encoding = 'utf-8') as f:
+                        asset = _Asset(f.read(), mtime, next_check)
+            except (OSError, ValueError):
+                if asset is None:
+                    raise
+            asset.next_check = next_check
+            self._assets[name] = asset
+            return asset.text
+
+    async def get_async(self, name: str) -> str:
+        """
+        Return the text of a file like get, reading the file
+        in a thread rather than on the event loop.
+        """
+        if not self._due(name):
+            return self._assets[name].text
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, name)
@@ -0,0 +1,277 @@
+from collections import defaultdict
+from operator import itemgetter
+from typing import NamedTuple
+from snapshot import Snapshot
+from custom_errs import ApiHandleError
+
+"""
+Details:
+    2020-04-04
+
+Module details:
+    Change detection between consecutive api snapshots.
+
+Synposis:
+    The bot pushes a message whenever a number changes for
+    a country. Rather than polling every country and metric
+    on its own, the previous and current snapshots are compared
+    in a single pass whenever the api handle installs a new
+    snapshot. The integer columns of the snapshots are compared
+    block by block, see CountryTable.changed_rows, so that a
+    poll costs in proportion to the number of changes. Only the
+    changed values are rendered, all of them at once, and the
+    messages are grouped per channel they are routed to.
+"""
+
+
+class Change(NamedTuple):
+    """
+    A changed value for a country.
+
+    :country:
+        normalized English country name, as indexed in Snapshot
+
+    :metric:
+        the Snapshot column that changed
+
+    :previous:
+        the value in the previous snapshot, None if the country
+        or value was not reported before
+
+    :current:
+        the value in the current snapshot
+    """
+    country: str
+    metric: str
+    previous: int
+    current: int
+
+
+def snapshot_values(snapshot: Snapshot, metrics: tuple) -> dict:
+    """
+    Return the values of a snapshot keyed by (country, metric),
+    missing values left out.
+    :param snapshot:
+        Snapshot
+    :param metrics:
+        tuple of Snapshot columns
+    :returns:
+        dict
+    """
+    table = snapshot.table
+    values = {}
+    for metric in metrics:
+        values.update(((country, metric), value) for country, value in table.present(metric))
+    return values
+
+
+def _in_row_order(found: list) -> list:
+    # Changes ordered by country as in the snapshot, then
+    # by metric, found as (row, metric index, Change).
+    found.sort(key = itemgetter(0, 1))
+    return [change for _, _, change in found]
+
+
+def diff_values(baseline: dict, current: Snapshot, metrics: tuple) -> list:
+    """
+    Return the changed (country, metric) pairs between a
+    baseline of values and a snapshot. Values missing in the
+    snapshot are not reported as changes.
+    :param baseline:
+        dict keyed by (country, metric), as returned by 
+        snapshot_values
+    :param current:
+        Snapshot, the most recent snapshot
+    :param metrics:
+        tuple of Snapshot columns to compare
+    :returns:
+        list of Change
+    """
+    table = current.table
+    found = []
+    for i, metric in enumerate(metrics):
+        missing = table.missing[metric]
+        for row, (country, value) in enumerate(zip(table.keys, table.columns[metric])):
+            if missing[row]:
+                continue
+            previous_value = baseline.get((country, metric))
+            if value != previous_value:
+                found.append((row, i, Change(country, metric, previous_value, value)))
+    return _in_row_order(found)
+
+
+def diff_since(baseline: dict, previous: Snapshot, current: Snapshot, metrics: tuple) -> list:
+    """
+    Return the same changes as diff_values, given that the
+    baseline holds every value of the previous snapshot in
+    metrics, as it does once the changes of the previous
+    snapshot have been applied to it. Only the values which
+    differ between the snapshots are looked up.
+    :param previous:
+        Snapshot, the snapshot the baseline was brought up to
+    """
+    table = current.table
+    positions = table.align(previous.table)
+    found = []
+    for i, metric in enumerate(metrics):
+        values, missing = table.columns[metric], table.missing[metric]
+        for row in table.changed_rows(previous.table, metric, positions):
+            if missing[row]:
+                continue
+            country = table.keys[row]
+            previous_value = baseline.get((country, metric))
+            if values[row] != previous_value:
+                found.append((row, i, Change(country, metric, previous_value, values[row])))
+    return _in_row_order(found)
+
+
+def diff_snapshots(previous: Snapshot, current: Snapshot, metrics: tuple) -> list:
+    """
+    Return the changed (country, metric) pairs between
+    two snapshots, see diff_values.
+    :param previous:
+        Snapshot, the baseline
+    :param current:
+        Snapshot, the most recent snapshot
+    :param metrics:
+        tuple of Snapshot columns to compare
+    :returns:
+        list of Change
+    """
+    return diff_values(snapshot_values(previous, metrics), current, metrics)
+
+
+class StaticRouter:
+    """
+    Decide which channels a change is pushed to. A route
+    sends one metric either for the given countries only,
+    or for every country except those excluded.
+    """
+
+    def __init__(self):
+        self._routes = defaultdict(list)
+
+    def add(self, metric: str, channel: int, countries: tuple = None, exclude: tuple = ()) -> None:
+        """
+        Add a route.
+        :param metric:
+            string, Snapshot column to route
+        :param channel:
+            int, id of the Discord channel
+        :param countries:
+            tuple of normalized country names, None for all
+        :param exclude:
+            tuple of normalized country names to leave out
+        """
+        countries = frozenset(countries) if countries is not None else None
+        self._routes[metric].append((countries, frozenset(exclude), channel))
+
+    def channels_for(self, country: str, metric: str) -> list:
+        return [channel for countries, exclude, channel in self._routes.get(metric, ())
+                if (countries is None or country in countries) and country not in exclude]
+
+    @property
+    def metrics(self) -> tuple:
+        return tuple(self._routes)
+
+
+class ChangeFeed:
+    """
+    Scheduled job detecting changes between the snapshot
+    seen at the previous poll and the current one. As long
+    as the api handle has not installed a new snapshot a
+    poll costs nothing more than an identity comparison.
+
+    Changes are detected against the last published value
+    per country and metric. With a SnapshotStore these values
+    are persisted, so that change detection resumes where it
+    stopped after a restart. For a metric without published
+    values, as on the first poll or once the router starts
+    routing a metric it did not route at the previous poll,
+    the snapshot seen is only stored as the baseline of that
+    metric, in the same manner as
+    PollCache(silent_first_call = True).
+
+    :api_handle:
+        ApiHandle or AsyncApiHandle serving the snapshots
+
+    :router:
+        object with a channels_for(country, metric) method
+        and a metrics property, such as StaticRouter or
+        subscriptions.SubscriptionRegistry
+
+    :render:
+        callable taking a Change and the current Snapshot,
+        returning the message to push or None to skip it,
+        or an object rendering every change of a poll at once
+        with a render_many method, such as
+        rendering.ChangeRenderer
+
+    :store:
+        optional SnapshotStore persisting the published values
+    """
+
+    def __init__(self, api_handle, router, render, store = None):
+        self.api_handle = api_handle
+        self.router = router
+        self.render = render
+        self.store = store
+        self._previous: Snapshot = None
+        self._published = store.published() if store is not None else {}
+        self._previous_metrics = tuple({metric for _, metric in self._published})
+
+    def _render(self, changes: list, snapshot: Snapshot) -> list:
+        render_many = getattr(self.render, 'render_many', None)
+        if render_many is not None:
+            return render_many(changes, snapshot)
+        return [self.render(change, snapshot) for change in changes]
+
+    def poll(self) -> list:
+        """
+        Return the messages for every changed value since
+        the last poll, grouped per channel as dictionaries
+        with the keys 'channel' and 'result', the latter
+        holding a list of messages.
+        :returns:
+            list
+        """
+        try:
+            snapshot = self.api_handle.fetch_snapshot()
+        except ApiHandleError:
+            return []
+        if snapshot is self._previous:
+            return []
+
+        metrics = self.router.metrics
+        watched = tuple(i for i in metrics if i in self._previous_metrics)
+        added = tuple(i for i in metrics if i not in self._previous_metrics)
+        if self._previous is not None:
+            changes = diff_since(self._published, self._previous, snapshot, watched)
+        else:
+            changes = diff_values(self._published, snapshot, watched)
+        self._previous = snapshot
+        self._previous_metrics = metrics
+
+        published = {(i.country, i.metric): i.current for i in changes}
+        published.update(snapshot_values(snapshot, added))
+        self._published.update(published)
+        if self.store is not None and published:
+            self.store.set_published((country, metric, value) for (country, metric), value in published.items())
+        if not changes:
+            return []
+
+        routed = []
+        for change in changes:
+            channels = self.router.channels_for(change.country, change.metric)
+            if channels:
+                routed.append((change, channels))
+
+        grouped = defaultdict(list)
+        messages = self._render([change for change, _ in routed], snapshot)
+        for (_, channels), message in zip(routed, messages):
+            if not message:
+                continue
+            for channel in channels:
+                grouped[channel].append(message)
+
+        return [{'channel': channel, 'result': messages} for channel, messages in grouped.items()]
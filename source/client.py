@@ -1,19 +1,36 @@
+from startup import StartupTimer, lazy_import, load_parallel
 import os
 import json
 import asyncio
 import discord
-from schedule import Scheduler
 
-from dataclasses import dataclass
 from datetime import datetime, time, timedelta
-from dotenv import load_dotenv
+import metrics
 from pathlib import Path
 from custom_errs import *
 from weekdays import Weekdays
+from changes import ChangeFeed
+from scheduling import QuietHours, SchedulerRunner
+from dispatch import CommandDispatcher
+from admission import AdmissionControl
+from outbound import DirectMessageQueue, SendQueue, scheduled_messages
+from assets import AssetCache
+from snapshotstore import SnapshotStore
+from history import HistoryStore
+from translations import TranslationRegistry
+from subscriptions import SubscriptionRegistry
+from ipc import Publisher, Subscriber
+from refreshworker import RefreshWorker
+from coronafeatureclient import SharedApiHandle
 
 from features.CoronaSpreadFeature import CoronaSpreadFeature
 from CommandIntegrator.logger import logger
-from CommandIntegrator import CommandProcessor, PronounLookupTable, PollCache
+from CommandIntegrator import CommandProcessor, PronounLookupTable
+
+# Imported on first use, when the config is read and the jobs
+# are set up, so that their time is counted in those phases.
+dotenv = lazy_import('dotenv')
+schedule = lazy_import('schedule')
 
 """
 Details:
@@ -28,8 +45,17 @@ Synposis:
     modules. 
 """
 
-pollcache = PollCache(silent_first_call = True)
+REFRESH_METRICS_FILE = 'corona_refresh_metrics.prom'
+
+
 class CoronaBotClient(discord.Client):
+
+    TIMEOUT_RESPONSE = 'Det tog för lång tid att ta fram svaret, försök igen om en stund.'
+    METRICS_FILE = 'corona_metrics.prom'
+    GREETING_FILE = 'greeting.dat'
+    # Commands answered depending on who sends them and where,
+    # see AdmissionControl.
+    PERSONAL_COMMAND_WORDS = ('prenumerera', 'avprenumerera', 'prenumerationer')
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -37,18 +63,54 @@ class CoronaBotClient(discord.Client):
             setattr(self, key, value)
 
         self.loop.create_task(self.run_scheduler())
+        self.loop.create_task(self.run_metrics())
         self._guild = kwargs['DISCORD_GUILD']
-        self._scheduler = Scheduler()
+        self._scheduler = schedule.Scheduler()
+        self._api_handle = None
+        self._dispatcher = CommandDispatcher()
+        self._admission = AdmissionControl(
+            max_in_flight = 2 * self._dispatcher.max_concurrency,
+            personal_words = CoronaBotClient.PERSONAL_COMMAND_WORDS)
+        self._send_queue = SendQueue(self.get_channel)
+        self._dm_queue = DirectMessageQueue()
+        self._assets = AssetCache()
+        self._metrics_server = None
+        self._subscriber = None
+        self._startup_timer = None
                         
     @property
     def scheduler(self):
         return self._scheduler
 
+    @property
+    def dispatcher(self):
+        return self._dispatcher
+
+    @property
+    def admission(self):
+        return self._admission
+
+    @property
+    def send_queue(self):
+        return self._send_queue
+
+    @property
+    def dm_queue(self):
+        return self._dm_queue
+
+    @property
+    def assets(self):
+        return self._assets
+
     @logger
     async def on_ready(self) -> None:
         """
         This method is called as soon as the bot is online.
         """
+        if self.startup_timer:
+            self.startup_timer.mark('gateway')
+            self.startup_timer.publish(metrics.registry)
+            self.startup_timer = None
         for guild_name in client.guilds:
             if guild_name == self._guild:
                 break
@@ -56,47 +118,129 @@ class CoronaBotClient(discord.Client):
     async def on_member_join(self, member: discord.Member) -> None:
         """
         If a new member just joined our server, greet them warmly!
+        The greeting is sent in the background, see DirectMessageQueue.
         """
-        with open('greeting.dat', 'r', encoding = 'utf-8') as f:
-            greeting_phrase = f.read()
-            await member.create_dm()
-            await member.dm_channel.send(greeting_phrase)
+        greeting_phrase = await self.assets.get_async(CoronaBotClient.GREETING_FILE)
+        self.dm_queue.post(member, greeting_phrase)
     
     @logger    
     async def on_message(self, message: discord.Message) -> None: 
         """
         Respond to a message in the channel if someone
         calls on the bot by name, asking for commands.
+        Commands are subject to admission control, see
+        AdmissionControl.
         """
         if message.content.lower().startswith('!') and message.author != client.user:
-            response = processor.process(message).response()
-            if response: await message.channel.send(response)
+            async def answer():
+                try:
+                    return await self.dispatcher.dispatch(
+                        lambda: processor.process(message).response(),
+                        command = CommandDispatcher.command_of(message.content))
+                except asyncio.TimeoutError:
+                    return CoronaBotClient.TIMEOUT_RESPONSE
+
+            with metrics.timed('on_message_seconds'):
+                response = await self.admission.run(
+                    message.author.id, message.channel.id, message.content, answer)
+                if response: await self.send_queue.send(message.channel, response)
 
     @logger
     async def run_scheduler(self) -> None:
         """
-        Loop indefinitely and send messages that are pre-
-        defined on a certain day and a certain time. 
+        Run the scheduled jobs as they fall due, holding
+        them back during the night, and send their results
+        to the channels they are meant for.
         """
 
         await client.wait_until_ready()
-        while not self.is_closed():            
-            result = self.scheduler.run_pending(passthrough = True)
-            if not result or datetime.now().hour >= 22 or datetime.now().hour < 8:
-                await asyncio.sleep(0.1)
-                continue
-            for _, method_return in result.items():
-                if not method_return:
-                    continue
-                if isinstance(method_return, dict):
-                    channel = method_return['channel']
-                    message = method_return['result']
-                    channel = self.get_channel(channel)
-                    await channel.send(message)
-                else:
-                    channel = self.get_channel(self.default_autochannel)
-                    await channel.send(method_return)
-            await asyncio.sleep(0.1)
+        if self.subscriber:
+            # A shard leaves the api and the scheduled jobs to
+            # the refresh worker, and delivers what it publishes.
+            await self.subscriber.run(keep_running = lambda: not self.is_closed())
+            return
+        if self.api_handle:
+            try:
+                await self.api_handle.fetch_async()
+            except Exception:
+                pass
+            self.api_handle.start_background_refresh()
+
+        runner = SchedulerRunner(self.scheduler, quiet_hours = QuietHours(time(22), time(8)))
+        await runner.run(self.send_scheduled_result, keep_running = lambda: not self.is_closed())
+
+    @logger
+    async def run_metrics(self) -> None:
+        """
+        Record the event loop lag and expose the metrics,
+        served over HTTP on METRICS_PORT if it is set in the
+        environment, otherwise written to METRICS_FILE every
+        minute.
+        """
+        self.loop.create_task(metrics.monitor_loop_lag())
+        if getattr(self, 'METRICS_PORT', None):
+            self._metrics_server = await metrics.serve(port = int(self.METRICS_PORT))
+        else:
+            await metrics.dump_periodically(CoronaBotClient.METRICS_FILE)
+
+    async def send_scheduled_result(self, method_return) -> None:
+        """
+        Queue the return value of a scheduled job to be sent
+        in bulk, behind replies to users. See 
+        outbound.scheduled_messages for what jobs may return.
+        """
+        for channel, message in scheduled_messages(method_return, self.default_autochannel):
+            self.send_queue.post(channel, message)
+
+    async def deliver_published(self, event: dict) -> None:
+        """
+        Queue the messages published by the refresh worker
+        for the channels this shard serves. Other channels
+        are served by other shards.
+        """
+        for item in event['messages']:
+            if self.get_channel(item['channel']) is not None:
+                self.send_queue.post(item['channel'], item['message'])
+
+    @logger
+    async def close(self) -> None:
+        """
+        Release the connections held by the api handle, the
+        dispatcher threads and the send queues before the 
+        client shuts down.
+        """
+        if self.api_handle:
+            await self.api_handle.close()
+        if self._metrics_server:
+            self._metrics_server.close()
+        self.dispatcher.shutdown()
+        self.send_queue.close()
+        self.dm_queue.close()
+        await super().close()
+
+    @property
+    def api_handle(self):
+        return self._api_handle
+
+    @api_handle.setter
+    def api_handle(self, value):
+        self._api_handle = value
+
+    @property
+    def startup_timer(self):
+        return self._startup_timer
+
+    @startup_timer.setter
+    def startup_timer(self, value):
+        self._startup_timer = value
+
+    @property
+    def subscriber(self):
+        return self._subscriber
+
+    @subscriber.setter
+    def subscriber(self, value):
+        self._subscriber = value
 
     @property
     def default_autochannel(self):
@@ -119,7 +263,7 @@ def load_environment(env_var_strings: list) -> dict:
         list with all keys to populate with value, the 
         same as in the ones in the .env file
     """
-    load_dotenv()
+    dotenv.load_dotenv()
     var_dict = {}
 
     for var in env_var_strings:
@@ -127,101 +271,176 @@ def load_environment(env_var_strings: list) -> dict:
 
     return var_dict
 
+async def run_refresh_worker(worker: RefreshWorker) -> None:
+    """
+    Run the refresh worker, writing its metrics, the
+    startup_seconds gauge among them, to REFRESH_METRICS_FILE
+    every minute, as the shards do to METRICS_FILE.
+    """
+    dump = asyncio.get_running_loop().create_task(metrics.dump_periodically(REFRESH_METRICS_FILE))
+    try:
+        await worker.run()
+    finally:
+        dump.cancel()
+
 if __name__ == '__main__':
 
+    startup_timer = StartupTimer()
+    startup_timer.mark('imports')
+
     enviromnent_strings = [
         'DISCORD_GUILD',
         'DISCORD_TOKEN',
         'CORONA_API_URI',
         'CORONA_API_RAPIDAPI_HOST',
         'CORONA_API_RAPIDAPI_KEY',
-        'FOLKHALSOMYNDIGHET_RSS'
+        'FOLKHALSOMYNDIGHET_RSS',
+        'METRICS_PORT',
+        'CORONA_DUMP_FILE',
+        'ROLE',
+        'SHARD_ID',
+        'SHARD_COUNT',
+        'CORONA_IPC_SOCKET'
     ]
 
     CommandIntegrator_settings_file = Path('CommandIntegrator') / 'commandintegrator.settings.json'
     corona_translation_file = 'country_eng_swe_translations.json'
+    corona_snapshot_file = 'corona_snapshots.db'
+    corona_history_file = 'corona_history.bin'
+    corona_subscription_file = 'corona_subscriptions.db'
 
-    with open(CommandIntegrator_settings_file, 'r', encoding = 'utf-8') as f:
-        default_responses = json.loads(f.read())['default_responses']
+    def load_default_responses() -> dict:
+        with open(CommandIntegrator_settings_file, 'r', encoding = 'utf-8') as f:
+            return json.loads(f.read())['default_responses']
 
     environment_vars = load_environment(enviromnent_strings)
-        
+    role = environment_vars['ROLE'] or 'all'
+    ipc_socket = environment_vars['CORONA_IPC_SOCKET'] or 'corona_refresh.sock'
+    if role == 'shard':
+        shard_id, shard_count = int(environment_vars['SHARD_ID']), int(environment_vars['SHARD_COUNT'])
+        corona_history_file = f'{corona_history_file}.shard{shard_id}'
+
+    #  --- Load the settings, translations and stores side by side ---
+
+    loaded = load_parallel({
+        'default_responses': load_default_responses,
+        'translations': lambda: TranslationRegistry(corona_translation_file),
+        'subscriptions': lambda: SubscriptionRegistry(corona_subscription_file),
+        'history': lambda: HistoryStore(corona_history_file),
+        'snapshot_store': lambda: None if role == 'shard' else SnapshotStore(corona_snapshot_file)
+    })
+    default_responses = loaded['default_responses']
+    subscriptions = loaded['subscriptions']
+    history = loaded['history']
+    snapshot_store = loaded['snapshot_store']
+    startup_timer.mark('config')
+
     #  --- Instantiate the key backend objects used and the discord client ---
+    #
+    #  In the role 'all' one process does everything. When serving many
+    #  guilds, one process runs in the role 'refresh', calling the api and
+    #  running the scheduled jobs, and publishes the snapshots and messages
+    #  to any number of processes in the role 'shard' over CORONA_IPC_SOCKET.
+
+    def seed_subscriptions(registry: SubscriptionRegistry) -> None:
+        # The channels pushed to before subscriptions could be
+        # made in the chat: Sweden to its own channels, and
+        # every other country to the rest.
+        for metric, sweden_channel, world_channel in (
+                ('cases', 694192847590785094, 694192455062388847),
+                ('deaths', 694192817014308946, 694192280311038023),
+                ('total_recovered', 694192834739175424, 694192447563235448)):
+            registry.add(sweden_channel, metric, 'sweden')
+            registry.add(world_channel, metric)
+            registry.remove(world_channel, metric, 'sweden')
+
+    subscriptions.seed(seed_subscriptions)
+
+    api_handle = SharedApiHandle() if role == 'shard' else None
 
     corona_ft = CoronaSpreadFeature(
                     CORONA_API_URI = environment_vars['CORONA_API_URI'],
                     CORONA_API_RAPIDAPI_HOST = environment_vars['CORONA_API_RAPIDAPI_HOST'],
                     CORONA_API_RAPIDAPI_KEY = environment_vars['CORONA_API_RAPIDAPI_KEY'],
                     FOLKHALSOMYNDIGHET_RSS = environment_vars['FOLKHALSOMYNDIGHET_RSS'],
-                    translation_file_path = corona_translation_file)
+                    CORONA_DUMP_FILE = environment_vars['CORONA_DUMP_FILE'],
+                    translation_file_path = corona_translation_file,
+                    translations = loaded['translations'],
+                    snapshot_store = snapshot_store,
+                    history = history,
+                    api_handle = api_handle,
+                    subscriptions = subscriptions)
 
     processor = CommandProcessor(
         pronoun_lookup_table = PronounLookupTable(), 
         default_responses = default_responses)
     
     processor.features = (corona_ft,)   
-    client = CoronaBotClient(**environment_vars)
-    client.default_autochannel = 687088295079051289
-    pollcache = PollCache(silent_first_call = True)
+    default_autochannel = 687088295079051289
+    startup_timer.mark('feature')
+
+    if role == 'refresh':
+        scheduler = schedule.Scheduler()
+    else:
+        if role == 'shard':
+            client = CoronaBotClient(shard_id = shard_id, shard_count = shard_count, **environment_vars)
+            client.subscriber = Subscriber(ipc_socket, {
+                'snapshot': corona_ft.interface.api_handle.receive,
+                'messages': client.deliver_published
+            })
+        else:
+            client = CoronaBotClient(**environment_vars)
+        client.default_autochannel = default_autochannel
+        client.startup_timer = startup_timer
+        client.api_handle = corona_ft.interface.api_handle
+        scheduler = client.scheduler
+
+        metrics.gauge('send_queue_depth', client.send_queue.depth)
+        metrics.gauge('commands_in_flight', lambda: client.admission.in_flight)
+        for counter in ('admitted', 'deduplicated', 'repeated', 'limited', 'shed', 'replied'):
+            metrics.gauge(f'commands_{counter}', lambda counter = counter: getattr(client.admission.stats, counter))
+        metrics.gauge('dm_queue_depth', client.dm_queue.depth)
+        for counter in ('sent', 'retried', 'failed', 'dropped'):
+            metrics.gauge(f'dm_{counter}', lambda counter = counter: getattr(client.dm_queue.stats, counter))
+        metrics.gauge('response_cache_hit_rate', lambda: corona_ft.response_cache.stats.hit_rate)
+        for counter in ('hits', 'misses', 'stale_serves', 'refresh_errors'):
+            metrics.gauge(f'corona_api_{counter}', lambda counter = counter: getattr(client.api_handle.stats, counter))
+
+    if role != 'shard':
+        change_feed = ChangeFeed(
+            api_handle = corona_ft.interface.api_handle,
+            router = subscriptions,
+            render = corona_ft.change_renderer,
+            store = snapshot_store)
     
 
-    """
-    Add scheduled methods here. If your method needs parameters, 
-    simply add them after the name of the method. here's an example:
-    
-    <<< client.scheduler.every(1).minute.do(add_integers, a = 10, b = 5) >>>
-    """
+        """
+        Add scheduled methods here. If your method needs parameters, 
+        simply add them after the name of the method. here's an example:
+        
+        <<< scheduler.every(1).minute.do(add_integers, a = 10, b = 5) >>>
+        """
 
-    @dataclass
-    class message_mock:
-        content: list
+        scheduler.every().day.at('21:50').do(corona_ft.get_total_deaths, channel = 694193518754660473)
+        scheduler.every().day.at('21:50').do(corona_ft.get_total_recoveries, channel = 694193518754660473)
+        scheduler.every().day.at('21:50').do(corona_ft.get_total_infections, channel = 694193518754660473)
+        
+        scheduler.every(1).minutes.do(corona_ft.get_latest_rss_news, channel = 689199890596626502)
 
-    client.scheduler.every().day.at('21:50').do(corona_ft.get_total_deaths, channel = 694193518754660473)
-    client.scheduler.every().day.at('21:50').do(corona_ft.get_total_recoveries, channel = 694193518754660473)
-    client.scheduler.every().day.at('21:50').do(corona_ft.get_total_infections, channel = 694193518754660473)
-    
-    client.scheduler.every(1).minute.do(
-        pollcache, func = corona_ft.get_cases_by_country, 
-        message = message_mock('sverige'.split(' ')), 
-        channel = 694192847590785094
-    )
-
-    client.scheduler.every(1).minute.do(
-        pollcache, func = corona_ft.get_deaths_by_country, 
-        message = message_mock('sverige'.split(' ')), 
-        channel = 694192817014308946
-    )
-
-
-    client.scheduler.every(1).minute.do(
-        pollcache, func = corona_ft.get_recoveries_by_country, 
-        message = message_mock('sverige'.split(' ')), 
-        channel = 694192834739175424
-    )
-
-    client.scheduler.every(1).minutes.do(
-        pollcache, func = corona_ft.get_latest_rss_news, 
-        channel = 689199890596626502
-    )
-
-    with open(corona_translation_file, 'r', encoding = 'utf-8') as f:
-        for country in json.loads(f.read())['swe_to_eng'].keys():
-            if country == 'sverige': continue
-            client.scheduler.every(1).minutes.do(
-                pollcache, func = corona_ft.get_cases_by_country, 
-                message = message_mock(f'{country}'.split(' ')), 
-                channel = 694192455062388847)
-
-            client.scheduler.every(1).minutes.do(
-                pollcache, func = corona_ft.get_deaths_by_country, 
-                message = message_mock(f'{country}'.split(' ')),
-                channel = 694192280311038023)
-
-            client.scheduler.every(1).minutes.do(
-                pollcache, func = corona_ft.get_recoveries_by_country, 
-                message = message_mock(f'{country}'.split(' ')),
-                channel = 694192447563235448)
+        scheduler.every(1).minutes.do(change_feed.poll)
 
 
     # --- Turn the key and start the bot ---
-client.run(environment_vars['DISCORD_TOKEN'])
\ No newline at end of file
+
+    startup_timer.mark('jobs')
+    if role == 'refresh':
+        startup_timer.publish(metrics.registry)
+        worker = RefreshWorker(
+            api_handle = corona_ft.interface.api_handle,
+            scheduler = scheduler,
+            publisher = Publisher(ipc_socket),
+            default_channel = default_autochannel,
+            quiet_hours = QuietHours(time(22), time(8)))
+        asyncio.run(run_refresh_worker(worker))
+    else:
+        client.run(environment_vars['DISCORD_TOKEN'])
@@ -1,8 +1,21 @@
-import json
-import os
-import requests
-from datetime import datetime, timedelta
-from pathlib import Path
+from __future__ import annotations
+import asyncio
+import random
+import time
+import metrics
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from snapshot import Snapshot, SnapshotBuilder
+from streaming import CHUNK_SIZE, parse_chunks, parse_chunks_async
+from history import HistoryStore
+from translations import TranslationRegistry
+from custom_errs import ApiHandleError
+from providers import check_response
+from startup import lazy_import
+
+# Imported on first use, they are not needed to connect to Discord.
+aiohttp = lazy_import('aiohttp')
+requests = lazy_import('requests')
 
 """
 This module contains the interface class used by the 
@@ -14,6 +27,49 @@ https://rapidapi.com/astsiatsko/api/coronavirus-monitor/
 """
 
 
+@dataclass
+class CacheStats:
+	"""
+	Counters describing how the cache of an ApiHandle
+	has been serving its callers.
+
+	:hits:
+		calls answered by a fresh cached response
+
+	:misses:
+		calls that had to wait for the api
+
+	:stale_serves:
+		calls answered by an expired response, either while
+		a refresh was running or after it failed
+
+	:refreshes:
+		successful requests to the api
+
+	:refresh_errors:
+		failed requests to the api
+
+	:last_refresh_latency:
+		seconds the most recent successful request took
+	"""
+	hits: int = 0
+	misses: int = 0
+	stale_serves: int = 0
+	refreshes: int = 0
+	refresh_errors: int = 0
+	last_refresh_latency: float = None
+	total_refresh_latency: float = 0.0
+
+	@property
+	def mean_refresh_latency(self) -> float:
+		if not self.refreshes:
+			return None
+		return self.total_refresh_latency / self.refreshes
+
+	def as_dict(self) -> dict:
+		return dict(asdict(self), mean_refresh_latency = self.mean_refresh_latency)
+
+
 class ApiHandle:
 	"""
 	Call api and parse output to JSON. Returns cache 
@@ -21,6 +77,12 @@ class ApiHandle:
 	overload the api service. The object calls the api upon
 	instantiation, and will automatically cache the response.
 
+	Should the api fail while there is a cached response, the
+	cached response is served and the api is not called again
+	until a backoff period has passed. The backoff doubles with
+	every consecutive failure up to max_backoff seconds, and is
+	jittered so that several bots do not retry in lockstep.
+
 	:uri:
 		URI for the REST api
 
@@ -35,19 +97,56 @@ class ApiHandle:
 	:_cached_response:
 		last response received by the API
 
+	:_snapshot:
+		Snapshot built from _cached_response, rebuilt only
+		when a new response is received.
+
+	:_timeout:
+		seconds to wait for the api before giving up on a request
+
+	:_failures:
+		number of consecutive failed requests
+
+	:_retry_at:
+		time.monotonic() stamp before which the api is not
+		called again after a failure
+
+	:stats:
+		CacheStats for this handle
+
+	:_listeners:
+		callables invoked with every Snapshot installed, added 
+		with the add_listener method.
+
+	:_store:
+		optional SnapshotStore. The most recent response in it
+		is cached upon construction, and every new response is
+		saved to it.
+
 	:_headers_:
 		dictionary which can be added to with the add_header method.
 		Contains headers which will be used upon a request with the 
 		fetch() call.
 	"""
 
-	def __init__(self, uri: str, standby_hours = 2):
+	def __init__(self, uri: str, standby_hours = 2, timeout = 10, max_backoff = 300, store = None):
 		self.uri: str = uri
 		self.last_api_call: datetime = None
 		self._wait_time = (60 * 60) * standby_hours
-		self._cached_response = None
+		self._timeout = timeout
+		self._max_backoff = max_backoff
 		self._cached_response: dict = None
+		self._snapshot: Snapshot = None
+		self._failures = 0
+		self._retry_at = 0
 		self._headers = {}
+		self.stats = CacheStats()
+		self._listeners = []
+		self._store = store
+		if store is not None:
+			latest = store.latest()
+			if latest is not None:
+				self._install(*latest)
 
 	@property
 	def uri(self) -> str:
@@ -55,7 +154,10 @@ class ApiHandle:
 	
 	@uri.setter
 	def uri(self, uri: str) -> None:
-		if uri.startswith('https'):
+		# Plain http is only accepted from the local machine,
+		# such as the fake api the benchmarks run against. A
+		# handle fetching through a provider has no uri.
+		if uri is None or uri.startswith(('https', 'http://127.0.0.1', 'http://localhost')):
 			self._uri = uri
 		else:
 			raise AttributeError('Got "http", expected "https"')
@@ -72,6 +174,14 @@ class ApiHandle:
 	def last_api_call(self, val: datetime) -> None:
 		self._last_api_call = val
 
+	@property
+	def fetched_at(self) -> datetime:
+		"""
+		Return when the cached response was fetched from the
+		api, None before any response.
+		"""
+		return self._last_api_call
+
 	def add_header(self, key: str, value: str) -> None:
 		"""
 		Allows this object to add HTML headers for the 
@@ -89,6 +199,21 @@ class ApiHandle:
 		"""
 		self._headers[key] = value
 
+	def add_listener(self, callback) -> None:
+		"""
+		Register a callable to be invoked with every new
+		Snapshot this handle installs. Listeners are invoked
+		on the thread receiving the response and should not 
+		block.
+
+		:param callback:
+			callable taking a Snapshot
+		:returns:
+			None
+		"""
+		self._listeners.append(callback)
+
+	@metrics.timed('corona_api_fetch_seconds')
 	def fetch(self) -> dict:
 		"""
 		Call the api and mutate the instance variable _cached_response
@@ -98,19 +223,378 @@ class ApiHandle:
 		:returns:
 			dict
 		"""
-		if self._cached_response:
-			seconds_since_last_call = (datetime.now() - self._last_api_call).seconds
-			if seconds_since_last_call < self._wait_time: 
-				return self._cached_response
+		if not self._is_expired():
+			self.stats.hits += 1
+			return self._cached_response
+		if self._cached_response is not None and self._is_backing_off():
+			self.stats.stale_serves += 1
+			return self._cached_response
+
+		self.stats.misses += 1
+		started = time.monotonic()
+		builder = SnapshotBuilder()
 		try:
-			response = requests.get(self.uri, headers = self._headers).json()
+			# The rows are indexed as the body is received,
+			# rather than once the whole of it has been read.
+			with requests.get(self.uri, headers = self._headers, timeout = self._timeout, stream = True) as r:
+				r.raise_for_status()
+				response = check_response(parse_chunks(r.iter_content(CHUNK_SIZE), on_row = builder.add))
 		except Exception:
-			raise
-		
-		self._cached_response = response
-		self.last_api_call = datetime.now()
+			self._record_failure()
+			if self._cached_response is None:
+				raise
+			self.stats.stale_serves += 1
+			return self._cached_response
+
+		self._record_refresh(started)
+		self._install(response, snapshot = builder.build(response))
 		return response
 
+	def _age(self) -> float:
+		"""
+		Return the age of the cached response in seconds.
+		"""
+		return (datetime.now() - self._last_api_call).total_seconds()
+
+	def _is_expired(self) -> bool:
+		"""
+		Return whether the cached response is missing or
+		older than the defined standby time.
+		"""
+		if not self._cached_response:
+			return True
+		return self._age() >= self._wait_time
+
+	def _is_backing_off(self) -> bool:
+		return time.monotonic() < self._retry_at
+
+	def _record_refresh(self, started: float) -> None:
+		latency = time.monotonic() - started
+		self._failures = 0
+		self._retry_at = 0
+		self.stats.refreshes += 1
+		self.stats.last_refresh_latency = latency
+		self.stats.total_refresh_latency += latency
+		metrics.observe('corona_api_request_seconds', latency)
+
+	def _record_failure(self) -> None:
+		self._failures += 1
+		self.stats.refresh_errors += 1
+		backoff = min(self._max_backoff, self._timeout * 2 ** (self._failures - 1))
+		self._retry_at = time.monotonic() + random.uniform(backoff / 2, backoff)
+
+	def _install(self, response: dict, fetched_at: datetime = None, snapshot: Snapshot = None) -> None:
+		"""
+		Replace the cached response and its snapshot, built
+		from the response unless given. A response without 
+		fetched_at was just received and is saved to the store.
+		"""
+		self._snapshot = Snapshot(response) if snapshot is None else snapshot
+		self._cached_response = response
+		self.last_api_call = fetched_at or datetime.now()
+		if fetched_at is None and self._store is not None:
+			self._save(response, self._last_api_call)
+		for callback in self._listeners:
+			callback(self._snapshot)
+
+	def _save(self, response: dict, fetched_at: datetime) -> None:
+		self._store.save_snapshot(response, fetched_at)
+
+	def fetch_snapshot(self) -> Snapshot:
+		"""
+		Return the Snapshot of the most recent response,
+		refreshing it through fetch() if it has expired.
+
+		:returns:
+			Snapshot
+		"""
+		self.fetch()
+		return self._snapshot
+
+
+class AsyncApiHandle(ApiHandle):
+	"""
+	ApiHandle which calls the api without blocking the event
+	loop, over a pooled aiohttp session with explicit timeouts.
+	Concurrent callers awaiting an expired cache share a single
+	in-flight request instead of firing one each.
+
+	With stale_while_revalidate enabled, callers are never made
+	to wait for the api once a response has been cached. An
+	expired response is served while a refresh runs behind it,
+	and start_background_refresh() keeps refreshing ahead of
+	expiry, at refresh_ahead times the standby time.
+
+	The synchronous fetch() is kept so that Client works with
+	either handle. Called on the event loop thread it never
+	blocks; it returns the cached response and schedules a
+	refresh in the background. Called from another thread it
+	waits for the refresh on the loop.
+
+	:_connection_limit:
+		maximum simultaneous connections in the session pool
+
+	:_inflight:
+		task of the request currently in progress, if any
+
+	:_background:
+		task refreshing the cache ahead of expiry, if started
+
+	:_loop:
+		the event loop the session was created on
+
+	:_provider:
+		optional Provider or ProviderGroup fetching the
+		responses in place of a request to the uri, which
+		may then be None
+	"""
+
+	def __init__(self, uri: str, standby_hours = 2, timeout = 10, max_backoff = 300, store = None,
+				 connection_limit = 4, stale_while_revalidate = False, refresh_ahead = 0.8, provider = None):
+		super().__init__(uri, standby_hours, timeout, max_backoff, store)
+		self._provider = provider
+		self._connection_limit = connection_limit
+		self._stale_while_revalidate = stale_while_revalidate
+		self._refresh_ahead = refresh_ahead
+		self._session: aiohttp.ClientSession = None
+		self._inflight: asyncio.Task = None
+		self._background: asyncio.Task = None
+		self._loop: asyncio.AbstractEventLoop = None
+
+	def _get_session(self) -> aiohttp.ClientSession:
+		if self._session is None or self._session.closed:
+			self._session = aiohttp.ClientSession(
+				headers = self._headers,
+				timeout = aiohttp.ClientTimeout(total = self._timeout),
+				connector = aiohttp.TCPConnector(limit = self._connection_limit))
+		return self._session
+
+	def _save(self, response: dict, fetched_at: datetime) -> None:
+		try:
+			loop = asyncio.get_running_loop()
+		except RuntimeError:
+			super()._save(response, fetched_at)
+			return
+		# Installed on the event loop, the response is written
+		# to the store in a thread rather than blocking the loop.
+		loop.run_in_executor(None, self._store.save_snapshot, response, fetched_at)
+
+	async def _request(self) -> dict:
+		started = time.monotonic()
+		builder = SnapshotBuilder()
+		try:
+			if self._provider is not None:
+				payload = await self._provider.fetch(self._get_session(), on_row = builder.add)
+			else:
+				async with self._get_session().get(self.uri) as response:
+					response.raise_for_status()
+					payload = check_response(await parse_chunks_async(
+						response.content.iter_chunked(CHUNK_SIZE), on_row = builder.add))
+			snapshot = builder.build(payload)
+		except Exception:
+			self._record_failure()
+			raise
+		self._record_refresh(started)
+		self._install(payload, snapshot = snapshot)
+		return payload
+
+	def _refresh(self) -> asyncio.Task:
+		"""
+		Return the task of the in-flight request, starting
+		one if there is none.
+		"""
+		if self._inflight is None or self._inflight.done():
+			self._loop = asyncio.get_running_loop()
+			self._inflight = self._loop.create_task(self._request())
+			self._inflight.add_done_callback(self._retrieve_exception)
+		return self._inflight
+
+	def _refresh_in_background(self) -> None:
+		"""
+		Start a refresh without waiting for it, unless one
+		is already running or the api is being backed off.
+		"""
+		if not self._is_backing_off():
+			self._refresh()
+
+	@staticmethod
+	def _retrieve_exception(task: asyncio.Task) -> None:
+		# Background refreshes may fail without anyone awaiting 
+		# them. The failure is recorded in the stats instead.
+		if not task.cancelled():
+			task.exception()
+
+	@metrics.timed('corona_api_fetch_seconds')
+	async def fetch_async(self) -> dict:
+		"""
+		Return the cached response, or await a refreshed 
+		one if it has expired. See the class documentation
+		for how stale responses are served.
+
+		:returns:
+			dict
+		"""
+		if not self._is_expired():
+			self.stats.hits += 1
+			return self._cached_response
+
+		cached = self._cached_response
+		if cached is not None and (self._stale_while_revalidate or self._is_backing_off()):
+			self.stats.stale_serves += 1
+			self._refresh_in_background()
+			return cached
+
+		self.stats.misses += 1
+		try:
+			return await asyncio.shield(self._refresh())
+		except Exception:
+			if cached is None:
+				raise
+			self.stats.stale_serves += 1
+			return cached
+
+	async def fetch_snapshot_async(self) -> Snapshot:
+		"""
+		Return the Snapshot of the most recent response,
+		awaiting a refresh if it has expired.
+
+		:returns:
+			Snapshot
+		"""
+		await self.fetch_async()
+		return self._snapshot
+
+	def fetch(self) -> dict:
+		"""
+		Synchronous counterpart to fetch_async, see the
+		class documentation. Calls handed on to fetch_async
+		or ApiHandle.fetch are timed there, the others here,
+		so that each is recorded once.
+
+		:returns:
+			dict
+		"""
+		if not self._is_expired():
+			with metrics.timed('corona_api_fetch_seconds', function = 'fetch'):
+				self.stats.hits += 1
+				return self._cached_response
+		try:
+			running_loop = asyncio.get_running_loop()
+		except RuntimeError:
+			running_loop = None
+
+		if self._loop is None or self._loop.is_closed():
+			if running_loop is None:
+				if self._provider is not None:
+					return asyncio.run(self._fetch_once())
+				return super().fetch()
+			self._loop = running_loop
+
+		if running_loop is self._loop:
+			with metrics.timed('corona_api_fetch_seconds', function = 'fetch'):
+				if self._cached_response is None:
+					self._refresh_in_background()
+					raise ApiHandleError('No data has been received from the api yet')
+				self.stats.stale_serves += 1
+				self._refresh_in_background()
+				return self._cached_response
+
+		future = asyncio.run_coroutine_threadsafe(self.fetch_async(), self._loop)
+		return future.result(timeout = self._timeout)
+
+	async def _fetch_once(self) -> dict:
+		# The session is bound to the loop it was created on,
+		# so a fetch on a loop of its own closes it afterwards.
+		try:
+			return await self.fetch_async()
+		finally:
+			if self._session is not None:
+				await self._session.close()
+
+	def _seconds_until_refresh(self) -> float:
+		if self._is_backing_off():
+			return self._retry_at - time.monotonic()
+		if self._cached_response is None:
+			return 0
+		return max(0, self._wait_time * self._refresh_ahead - self._age())
+
+	async def _refresh_periodically(self) -> None:
+		while True:
+			await asyncio.sleep(self._seconds_until_refresh())
+			try:
+				await asyncio.shield(self._refresh())
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				pass
+
+	def start_background_refresh(self) -> asyncio.Task:
+		"""
+		Start refreshing the cache ahead of its expiry on
+		the running event loop, backing off on failures.
+
+		:returns:
+			asyncio.Task
+		"""
+		if self._background is None or self._background.done():
+			self._loop = asyncio.get_running_loop()
+			self._background = self._loop.create_task(self._refresh_periodically())
+		return self._background
+
+	async def close(self) -> None:
+		"""
+		Stop refreshing and close the underlying session 
+		and its connections.
+		"""
+		if self._background is not None:
+			self._background.cancel()
+		if self._provider is not None:
+			await self._provider.close()
+		if self._session is not None:
+			await self._session.close()
+
+
+class SharedApiHandle(ApiHandle):
+	"""
+	ApiHandle of a shard process, which never calls the api
+	itself. The responses are received from the refresh worker
+	through receive(), as 'snapshot' events published over ipc,
+	and are served for as long as no newer one is received.
+	"""
+
+	def __init__(self):
+		super().__init__(uri = None)
+
+	def receive(self, event: dict) -> None:
+		"""
+		Install the response of a 'snapshot' event.
+
+		:param event:
+			dict with the keys 'response' and 'fetched_at',
+			the latter in ISO 8601 format
+		"""
+		self.stats.refreshes += 1
+		self._install(event['response'], datetime.fromisoformat(event['fetched_at']))
+
+	def fetch(self) -> dict:
+		if self._cached_response is None:
+			self.stats.misses += 1
+			raise ApiHandleError('No data has been received from the refresh worker yet')
+		self.stats.hits += 1
+		return self._cached_response
+
+	async def fetch_async(self) -> dict:
+		return self.fetch()
+
+	async def fetch_snapshot_async(self) -> Snapshot:
+		return self.fetch_snapshot()
+
+	def start_background_refresh(self) -> None:
+		pass
+
+	async def close(self) -> None:
+		pass
+
 
 class Client:
 	"""
@@ -121,9 +605,16 @@ class Client:
 	recoveries based upon method call.
 	"""
 
-	def __init__(self, api_handle: ApiHandle, translation_file_path: str):
+	def __init__(self, api_handle: ApiHandle, translation_file_path: str, history: HistoryStore = None,
+				 translations: TranslationRegistry = None):
 		self.api_handle = api_handle
 		self.translation_file_path = translation_file_path
+		if translations is None:
+			translations = TranslationRegistry(translation_file_path)
+		self.translations = translations
+		self.history = history
+		if history is not None:
+			api_handle.add_listener(history.append)
 
 	def _translate(self, country: str, from_language: str) -> str:
 		"""
@@ -137,16 +628,7 @@ class Client:
 		:returns:
 			string
 		"""
-		country = country.lower()
-		try:
-			with open(self.translation_file_path, 'r', encoding = 'utf-8') as f:
-				translation = json.loads(f.read())
-		except Exception as e:
-			raise Exception(f'Could not load translation file. {e}')
-		
-		if from_language == 'swedish':
-			return translation['swe_to_eng'][country]
-		return translation['eng_to_swe'][country]
+		return self.translations.translate(country, from_language)
 
 	def get_raw_data(self):
 		"""
@@ -156,37 +638,70 @@ class Client:
 		return self.api_handle.fetch()
 
 	def get_total_recoveries(self) -> int:
-		data = self.api_handle.fetch()['countries_stat']
-		return sum([int(i['total_recovered'].replace(',','')) for i in data if i['total_recovered'] != 'N/A'])
+		return self.api_handle.fetch_snapshot().total('total_recovered')
 
 	def get_total_infections(self) -> int:
-		data = self.api_handle.fetch()['countries_stat']
-		return sum([int(i['cases'].replace(',','')) for i in data if i['total_recovered'] != 'N/A'])
+		return self.api_handle.fetch_snapshot().total('cases')
 
-	def get_total_deaths(self, sort_by_highest = True) -> str:
-		data = self.api_handle.fetch()['countries_stat']
-		return sum([int(i['deaths'].replace(',','')) for i in data if i['total_recovered'] != 'N/A'])
+	def get_total_deaths(self) -> int:
+		return self.api_handle.fetch_snapshot().total('deaths')
+
+	def _get_ranked(self, column: str, sort_by_highest: bool) -> str:
+		"""
+		Return the translated name and value of the country
+		ranking first or last in given column.
+		:param column:
+			string, column in the snapshot to rank by
+		:param sort_by_highest:
+			bool, rank by highest or lowest value
+		:returns:
+			string
+		"""
+		snapshot = self.api_handle.fetch_snapshot()
+		if sort_by_highest:
+			stat = snapshot.highest(column)
+		else:
+			stat = snapshot.lowest(column)
+		translated_country = self._translate(stat.name, 'english')
+		return f"{translated_country}: {stat.raw[column]}"
 
 	def get_recoveries(self, sort_by_highest = True) -> str:
-		sorter = lambda i: int(i['total_recovered'].replace(',',''))
-		data = self.api_handle.fetch()['countries_stat']
-		data.sort(key = sorter, reverse = sort_by_highest)
-		translated_country = self._translate(data[0]['country_name'], 'english')
-		return f"{translated_country}: {data[0]['total_recovered']}"
+		return self._get_ranked('total_recovered', sort_by_highest)
 
 	def get_infections(self, sort_by_highest = True) -> str:
-		sorter = lambda i: int(i['cases'].replace(',',''))
-		data = self.api_handle.fetch()['countries_stat']
-		data.sort(key = sorter, reverse = sort_by_highest)
-		translated_country = self._translate(data[0]['country_name'], 'english')
-		return f"{translated_country}: {data[0]['cases']}"
+		return self._get_ranked('cases', sort_by_highest)
 
 	def get_deaths(self, sort_by_highest = True) -> str:
-		sorter = lambda i: int(i['deaths'].replace(',',''))
-		data = self.api_handle.fetch()['countries_stat']
-		data.sort(key = sorter, reverse = sort_by_highest)
-		translated_country = self._translate(data[0]['country_name'], 'english')
-		return f"{translated_country}: {data[0]['deaths']}"	
+		return self._get_ranked('deaths', sort_by_highest)
+
+	def get_top(self, column: str, k = 10, sort_by_highest = True) -> list:
+		"""
+		Get the k countries ranking highest or lowest in a 
+		column. Countries without a translation keep their
+		name from the api.
+		:param column:
+			string, column in the snapshot to rank by
+		:param k:
+			int, number of countries
+		:param sort_by_highest:
+			bool, rank by highest or lowest value
+		:returns:
+			list of tuples, (translated country, value)
+		"""
+		snapshot = self.api_handle.fetch_snapshot()
+		if sort_by_highest:
+			stats = snapshot.top(column, k)
+		else:
+			stats = snapshot.bottom(column, k)
+
+		top = []
+		for stat in stats:
+			try:
+				country = self._translate(stat.name, 'english')
+			except KeyError:
+				country = stat.name
+			top.append((country, getattr(stat, column)))
+		return top
 
 	def get_by_query(self, query: str, country_name: str) -> str:
 		"""
@@ -201,12 +716,11 @@ class Client:
 		:returns:
 			string
 		"""
-
-		data = self.api_handle.fetch()['countries_stat']
-		for country in data:
-			if country['country_name'].lower() == self._translate(country_name, 'swedish'):
-				return country[query]
-		raise KeyError(f'No such key: {country_name}')
+		snapshot = self.api_handle.fetch_snapshot()
+		try:
+			return snapshot[self._translate(country_name, 'swedish')].raw[query]
+		except KeyError:
+			raise KeyError(f'No such key: {country_name}')
 
 	def get_data_timestamp(self) -> str:
 		"""
@@ -216,4 +730,31 @@ class Client:
 		:returns:
 			string, datetime
 		"""
-		return self.api_handle.fetch()['statistic_taken_at']
\ No newline at end of file
+		return self.api_handle.fetch_snapshot().taken_at
+
+	def get_trend(self, query: str, country_name: str, days = 7) -> dict:
+		"""
+		Get how a value developed in a country over the last
+		days, according to the history.
+		:param query:
+			string, 'cases', 'deaths' or 'total_recovered'
+		:param country_name:
+			string, Swedish name of the country
+		:param days:
+			int, number of days to look back
+		:returns:
+			dictionary with the keys 'increase', 'daily_average'
+			and 'doubling_time', each None if the history does
+			not reach back far enough.
+		"""
+		if self.history is None:
+			raise ApiHandleError('No history is kept')
+		try:
+			country = self._translate(country_name, 'swedish')
+			return {
+				'increase': self.history.increase(country, query, days),
+				'daily_average': self.history.average_increase(country, query, days),
+				'doubling_time': self.history.doubling_time(country, query, days)
+			}
+		except KeyError:
+			raise KeyError(f'No such key: {country_name}')
\ No newline at end of file
@@ -0,0 +1,188 @@
+import sys
+from array import array
+from itertools import compress, repeat
+
+"""
+Details:
+    2020-04-20
+
+Module details:
+    Columnar storage of the countries in an api response.
+
+Synposis:
+    The api returns every country as a dictionary of strings
+    such as '1,234' and 'N/A'. Kept as Python objects, one
+    integer or float object per country and column, every
+    snapshot costs many times the size of the numbers in it.
+    A CountryTable holds each column in a typed array, 8 bytes
+    per country, with a mask telling which values are missing,
+    and the countries in an index of row numbers. Columns are
+    parsed in one go: the strings of a column are joined, the
+    thousand separators are removed from the joined string with
+    a single replace, and the result is split and converted
+    by the array constructor. Two tables are compared in the
+    same manner, block by block, so that finding the few values
+    that changed between two snapshots does not take a Python
+    comparison per country.
+"""
+
+
+_SEPARATOR = '\n'
+
+# Turns a mask of missing values into one of present values.
+_INVERT = bytes([1, 0]) + bytes(254)
+
+
+def _text(value) -> str:
+    if isinstance(value, str):
+        return value.replace(_SEPARATOR, ' ')
+    return '' if value is None else str(value)
+
+
+def parse_column(values, typecode = 'q') -> tuple:
+    """
+    Parse the values of one column formatted like '12,345'
+    into an array. Values that are missing or not numeric,
+    such as 'N/A' or '', are stored as 0 and marked in the
+    mask.
+    :param values:
+        sequence of strings, numbers or None
+    :param typecode:
+        'q' for integer counts, 'd' for rates
+    :returns:
+        tuple of the array and a bytearray holding 1 for
+        every missing value
+    """
+    if not values:
+        return array(typecode), bytearray()
+    convert = int if typecode == 'q' else float
+    try:
+        parts = _SEPARATOR.join(values).replace(',', '').split(_SEPARATOR)
+    except TypeError:
+        parts = None
+    if parts is None or len(parts) != len(values):
+        # Values which are not strings, or hold the separator.
+        parts = _SEPARATOR.join(map(_text, values)).replace(',', '').split(_SEPARATOR)
+    try:
+        return array(typecode, map(convert, parts)), bytearray(len(parts))
+    except (ValueError, OverflowError):
+        pass
+
+    column = array(typecode, bytes(len(parts) * array(typecode).itemsize))
+    missing = bytearray(len(parts))
+    for i, part in enumerate(parts):
+        try:
+            column[i] = convert(part)
+        except (ValueError, OverflowError):
+            missing[i] = 1
+    return column, missing
+
+
+class CountryTable:
+    """
+    The numeric columns of the countries in a response, one
+    row per country in the order of the response.
+
+    :keys:
+        tuple of the normalized country names, one per row
+
+    :names:
+        tuple of the country names as given by the api
+
+    :index:
+        dict mapping normalized country names to rows
+
+    :columns:
+        dict mapping column names to arrays
+
+    :missing:
+        dict mapping column names to a bytearray holding 1
+        for every row whose value is missing
+    """
+
+    __slots__ = ('keys', 'names', 'index', 'columns', 'missing')
+
+    def __init__(self, keys: tuple, names: tuple, rows: list, count_columns: tuple, rate_columns: tuple = ()):
+        self.keys = keys
+        self.names = names
+        self.index = {key: i for i, key in enumerate(keys)}
+        self.columns = {}
+        self.missing = {}
+        for typecode, columns in (('q', count_columns), ('d', rate_columns)):
+            for column in columns:
+                self.columns[column], self.missing[column] = parse_column(
+                    [row.get(column) for row in rows], typecode)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def value(self, row: int, column: str):
+        """
+        Return the value of a column in a row, None if
+        it is missing.
+        """
+        if self.missing[column][row]:
+            return None
+        return self.columns[column][row]
+
+    def present(self, column: str):
+        """
+        Return (key, value) pairs of the values of a column
+        which are not missing, in row order.
+        """
+        missing = self.missing[column]
+        if not any(missing):
+            return zip(self.keys, self.columns[column])
+        present = missing.translate(_INVERT)
+        return zip(compress(self.keys, present), compress(self.columns[column], present))
+
+    def align(self, previous: 'CountryTable'):
+        """
+        Return the row in a previous table of every row in
+        this one, countries missing there mapped to the row
+        after its last, or None if both tables hold the same
+        countries in the same order.
+        """
+        if previous.keys == self.keys:
+            return None
+        return array('q', map(previous.index.get, self.keys, repeat(len(previous))))
+
+    def changed_rows(self, previous: 'CountryTable', column: str, positions = None, block = 256) -> list:
+        """
+        Return the rows whose value in a column differs from
+        that of the same country in a previous table, or which
+        are missing in one of them but not in the other.
+        Countries not in the previous table are counted as
+        missing there.
+        :param positions:
+            the alignment of the tables, as returned by align
+        """
+        values, missing = self.columns[column], self.missing[column]
+        old_values, old_missing = previous.columns[column], previous.missing[column]
+        if positions is not None:
+            old_values = old_values + array(old_values.typecode, (0,))
+            old_missing = old_missing + b'\x01'
+            old_values = array(old_values.typecode, map(old_values.__getitem__, positions))
+            old_missing = bytearray(map(old_missing.__getitem__, positions))
+        if values == old_values and missing == old_missing:
+            return []
+
+        rows = []
+        for start in range(0, len(values), block):
+            end = start + block
+            if values[start:end] == old_values[start:end] and missing[start:end] == old_missing[start:end]:
+                continue
+            rows.extend(row for row in range(start, min(end, len(values)))
+                        if values[row] != old_values[row] or missing[row] != old_missing[row])
+        return rows
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes held by the table, its index included.
+        """
+        size = sum(sys.getsizeof(i) for i in self.columns.values())
+        size += sum(sys.getsizeof(i) for i in self.missing.values())
+        size += sys.getsizeof(self.index) + sys.getsizeof(self.keys) + sys.getsizeof(self.names)
+        size += sum(sys.getsizeof(i) for i in self.keys) + sum(sys.getsizeof(i) for i in self.names)
+        return size
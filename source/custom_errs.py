@@ -34,4 +34,7 @@ class AccessViolation(Exception):
     pass
 
 class ScrapingError(Exception):
+    pass
+
+class ApiHandleError(Exception):
     pass
\ No newline at end of file
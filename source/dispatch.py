@@ -0,0 +1,126 @@
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+"""
+Details:
+    2020-04-06
+
+Module details:
+    Dispatch of feature callbacks off the event loop.
+
+Synposis:
+    The features answering chat commands are synchronous and
+    do blocking work such as http requests and file reads.
+    Running them on the event loop stalls every other handler
+    and the gateway heartbeat, so they are dispatched to a
+    bounded pool of worker threads instead. Callbacks that are
+    coroutine functions, or that return an awaitable, are run
+    directly on the loop. Every dispatch is subject to a timeout
+    and to a limit on how many commands run at once, which is
+    the number of threads. A blocking callback which timed out
+    cannot be stopped and keeps its thread until it returns,
+    so it also keeps its slot until then: further commands wait
+    for a free thread within their own timeout, rather than
+    being queued behind abandoned work without limit.
+"""
+
+
+class CommandDispatcher:
+    """
+    Run callbacks in a thread pool from the event loop.
+
+    :max_workers:
+        number of worker threads, and the maximum number of
+        commands in progress at once. Further commands wait
+        for a slot.
+
+    :timeout:
+        seconds a command may take, waiting for a slot
+        included, before asyncio.TimeoutError is raised,
+        unless overridden in timeouts
+
+    :timeouts:
+        dictionary mapping a command, the first word of the
+        message without its prefix, to its own timeout
+    """
+
+    def __init__(self, max_workers = 8, timeout = 10, timeouts: dict = None):
+        self.executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'dispatch')
+        self.max_concurrency = max_workers
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self._semaphore: asyncio.Semaphore = None
+
+    @staticmethod
+    def command_of(content: str, prefix = '!') -> str:
+        """
+        Return the command in a message, being its first word
+        without the prefix, in lower case.
+        :param content:
+            string, the message
+        :param prefix:
+            string the command is prefixed with
+        :returns:
+            string
+        """
+        words = content.split(maxsplit = 1)
+        if not words:
+            return ''
+        return words[0][len(prefix):].lower() if words[0].startswith(prefix) else words[0].lower()
+
+    def timeout_for(self, command: str) -> float:
+        return self.timeouts.get(command, self.timeout)
+
+    async def _run(self, func, *args, **kwargs):
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        if inspect.isawaitable(result):
+            return await result
+        return result
+
+    def _finished(self, task: asyncio.Future) -> None:
+        self._semaphore.release()
+        # Retrieved, as nobody awaits a command which timed out.
+        if not task.cancelled():
+            task.exception()
+
+    async def dispatch(self, func, *args, command: str = None, **kwargs):
+        """
+        Run func with given arguments and return its result.
+        :param func:
+            callable or coroutine function
+        :param command:
+            string, the command being run, selecting its timeout
+        :returns:
+            the return value of func
+        :raises:
+            asyncio.TimeoutError if func did not return in time
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout_for(command)
+        await asyncio.wait_for(self._semaphore.acquire(), self.timeout_for(command))
+        task = asyncio.ensure_future(self._run(func, *args, **kwargs))
+        # The slot is released when the callback returns, not
+        # when the caller stops waiting for it.
+        task.add_done_callback(self._finished)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            if asyncio.iscoroutinefunction(func):
+                # Callbacks on the loop can be stopped, unlike
+                # those in a thread.
+                task.cancel()
+            raise
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker threads once their current work
+        is done.
+        """
+        self.executor.shutdown(wait = False)
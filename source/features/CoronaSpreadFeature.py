@@ -1,18 +1,60 @@
+from __future__ import annotations
 import os
-import re
-import discord
 import CommandIntegrator as ci
-import fake_useragent
 import coronafeatureclient as coronafeatureclient
-import feedparser
+from rssfeed import RssPoller, strip_html
+from providers import FileProvider, ProviderGroup, RapidApiProvider
+from intents import IntentMatcher
+from rendering import ChangeRenderer, new_word
+from responsecache import ResponseCache, memoized_response
+from snapshot import normalize_country_name
+from subscriptions import ALL_COUNTRIES
+import metrics
 from CommandIntegrator.enumerators import CommandPronoun
 from CommandIntegrator.logger import logger
+from startup import lazy_import
+
+# Only used in annotations, see startup.
+discord = lazy_import('discord')
 
 
 class CoronaSpreadFeatureCommandParser(ci.FeatureCommandParserBase):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.matcher = IntentMatcher()
+
+    def compile(self) -> None:
+        """
+        Compile the callbacks into an IntentMatcher. Call 
+        this whenever the callbacks have been changed.
+        """
+        self.matcher = IntentMatcher.compile(self.callbacks)
+
+    def get_callback(self, message: discord.Message):
+        """
+        Return the callback for a message, in time proportional
+        to the length of the message rather than the number of
+        registered phrases. Overrides the phrase by phrase scan
+        of FeatureCommandParserBase.
+        :param message:
+            original message from Discord
+        :returns:
+            callable or None
+        """
+        return self.matcher.match(
+            i.strip(ci.FeatureCommandParserBase.IGNORED_CHARS).lower() for i in message.content)
+
+def country_words(message: discord.Message) -> tuple:
+    """
+    Return the last two words of a message, where the
+    country is named, normalized for use as a cache key.
+    """
+    return tuple(i.strip(ci.FeatureCommandParserBase.IGNORED_CHARS).lower() for i in message.content[-2:])
+
+def message_words(message: discord.Message) -> tuple:
+    return tuple(i.strip(ci.FeatureCommandParserBase.IGNORED_CHARS).lower() for i in message.content)
+
 
 class CoronaSpreadFeature(ci.FeatureBase):
 
@@ -21,9 +63,37 @@ class CoronaSpreadFeature(ci.FeatureBase):
         'totalt',
         'många',
         'corona',
-        'coronafall'
+        'coronafall',
+        'ökning',
+        'ökat',
+        'fördubblas',
+        'fördubblingstid',
+        'topp',
+        'prenumerera',
+        'avprenumerera',
+        'prenumerationer'
     )
 
+    TOP_METRICS = (
+        (('döda', 'dödsfall', 'dött', 'omkomna', 'omkommit'), 'deaths', 'deaths_per_1m_population'),
+        (('smittade', 'smittats', 'sjuka', 'fall'), 'cases', 'total_cases_per_1m_population'),
+        (('friska', 'tillfrisknat', 'tillfrisknade'), 'total_recovered', None)
+    )
+
+    PER_CAPITA_WORDS = ('capita', 'miljon', 'invånare', 'befolkning')
+
+    METRIC_NAMES = {'cases': 'smittade', 'deaths': 'döda', 'total_recovered': 'tillfrisknade'}
+
+    ALL_COUNTRIES_WORDS = ('alla', 'allt', 'världen', 'länder')
+
+    SUBSCRIPTION_FILLER_WORDS = ('i', 'på', 'för', 'om', 'till')
+
+    COUNTRY_TEMPLATES = {
+        'cases': 'Totalt {value} har smittats av COVID-19 i {country}',
+        'total_recovered': 'Totalt {value} har tillfrisknat från COVID-19 i {country}',
+        'deaths': 'Totalt {value} har dött i COVID-19 i {country}'
+    }
+
     def __init__(self, *args, **kwargs):
         
         data_timestamp_1 = {'när': ('uppdaterad', 'uppdaterades', 'statistik', 'statistiken')}
@@ -50,13 +120,26 @@ class CoronaSpreadFeature(ci.FeatureBase):
         recoveries_by_query = {'har': ('friska', 'tillfrisknat')}
         new_cases_by_query = {'hur': ('nya', 'nytt', 'fall')}    
 
+        weekly_increase_1 = {'ökning': ('veckan', 'vecka')}
+        weekly_increase_2 = {'ökat': ('veckan', 'vecka')}
+        doubling_time = {'fördubblas': ('smittade', 'smittan', 'fall')}
+        top_countries = {'topp': tuple(word for words, *_ in CoronaSpreadFeature.TOP_METRICS for word in words)}
+        subscribe = {'prenumerera': top_countries['topp'] + CoronaSpreadFeature.ALL_COUNTRIES_WORDS}
+        unsubscribe = {'avprenumerera': subscribe['prenumerera']}
+
         self.command_parser = CoronaSpreadFeatureCommandParser()
         self.command_parser.keywords = CoronaSpreadFeature.FEATURE_KEYWORDS
         self.command_parser.interactive_methods = (
             self.get_cases_by_country,
             self.get_recoveries_by_country,
             self.get_deaths_by_country,
-            self.get_new_cases_by_country
+            self.get_new_cases_by_country,
+            self.get_weekly_increase_by_country,
+            self.get_doubling_time_by_country,
+            self.get_top_countries,
+            self.subscribe,
+            self.unsubscribe,
+            self.get_subscriptions
         )
         
         self.command_parser.callbacks = {
@@ -77,6 +160,16 @@ class CoronaSpreadFeature(ci.FeatureBase):
             str(deaths_by_query_2): self.get_deaths_by_country,
             str(recoveries_by_query): self.get_recoveries_by_country,
             str(new_cases_by_query): self.get_new_cases_by_country,
+            str(weekly_increase_1): self.get_weekly_increase_by_country,
+            str(weekly_increase_2): self.get_weekly_increase_by_country,
+            str(doubling_time): self.get_doubling_time_by_country,
+            'fördubblingstid': self.get_doubling_time_by_country,
+            str(top_countries): self.get_top_countries,
+            str(subscribe): self.subscribe,
+            str(unsubscribe): self.unsubscribe,
+            'prenumerera': self.subscribe,
+            'avprenumerera': self.unsubscribe,
+            'prenumerationer': self.get_subscriptions,
             'smittade': self.get_cases_by_country,
             'sjuka': self.get_cases_by_country,
             'dött': self.get_deaths_by_country,
@@ -85,70 +178,115 @@ class CoronaSpreadFeature(ci.FeatureBase):
             'tillfrisknat': self.get_recoveries_by_country,
             'tillfrisknade': self.get_recoveries_by_country
         }
+        self.command_parser.compile()
 
         self.translation_file_path = kwargs['translation_file_path']
         self.rss_uri = kwargs['FOLKHALSOMYNDIGHET_RSS']
+        self.rss_poller = RssPoller(self.rss_uri)
         self.mapped_pronouns = (CommandPronoun.INTERROGATIVE,)
+        self.response_cache = ResponseCache(max_size = 512)
+        self.change_renderer = ChangeRenderer(CoronaSpreadFeature.COUNTRY_TEMPLATES, self._change_country_name)
+        self.subscriptions = kwargs.get('subscriptions')
 
-        api_handle = coronafeatureclient.ApiHandle(uri = kwargs['CORONA_API_URI'], standby_hours = 0.25)
-        api_handle.add_header('x-rapidapi-host', kwargs['CORONA_API_RAPIDAPI_HOST'])
-        api_handle.add_header('x-rapidapi-key', kwargs['CORONA_API_RAPIDAPI_KEY'])
+        # A shard process is handed a handle fed by the refresh
+        # worker, rather than calling the api itself.
+        api_handle = kwargs.get('api_handle')
+        if api_handle is None:
+            providers = [RapidApiProvider(
+                uri = kwargs['CORONA_API_URI'],
+                host = kwargs['CORONA_API_RAPIDAPI_HOST'],
+                key = kwargs['CORONA_API_RAPIDAPI_KEY'])]
+            if kwargs.get('CORONA_DUMP_FILE'):
+                providers.append(FileProvider(kwargs['CORONA_DUMP_FILE']))
+
+            api_handle = coronafeatureclient.AsyncApiHandle(
+                uri = None, 
+                standby_hours = 0.25, 
+                timeout = 10,
+                store = kwargs.get('snapshot_store'),
+                stale_while_revalidate = True,
+                provider = ProviderGroup(providers))
 
         super().__init__(
             command_parser = self.command_parser,
-            interface = coronafeatureclient.Client(api_handle, self.translation_file_path)
+            interface = coronafeatureclient.Client(
+                api_handle, self.translation_file_path, history = kwargs.get('history'),
+                translations = kwargs.get('translations'))
         )
+        # Registered after the history, so that trends are never
+        # cached from a history lagging behind the snapshot.
+        api_handle.add_listener(self.response_cache.invalidate)
 
     @logger
     @ci.scheduledmethod
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_total_deaths(self):
         response = self.interface.get_total_deaths()
         return f'Totalt har {response} omkommit globalt'
     
     @logger
     @ci.scheduledmethod
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_total_recoveries(self):
         response = self.interface.get_total_recoveries()
         return f'Totalt har {response} tillfrisknat globalt'
     
     @logger
     @ci.scheduledmethod
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_total_infections(self):
         response = self.interface.get_total_infections()
         return f'Totalt har {response} insjuknat globalt'
     
     @logger
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_most_deaths(self):
         response = self.interface.get_deaths()
         return f'Flest har omkommit i {response}'
     
     @logger
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_most_recoveries(self):
         response = self.interface.get_recoveries()
         return f'Flest har tillfrisknat i {response}'
     
     @logger
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_most_infections(self):
         response = self.interface.get_infections()
         return f'Flest har smittats i {response}'
     
     @logger
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_least_infections(self):
         response = self.interface.get_infections(sort_by_highest = False)
         return f'Minst antal insjuknade har {response}'
     
     @logger
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_least_deaths(self):
         response = self.interface.get_deaths(sort_by_highest = False)
         return f'Minst antal dödsfall har {response}'
    
     @logger
+    @metrics.timed('feature_method_seconds')
+    @memoized_response()
     def get_least_recoveries(self):
         response = self.interface.get_recoveries(sort_by_highest = False)
         return f'Minst tillfrisknade: {response}'
 
     @logger
     @ci.scheduledmethod
+    @metrics.timed('feature_method_seconds')
+    @memoized_response(key = country_words)
     def get_new_cases_by_country(self, message: discord.Message) -> str:
         """
         Get new cases by country. New cases are defined by API.
@@ -160,18 +298,15 @@ class CoronaSpreadFeature(ci.FeatureBase):
         try:
             country = message.content[-1].strip(ci.FeatureCommandParserBase.IGNORED_CHARS)
             response = self.interface.get_by_query(query = 'new_cases', country_name = country)
-            
-            if int(response.replace(',','').strip()) > 1: 
-                new = 'nya'
-            else:
-                new = 'nytt'
-
+            new = new_word(int(response.replace(',','').strip()))
             return f' {response} {new} fall av COVID-19 i {country.capitalize()}'
         except Exception as e:
             pass
 
     @logger
     @ci.scheduledmethod
+    @metrics.timed('feature_method_seconds')
+    @memoized_response(key = country_words)
     def get_cases_by_country(self, message: discord.Message) -> str:
         """
         Get cases by country.
@@ -192,11 +327,13 @@ class CoronaSpreadFeature(ci.FeatureBase):
             return f'Jag förstod inte.. landet du frågar om behöver vara sist i din mening: {e}'
         except Exception as e:
             return
-        return f'Totalt {response} har smittats av COVID-19 i {country.capitalize()}'    
+        return CoronaSpreadFeature.COUNTRY_TEMPLATES['cases'].format(value = response, country = country.capitalize())    
 
 
     @logger
     @ci.scheduledmethod
+    @metrics.timed('feature_method_seconds')
+    @memoized_response(key = country_words)
     def get_recoveries_by_country(self, message: discord.Message) -> str:
         """
         Get recoveries by country.
@@ -217,10 +354,12 @@ class CoronaSpreadFeature(ci.FeatureBase):
             return f'Jag förstod inte.. landet du frågar om behöver vara sist i din mening: {e}'
         except Exception as e:
             return
-        return f'Totalt {response} har tillfrisknat från COVID-19 i {country.capitalize()}' 
+        return CoronaSpreadFeature.COUNTRY_TEMPLATES['total_recovered'].format(value = response, country = country.capitalize()) 
 
     @logger
     @ci.scheduledmethod
+    @metrics.timed('feature_method_seconds')
+    @memoized_response(key = country_words)
     def get_deaths_by_country(self, message: discord.Message) -> str:
         """
         Get deaths by country.
@@ -241,25 +380,246 @@ class CoronaSpreadFeature(ci.FeatureBase):
             return f'Jag förstod inte.. landet du frågar om behöver vara sist i din mening: {e}'
         except Exception as e:
             return
-        return f'Totalt {response} har dött i COVID-19 i {country.capitalize()}' 
+        return CoronaSpreadFeature.COUNTRY_TEMPLATES['deaths'].format(value = response, country = country.capitalize()) 
+
+    def _query_country(self, message: discord.Message, query) -> tuple:
+        """
+        Call query with the country named last in a message, 
+        trying the last word first and the last two words if
+        no country goes by the last word.
+        :param message:
+            original message from Discord
+        :param query:
+            callable taking the Swedish name of a country
+        :returns:
+            tuple, the country and the return value of query
+        """
+        country = message.content[-1].strip(ci.FeatureCommandParserBase.IGNORED_CHARS)
+        try:
+            return country, query(country)
+        except KeyError:
+            country = f'{message.content[-2]} {message.content[-1]}'.strip(ci.FeatureCommandParserBase.IGNORED_CHARS)
+            return country, query(country)
 
     @logger
-    @ci.scheduledmethod
-    def get_latest_rss_news(self) -> str:
+    @metrics.timed('feature_method_seconds')
+    @memoized_response(key = country_words)
+    def get_weekly_increase_by_country(self, message: discord.Message) -> str:
+        """
+        Get how much the number of cases in a country
+        increased over the last week.
+        :param message:
+            original message from Discord
+        :returns:
+            str
+        """
+        try:
+            country, trend = self._query_country(message, lambda i: self.interface.get_trend('cases', i))
+        except KeyError as e:
+            return f'Jag förstod inte.. landet du frågar om behöver vara sist i din mening: {e}'
+        if trend['increase'] is None:
+            return f'Det finns inte tillräckligt med historik för {country.capitalize()} ännu'
+        return (f'Antalet smittade i {country.capitalize()} har ökat med {trend["increase"]} '
+                f'senaste veckan, i snitt {round(trend["daily_average"])} per dag')
+
+    @logger
+    @metrics.timed('feature_method_seconds')
+    @memoized_response(key = country_words)
+    def get_doubling_time_by_country(self, message: discord.Message) -> str:
+        """
+        Get how many days it takes for the number of cases
+        in a country to double, at the rate of the last week.
+        :param message:
+            original message from Discord
+        :returns:
+            str
+        """
+        try:
+            country, trend = self._query_country(message, lambda i: self.interface.get_trend('cases', i))
+        except KeyError as e:
+            return f'Jag förstod inte.. landet du frågar om behöver vara sist i din mening: {e}'
+        if trend['doubling_time'] is None:
+            return f'Antalet smittade i {country.capitalize()} har inte ökat senaste veckan, eller så saknas historik'
+        days = f'{trend["doubling_time"]:.1f}'.replace('.', ',')
+        return f'I den takt som gällt senaste veckan fördubblas antalet smittade i {country.capitalize()} på {days} dagar'
+
+    @logger
+    @metrics.timed('feature_method_seconds')
+    @memoized_response(key = message_words)
+    def get_top_countries(self, message: discord.Message) -> str:
+        """
+        Get the countries with the most or least deaths,
+        cases or recoveries, optionally per million 
+        inhabitants, as in 'topp 10 länder med flest döda'.
+        :param message:
+            original message from Discord
+        :returns:
+            str
+        """
+        words = message_words(message)
+        per_capita = any(i in CoronaSpreadFeature.PER_CAPITA_WORDS for i in words)
+        for metric_words, column, per_capita_column in CoronaSpreadFeature.TOP_METRICS:
+            if any(i in metric_words for i in words):
+                break
+        else:
+            return
+        if per_capita and per_capita_column:
+            column = per_capita_column
+
+        k = next((int(i) for i in words if i.isdigit()), 10)
+        k = min(max(k, 1), 25)
+        sort_by_highest = 'minst' not in words
+        top = self.interface.get_top(column, k, sort_by_highest)
+
+        lines = []
+        for place, (country, value) in enumerate(top, start = 1):
+            value = f'{value:,}' if isinstance(value, int) else f'{value:g}'
+            lines.append(f'{place}. {country.capitalize()}: {value}')
+        return os.linesep.join(lines)
+
+    def _parse_subscription(self, message: discord.Message) -> tuple:
+        """
+        Return the metrics and the country named in a message
+        such as 'prenumerera döda i sverige'. Without a metric
+        every metric with a template is returned, without a
+        country ALL_COUNTRIES.
+        :raises:
+            KeyError if the country cannot be translated
+        """
+        words = message_words(message)[1:]
+        metric_words = {word: column for words, column, _ in CoronaSpreadFeature.TOP_METRICS for word in words}
+        columns = tuple(dict.fromkeys(metric_words[i] for i in words if i in metric_words))
+        country = ' '.join(i for i in words if i not in metric_words
+                           and i not in CoronaSpreadFeature.SUBSCRIPTION_FILLER_WORDS
+                           and i not in CoronaSpreadFeature.ALL_COUNTRIES_WORDS)
+        if country:
+            country = normalize_country_name(self.interface.translations.translate(country, 'swedish'))
+        return columns or tuple(CoronaSpreadFeature.COUNTRY_TEMPLATES), country or ALL_COUNTRIES
+
+    def _country_name(self, country: str) -> str:
+        if country == ALL_COUNTRIES:
+            return 'alla länder'
+        try:
+            return self.interface.translations.translate(country, 'english').capitalize()
+        except KeyError:
+            return country.capitalize()
+
+    def _change_subscription(self, message: discord.Message, subscribe: bool) -> str:
+        if self.subscriptions is None:
+            return 'Prenumerationer är inte tillgängliga'
+        try:
+            may_manage = message.channel.permissions_for(message.author).manage_channels
+        except AttributeError:
+            may_manage = False
+        if not may_manage:
+            return 'Du behöver rätt att hantera kanaler för att ändra kanalens prenumerationer'
+        try:
+            columns, country = self._parse_subscription(message)
+        except KeyError as e:
+            return f'Jag förstod inte vilket land du menar: {e}'
+
+        names = ', '.join(CoronaSpreadFeature.METRIC_NAMES.get(i, i) for i in columns)
+        if subscribe:
+            guild = getattr(message.guild, 'id', None)
+            for metric in columns:
+                self.subscriptions.add(message.channel.id, metric, country, guild = guild)
+            return f'Kanalen prenumererar nu på {names} i {self._country_name(country)}'
+        changed = [self.subscriptions.remove(message.channel.id, metric, country) for metric in columns]
+        if not any(changed):
+            return f'Kanalen prenumererade inte på {names} i {self._country_name(country)}'
+        return f'Kanalen prenumererar inte längre på {names} i {self._country_name(country)}'
+
+    @logger
+    @metrics.timed('feature_method_seconds')
+    def subscribe(self, message: discord.Message) -> str:
+        """
+        Subscribe the channel of a message to the changes
+        of a metric in a country, as in 'prenumerera döda
+        sverige'. Requires the permission to manage channels.
+        :param message:
+            original message from Discord
+        :returns:
+            str
+        """
+        return self._change_subscription(message, subscribe = True)
+
+    @logger
+    @metrics.timed('feature_method_seconds')
+    def unsubscribe(self, message: discord.Message) -> str:
+        """
+        Unsubscribe the channel of a message, the opposite 
+        of subscribe.
+        :param message:
+            original message from Discord
+        :returns:
+            str
         """
-        Get the latest entries from RSS, based upon 
-        the URL given at instantiation. Returns the
-        object which is the latest RSS entry in an
-        easily read format with attached link.
+        return self._change_subscription(message, subscribe = False)
+
+    @logger
+    @metrics.timed('feature_method_seconds')
+    def get_subscriptions(self, message: discord.Message) -> str:
+        """
+        List the subscriptions of the channel of a message.
+        :param message:
+            original message from Discord
         :returns:
             str
         """
-        newsfeed = feedparser.parse(self.rss_uri)
-        if not len(newsfeed.entries):
+        if self.subscriptions is None:
+            return 'Prenumerationer är inte tillgängliga'
+        countries, exceptions = {}, {}
+        for country, metric, excluded in self.subscriptions.for_channel(message.channel.id):
+            target = exceptions if excluded else countries
+            target.setdefault(metric, []).append(self._country_name(country))
+        if not countries:
+            return 'Kanalen har inga prenumerationer'
+        lines = []
+        for metric, names in countries.items():
+            line = f'{CoronaSpreadFeature.METRIC_NAMES.get(metric, metric).capitalize()}: {", ".join(names)}'
+            if metric in exceptions:
+                line += f' utom {", ".join(exceptions[metric])}'
+            lines.append(line)
+        return os.linesep.join(lines)
+
+    def _change_country_name(self, country: str) -> str:
+        try:
+            return self.interface.translations.translate(country, 'english').capitalize()
+        except KeyError:
+            return None
+
+    def render_change(self, change, snapshot) -> str:
+        """
+        Render the message pushed when a value changes for
+        a country. Changes for metrics without a template or 
+        for countries that cannot be translated are skipped.
+        The ChangeFeed renders all changes of a poll at once
+        through change_renderer instead.
+        :param change:
+            changes.Change
+        :param snapshot:
+            the Snapshot the change was detected in
+        :returns:
+            str or None
+        """
+        return self.change_renderer(change, snapshot)
+
+    @logger
+    @ci.scheduledmethod
+    @metrics.timed('feature_method_seconds')
+    def get_latest_rss_news(self) -> list:
+        """
+        Get the entries published in the RSS feed since
+        it was last polled, based upon the URL given at 
+        instantiation. Returns the entries in an easily 
+        read format with attached link, oldest first.
+        :returns:
+            list of str
+        """
+        entries = self.rss_poller.poll()
+        if not entries:
             return
 
-        latest = newsfeed.entries[0]
-        clean = re.compile('<.*?>')
-        cleantext = re.sub(clean, '', latest.summary)
         lead = ':green_circle: **Nyhet från Folkhälsomyndigheten**'
-        return f'{lead}{os.linesep * 2}{latest.title}{os.linesep}{cleantext}{os.linesep}{latest.link}'
\ No newline at end of file
+        return [f'{lead}{os.linesep * 2}{entry.title}{os.linesep}{strip_html(entry.summary)}{os.linesep}{entry.link}'
+                for entry in entries]
\ No newline at end of file
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import math
+import os
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from snapshot import Snapshot
+
+"""
+Details:
+    2020-04-10
+
+Module details:
+    Time series history of the api snapshots.
+
+Synposis:
+    The api only tells the current totals. To answer how
+    numbers develop over time, every distinct snapshot is
+    appended to a history held in compact integer arrays,
+    one row per country and snapshot. The rows are kept
+    per country in time order as parallel arrays of
+    timestamps and values, so that a query is a binary
+    search and a slice rather than a scan over Python
+    objects. The history is persisted to an append-only
+    binary file of fixed width records. Appended on the event
+    loop, as by a listener on the api handle, the records are
+    written in a thread of their own rather than blocking the
+    loop, one write after the other so they stay in time order.
+"""
+
+
+MISSING = -1
+
+
+class HistoryStore:
+    """
+    Append-only history of country statistics.
+
+    :path:
+        path of the record file, or None to keep the history
+        in memory only. The country names are kept next to it
+        in a file with the suffix '.countries.json'.
+
+    Records are the columns in RECORD, stored as signed 64 bit
+    integers. Missing values are stored as MISSING.
+    """
+
+    METRICS = ('cases', 'deaths', 'total_recovered')
+    RECORD = ('timestamp', 'country') + METRICS
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._countries = []
+        self._country_index = {}
+        self._series = []
+        self._last_timestamp = None
+        self._writer: ThreadPoolExecutor = None
+        if path is not None:
+            self._load()
+
+    @property
+    def _countries_path(self) -> str:
+        return f'{self.path}.countries.json'
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self._countries_path, 'r', encoding = 'utf-8') as f:
+            for country in json.loads(f.read()):
+                self._add_country(country)
+        records = array('q')
+        with open(self.path, 'rb') as f:
+            records.frombytes(f.read())
+        width = len(HistoryStore.RECORD)
+        for i in range(0, len(records) - len(records) % width, width):
+            self._append_row(records[i:i + width])
+
+    def _add_country(self, country: str) -> int:
+        index = self._country_index.get(country)
+        if index is None:
+            index = len(self._countries)
+            self._countries.append(country)
+            self._country_index[country] = index
+            self._series.append(tuple(array('q') for _ in range(len(HistoryStore.RECORD) - 1)))
+        return index
+
+    def _append_row(self, row) -> None:
+        timestamp, country, *values = row
+        series = self._series[country]
+        series[0].append(timestamp)
+        for column, value in zip(series[1:], values):
+            column.append(value)
+        self._last_timestamp = timestamp
+
+    def append(self, snapshot: Snapshot, taken_at: datetime = None) -> bool:
+        """
+        Append a snapshot to the history, unless it was taken
+        at or before the most recent snapshot in the history.
+        :param snapshot:
+            Snapshot
+        :param taken_at:
+            datetime, when the statistics were taken. Defaults
+            to the 'statistic_taken_at' value of the snapshot,
+            or the current time if it has none.
+        :returns:
+            bool, whether the snapshot was appended
+        """
+        if taken_at is None:
+            try:
+                taken_at = datetime.strptime(snapshot.taken_at, '%Y-%m-%d %H:%M:%S')
+            except (TypeError, ValueError):
+                taken_at = datetime.now()
+        timestamp = int(taken_at.timestamp())
+        if self._last_timestamp is not None and timestamp <= self._last_timestamp:
+            return False
+
+        countries_before = len(self._countries)
+        records = array('q')
+        for country, stat in snapshot.items():
+            row = [timestamp, self._add_country(country)]
+            for metric in HistoryStore.METRICS:
+                value = getattr(stat, metric)
+                row.append(MISSING if value is None else value)
+            records.extend(row)
+            self._append_row(row)
+
+        if self.path is not None:
+            countries = list(self._countries) if len(self._countries) != countries_before else None
+            self._persist(records, countries)
+        return True
+
+    def _write(self, records: array, countries: list) -> None:
+        if countries is not None:
+            with open(self._countries_path, 'w', encoding = 'utf-8') as f:
+                f.write(json.dumps(countries))
+        with open(self.path, 'ab') as f:
+            records.tofile(f)
+
+    def _persist(self, records: array, countries: list) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None and self._writer is None:
+            self._write(records, countries)
+            return
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'history')
+        if loop is None:
+            # Behind the writes already queued.
+            self._writer.submit(self._write, records, countries).result()
+        else:
+            loop.run_in_executor(self._writer, self._write, records, countries)
+
+    def close(self) -> None:
+        """
+        Wait for the records appended on the event loop to be
+        written.
+        """
+        if self._writer is not None:
+            self._writer.shutdown()
+            self._writer = None
+
+    def series(self, country: str, metric: str) -> tuple:
+        """
+        Return the timestamps and values recorded for a country,
+        as arrays in time order.
+        :param country:
+            string, normalized English country name
+        :param metric:
+            string, one of METRICS
+        :returns:
+            tuple (array, array)
+        :raises:
+            KeyError if the country has no history
+        """
+        series = self._series[self._country_index[country]]
+        return series[0], series[1 + HistoryStore.METRICS.index(metric)]
+
+    def value_at(self, country: str, metric: str, moment: datetime) -> int:
+        """
+        Return the most recent value recorded at or before
+        moment, or None if there is none.
+        """
+        timestamps, values = self.series(country, metric)
+        i = bisect_right(timestamps, int(moment.timestamp()))
+        while i > 0:
+            i -= 1
+            if values[i] != MISSING:
+                return values[i]
+        return None
+
+    def latest(self, country: str, metric: str) -> int:
+        timestamps, _ = self.series(country, metric)
+        if not timestamps:
+            return None
+        return self.value_at(country, metric, datetime.fromtimestamp(timestamps[-1]))
+
+    def increase(self, country: str, metric: str, days = 7) -> int:
+        """
+        Return how much a value increased over the last days,
+        counted back from the most recent record. None if the
+        history does not reach back that far.
+        :param country:
+            string, normalized English country name
+        :param metric:
+            string, one of METRICS
+        :param days:
+            int
+        :returns:
+            int or None
+        """
+        timestamps, _ = self.series(country, metric)
+        if not timestamps:
+            return None
+        end = datetime.fromtimestamp(timestamps[-1])
+        start = end - timedelta(days = days)
+        if timestamps[0] > start.timestamp():
+            return None
+        current = self.value_at(country, metric, end)
+        previous = self.value_at(country, metric, start)
+        if current is None or previous is None:
+            return None
+        return current - previous
+
+    def daily_increases(self, country: str, metric: str, days = 7) -> list:
+        """
+        Return the increase per day over the last days, oldest
+        first. Days the history does not cover are left out.
+        :returns:
+            list of int
+        """
+        timestamps, _ = self.series(country, metric)
+        if not timestamps:
+            return []
+        end = datetime.fromtimestamp(timestamps[-1])
+        values = [self.value_at(country, metric, end - timedelta(days = i)) for i in range(days, -1, -1)]
+        return [b - a for a, b in zip(values, values[1:]) if a is not None and b is not None]
+
+    def average_increase(self, country: str, metric: str, days = 7) -> float:
+        """
+        Return the average increase per day over the last days,
+        a single average over the whole period.
+        :returns:
+            float or None
+        """
+        increase = self.increase(country, metric, days)
+        if increase is None:
+            return None
+        return increase / days
+
+    def doubling_time(self, country: str, metric: str = 'cases', days = 7) -> float:
+        """
+        Return the number of days it takes for a value to
+        double at the growth rate of the last days. None if
+        the value did not grow or history is lacking.
+        :returns:
+            float or None
+        """
+        increase = self.increase(country, metric, days)
+        current = self.latest(country, metric)
+        if not increase or current is None or increase <= 0 or current <= increase:
+            return None
+        return days * math.log(2) / math.log(current / (current - increase))
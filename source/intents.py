@@ -0,0 +1,116 @@
+import ast
+from collections import defaultdict
+
+"""
+Details:
+    2020-04-12
+
+Module details:
+    Compiled matching of messages against feature callbacks.
+
+Synposis:
+    Features register their callbacks keyed either by a single
+    word, or by the string form of a dictionary mapping a word
+    to a tuple of words, like "{'totalt': ('dött', 'döda')}",
+    meaning that the message must hold the key word and one of
+    the words in the tuple. Rather than testing every registered
+    phrase against every message, the phrases are compiled once
+    into an inverted index from word to the callbacks it takes
+    part in, stored as bit masks. Matching a message is then a
+    few dictionary lookups per word in the message, however many
+    phrases are registered.
+"""
+
+
+class IntentMatcher:
+    """
+    Inverted index over the trigger words of callbacks.
+    Messages are read word by word, as FeatureCommandParserBase
+    does, and the first word which is a single word trigger,
+    or the key word of a dictionary whose qualifiers occur in
+    the message, selects the callback. At the same word,
+    callbacks keyed by a dictionary take precedence over
+    callbacks keyed by a single word, and otherwise the
+    callback registered first wins.
+    """
+
+    def __init__(self):
+        self._callbacks = []
+        self._compound = 0
+        self._keywords = defaultdict(int)
+        self._qualifiers = defaultdict(int)
+        self._words = defaultdict(int)
+
+    @staticmethod
+    def parse_trigger(trigger):
+        """
+        Return the trigger of a callback as a dictionary or a
+        single word. Dictionaries in string form are parsed.
+        :param trigger:
+            dict, or string holding a word or a dictionary
+        :returns:
+            dict or string
+        """
+        if isinstance(trigger, str) and trigger.startswith('{'):
+            return ast.literal_eval(trigger)
+        return trigger
+
+    def add(self, trigger, callback) -> None:
+        """
+        Register a callback.
+        :param trigger:
+            dict, or string holding a word or a dictionary
+        :param callback:
+            the callable to return upon a match
+        """
+        trigger = IntentMatcher.parse_trigger(trigger)
+        if isinstance(trigger, dict):
+            # Every key word gets its own bit, tied to its
+            # own qualifiers, and all of them to the callback.
+            for keyword, qualifiers in trigger.items():
+                bit = 1 << len(self._callbacks)
+                self._callbacks.append(callback)
+                self._compound |= bit
+                self._keywords[keyword.lower()] |= bit
+                for qualifier in qualifiers:
+                    self._qualifiers[qualifier.lower()] |= bit
+        else:
+            bit = 1 << len(self._callbacks)
+            self._callbacks.append(callback)
+            self._words[trigger.lower()] |= bit
+
+    @classmethod
+    def compile(cls, callbacks: dict) -> 'IntentMatcher':
+        """
+        Build a matcher from a callbacks dictionary as set on
+        a FeatureCommandParserBase.
+        :param callbacks:
+            dict mapping triggers to callables
+        :returns:
+            IntentMatcher
+        """
+        matcher = cls()
+        for trigger, callback in callbacks.items():
+            matcher.add(trigger, callback)
+        return matcher
+
+    def match(self, words):
+        """
+        Return the callback matching a message, or None.
+        :param words:
+            iterable of the words in the message, lower case
+            and stripped of punctuation
+        :returns:
+            callable or None
+        """
+        words = list(words)
+        qualifiers = 0
+        for word in words:
+            qualifiers |= self._qualifiers.get(word, 0)
+        qualifiers &= self._compound
+
+        for word in words:
+            matched = self._keywords.get(word, 0) & qualifiers or self._words.get(word, 0)
+            if matched:
+                return self._callbacks[(matched & -matched).bit_length() - 1]
+        return None
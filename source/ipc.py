@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+
+"""
+Details:
+    2020-04-17
+
+Module details:
+    Publishing of events from the refresh worker to the
+    Discord shard processes.
+
+Synposis:
+    When the bot serves many guilds it runs as several shard
+    processes, and one refresh worker fetching the statistics
+    and running the scheduled jobs for all of them, so that the
+    api is called as often however many guilds there are. The
+    worker publishes events, such as new snapshots and messages
+    to send, over a Unix socket as newline delimited JSON.
+    Every event is serialized once, whatever the number of
+    subscribers. Retained events, like the latest snapshot, are
+    replayed to a subscriber as soon as it connects.
+"""
+
+
+def encode(event: dict) -> bytes:
+    return (json.dumps(event, separators = (',', ':')) + '\n').encode('utf-8')
+
+
+class Publisher:
+    """
+    Unix socket server publishing events to every connected
+    subscriber. Subscribers falling more than max_buffer bytes
+    behind are disconnected, and catch up on the retained
+    events when they reconnect.
+
+    :path:
+        path of the Unix socket
+
+    :max_buffer:
+        bytes allowed to queue up for a subscriber
+    """
+
+    def __init__(self, path: str, max_buffer = 64 * 2 ** 20):
+        self.path = path
+        self.max_buffer = max_buffer
+        self._writers = set()
+        self._retained = {}
+        self._server = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._writers)
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._connected, self.path)
+
+    async def _connected(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        for line in self._retained.values():
+            writer.write(line)
+        self._writers.add(writer)
+        try:
+            # Subscribers do not send anything, reading only
+            # tells when they disconnect.
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def publish(self, event: dict, retain = False) -> None:
+        """
+        Send an event to every subscriber.
+        :param event:
+            dict holding the key 'type', serializable to JSON
+        :param retain:
+            bool, whether to replay the event to subscribers
+            connecting later, until another event of the same
+            type is retained
+        """
+        line = encode(event)
+        if retain:
+            self._retained[event['type']] = line
+        for writer in list(self._writers):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self._writers.discard(writer)
+                writer.close()
+                continue
+            writer.write(line)
+
+    async def close(self) -> None:
+        for writer in list(self._writers):
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Subscriber:
+    """
+    Connect to a Publisher and hand every event to the
+    handler of its type. Reconnects with a growing delay
+    whenever the connection is lost or cannot be made.
+
+    :handlers:
+        dict mapping event types to callables taking the
+        event, either functions or coroutine functions
+
+    :max_backoff:
+        longest delay between attempts to connect, in seconds
+    """
+
+    def __init__(self, path: str, handlers: dict, max_backoff = 30, limit = 256 * 2 ** 20):
+        self.path = path
+        self.handlers = handlers
+        self.max_backoff = max_backoff
+        self.limit = limit
+        self.connected = False
+
+    async def _dispatch(self, event: dict) -> None:
+        handler = self.handlers.get(event.get('type'))
+        if handler is None:
+            return
+        try:
+            result = handler(event)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            asyncio.get_running_loop().call_exception_handler({
+                'message': f'Could not handle {event.get("type")} event',
+                'exception': e
+            })
+
+    async def run(self, keep_running = lambda: True) -> None:
+        """
+        Receive events until keep_running returns False.
+        """
+        backoff = 0.5
+        while keep_running():
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit = self.limit)
+            except OSError:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 0.5
+            self.connected = True
+            try:
+                async for line in reader:
+                    await self._dispatch(json.loads(line))
+            except (ConnectionError, ValueError):
+                pass
+            finally:
+                self.connected = False
+                writer.close()
+            await asyncio.sleep(backoff)
@@ -0,0 +1,266 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+
+"""
+Details:
+    2020-04-14
+
+Module details:
+    Latency metrics for the handlers of the bot.
+
+Synposis:
+    A slow reply may come from the api, the translation file,
+    the RSS feed, Discord or a blocked event loop. The time
+    spent in each of them is recorded in histograms, labelled
+    per handler, and exposed in the Prometheus text format,
+    either served over HTTP on a local port or written to a
+    file at an interval. Recording a value costs a binary
+    search and a few additions under a lock, so the handlers
+    can be timed on every call.
+"""
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets.
+
+    :buckets:
+        tuple of the upper bounds of the buckets, ascending.
+        Values above the last bound are only counted in the
+        implicit +Inf bucket.
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        Return (upper bound, count of values at or below it)
+        pairs, ending with the +Inf bucket.
+        """
+        pairs, total = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class Timer:
+    """
+    Time a block of code, or every call of a function, into
+    a histogram. Used as a decorator the name of the function
+    is added as the label 'function'. Coroutine functions are
+    timed until they return.
+    """
+
+    def __init__(self, registry, name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self._started, **self.labels)
+        return False
+
+    def __call__(self, func):
+        registry, name = self.registry, self.name
+        labels = dict(self.labels, function = func.__name__)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    registry.observe(name, time.perf_counter() - started, **labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+
+
+class MetricsRegistry:
+    """
+    Thread safe collection of histograms and gauges, keyed
+    by name and labels.
+    """
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Record a value, in seconds, in the histogram of a name
+        and set of labels.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def timed(self, name: str, **labels) -> Timer:
+        """
+        Return a Timer recording into the histogram of a name,
+        for use in a with statement or as a decorator.
+        """
+        return Timer(self, name, labels)
+
+    def gauge(self, name: str, func, **labels) -> None:
+        """
+        Register a gauge, read by calling func every time the
+        metrics are rendered.
+        :param func:
+            callable returning a number
+        """
+        with self._lock:
+            self._gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = func
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """
+        Return the histogram of a name and set of labels,
+        or None if nothing has been observed for it.
+        """
+        return self._histograms.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def render(self) -> str:
+        """
+        Return every metric in the Prometheus text format.
+        """
+        lines = []
+        with self._lock:
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(histograms.items()):
+                    for bound, count in histogram.cumulative():
+                        bucket_labels = labels + (('le', _format_bound(bound)),)
+                        lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+            gauges = sorted((name, sorted(funcs.items())) for name, funcs in self._gauges.items())
+
+        for name, funcs in gauges:
+            lines.append(f'# TYPE {name} gauge')
+            for labels, func in funcs:
+                try:
+                    value = func()
+                except Exception:
+                    continue
+                if value is not None:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str) -> None:
+        """
+        Write the rendered metrics to a file, replacing it at
+        once so that readers never see a partial file.
+        """
+        with open(f'{path}.tmp', 'w', encoding = 'utf-8') as f:
+            f.write(self.render())
+        os.replace(f'{path}.tmp', path)
+
+
+registry = MetricsRegistry()
+
+
+def observe(name: str, value: float, **labels) -> None:
+    registry.observe(name, value, **labels)
+
+
+def timed(name: str, **labels) -> Timer:
+    return registry.timed(name, **labels)
+
+
+def gauge(name: str, func, **labels) -> None:
+    registry.gauge(name, func, **labels)
+
+
+async def monitor_loop_lag(interval = 0.5, registry = registry) -> None:
+    """
+    Record how late the event loop wakes up from a sleep,
+    telling how long it was blocked, as event_loop_lag_seconds.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        registry.observe('event_loop_lag_seconds', max(0.0, loop.time() - expected))
+
+
+async def dump_periodically(path: str, interval = 60, registry = registry) -> None:
+    """
+    Write the metrics to a file every interval seconds.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        await loop.run_in_executor(None, registry.dump, path)
+
+
+async def serve(host = '127.0.0.1', port = 9100, registry = registry) -> asyncio.AbstractServer:
+    """
+    Serve the metrics over HTTP, answering every request
+    with the rendered metrics.
+    :returns:
+        the asyncio server, already serving
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while (await reader.readline()).strip():
+                pass
+            body = registry.render().encode('utf-8')
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                         b'Connection: close\r\n\r\n' + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
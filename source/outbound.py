@@ -0,0 +1,421 @@
+import asyncio
+import itertools
+import metrics
+import time
+from dataclasses import asdict, dataclass
+from enum import IntEnum
+from ratelimit import TokenBucket
+
+"""
+Details:
+    2020-04-07
+
+Module details:
+    Outbound message queue for Discord channels.
+
+Synposis:
+    When many numbers change at once the bot has a lot to
+    say in a few channels, and sending one message per change
+    runs into the rate limits of Discord. Messages are instead
+    queued per channel. Pending bulk messages are merged into
+    as few messages as the length limit allows, each channel
+    is paced by a token bucket matching the rate limit of
+    Discord, and replies to users are sent ahead of bulk
+    pushes. Direct messages, such as the greeting of new
+    members, are sent by a few background workers with
+    retries, so that a wave of joins neither stalls the
+    handling of messages nor the greetings themselves.
+"""
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BULK = 1
+
+
+def split_message(message: str, max_length: int) -> list:
+    """
+    Split a message into parts no longer than max_length,
+    on line breaks where possible.
+    :param message:
+        string
+    :param max_length:
+        int
+    :returns:
+        list of strings
+    """
+    parts = []
+    while len(message) > max_length:
+        cut = message.rfind('\n', 0, max_length + 1)
+        if cut <= 0:
+            cut = max_length
+        parts.append(message[:cut])
+        message = message[cut:].lstrip('\n')
+    if message:
+        parts.append(message)
+    return parts
+
+
+def scheduled_messages(method_return, default_channel) -> list:
+    """
+    Return the messages in the return value of a scheduled
+    job as (channel, message) pairs. Jobs may return a message
+    for the default channel, a dictionary with the keys
+    'channel' and 'result', or a list of such dictionaries.
+    'result' may hold a list of messages. Empty messages
+    are left out.
+    """
+    if isinstance(method_return, dict):
+        method_return = [method_return]
+    elif not isinstance(method_return, list):
+        method_return = [{'channel': default_channel, 'result': method_return}]
+    pairs = []
+    for item in method_return:
+        messages = item['result']
+        if not isinstance(messages, list):
+            messages = [messages]
+        pairs.extend((item['channel'], message) for message in messages if message)
+    return pairs
+
+
+@dataclass
+class SendStats:
+    """
+    Counters for a SendQueue.
+
+    :queued:
+        messages put in the queue
+
+    :sent:
+        messages sent to Discord, several queued messages
+        merged into one count as one
+
+    :delivered:
+        queued messages that have been sent
+
+    :failed:
+        messages which could not be sent
+
+    :max_latency:
+        the longest time in seconds a message spent queued
+    """
+    queued: int = 0
+    sent: int = 0
+    delivered: int = 0
+    failed: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        if not self.delivered:
+            return None
+        return self.total_latency / self.delivered
+
+    def as_dict(self) -> dict:
+        return dict(asdict(self), mean_latency = self.mean_latency)
+
+
+class _QueuedMessage:
+
+    __slots__ = ('priority', 'order', 'text', 'queued_at', 'future')
+
+    def __init__(self, priority: Priority, order: int, text: str, future: asyncio.Future = None):
+        self.priority = priority
+        self.order = order
+        self.text = text
+        self.queued_at = time.monotonic()
+        self.future = future
+
+
+class _ChannelQueue:
+
+    def __init__(self, channel, rate: float, burst: int):
+        self.channel = channel
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        self.bucket = TokenBucket(rate, burst)
+        self.worker: asyncio.Task = None
+
+
+class SendQueue:
+    """
+    Queue messages per channel and send them in the
+    background.
+
+    :resolve_channel:
+        callable returning the channel object for a channel
+        id, such as discord.Client.get_channel
+
+    :max_length:
+        the maximum length of a message accepted by Discord
+
+    :rate:
+        messages per second sent to one channel over time
+
+    :burst:
+        messages sent to one channel at once before pacing
+        sets in
+    """
+
+    def __init__(self, resolve_channel, max_length = 2000, rate = 1.0, burst = 5):
+        self.resolve_channel = resolve_channel
+        self.max_length = max_length
+        self.rate = rate
+        self.burst = burst
+        self.stats = SendStats()
+        self._queues = {}
+        self._order = itertools.count()
+
+    def _queue_for(self, channel) -> _ChannelQueue:
+        channel_id = getattr(channel, 'id', channel)
+        queue = self._queues.get(channel_id)
+        if queue is None:
+            if not hasattr(channel, 'send'):
+                channel = self.resolve_channel(channel)
+                if channel is None:
+                    return None
+            queue = _ChannelQueue(channel, self.rate, self.burst)
+            self._queues[channel_id] = queue
+        if queue.worker is None or queue.worker.done():
+            queue.worker = asyncio.get_running_loop().create_task(self._work(queue))
+        return queue
+
+    def _put(self, channel, message: str, priority: Priority, future: asyncio.Future = None) -> bool:
+        queue = self._queue_for(channel)
+        if queue is None:
+            return False
+        parts = split_message(message, self.max_length)
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            queue.pending.append(_QueuedMessage(priority, next(self._order), part, future if last else None))
+        self.stats.queued += len(parts)
+        queue.wakeup.set()
+        return True
+
+    def post(self, channel, message: str, priority = Priority.BULK) -> None:
+        """
+        Queue a message without waiting for it to be sent.
+        :param channel:
+            channel object or channel id
+        :param message:
+            string
+        :param priority:
+            Priority
+        """
+        if message:
+            self._put(channel, message, priority)
+
+    async def send(self, channel, message: str, priority = Priority.INTERACTIVE) -> None:
+        """
+        Queue a message and wait until it has been sent.
+        :param channel:
+            channel object or channel id
+        :param message:
+            string
+        :param priority:
+            Priority
+        """
+        if not message:
+            return
+        future = asyncio.get_running_loop().create_future()
+        if self._put(channel, message, priority, future):
+            await future
+
+    def _take_batch(self, queue: _ChannelQueue) -> list:
+        """
+        Take the next message to send off the queue, with
+        any bulk messages that fit into the same message.
+        """
+        queue.pending.sort(key = lambda i: (i.priority, i.order))
+        batch = [queue.pending.pop(0)]
+        if batch[0].priority == Priority.INTERACTIVE:
+            return batch
+        length = len(batch[0].text)
+        while queue.pending and length + 1 + len(queue.pending[0].text) <= self.max_length:
+            length += 1 + len(queue.pending[0].text)
+            batch.append(queue.pending.pop(0))
+        return batch
+
+    async def _work(self, queue: _ChannelQueue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await queue.wakeup.wait()
+            queue.wakeup.clear()
+            while queue.pending:
+                await queue.bucket.acquire()
+                batch = self._take_batch(queue)
+                try:
+                    with metrics.timed('discord_send_seconds'):
+                        await queue.channel.send('\n'.join(i.text for i in batch))
+                except Exception as e:
+                    self.stats.failed += len(batch)
+                    for i in batch:
+                        if i.future is not None and not i.future.done():
+                            i.future.set_exception(e)
+                    if all(i.future is None for i in batch):
+                        loop.call_exception_handler({
+                            'message': f'Could not send to channel {queue.channel}',
+                            'exception': e
+                        })
+                    continue
+
+                now = time.monotonic()
+                self.stats.sent += 1
+                self.stats.delivered += len(batch)
+                for i in batch:
+                    latency = now - i.queued_at
+                    self.stats.total_latency += latency
+                    self.stats.max_latency = max(self.stats.max_latency, latency)
+                    if i.future is not None and not i.future.done():
+                        i.future.set_result(None)
+
+    def depth(self, channel = None) -> int:
+        """
+        Return the number of messages waiting to be sent,
+        to one channel or to all of them.
+        :param channel:
+            channel object or channel id, None for all
+        :returns:
+            int
+        """
+        if channel is None:
+            return sum(len(i.pending) for i in self._queues.values())
+        queue = self._queues.get(getattr(channel, 'id', channel))
+        return len(queue.pending) if queue else 0
+
+    def close(self) -> None:
+        """
+        Stop sending. Messages still queued are dropped.
+        """
+        for queue in self._queues.values():
+            if queue.worker is not None:
+                queue.worker.cancel()
+
+
+@dataclass
+class DirectMessageStats:
+    """
+    Counters for a DirectMessageQueue.
+
+    :retried:
+        attempts to send which failed and were retried
+
+    :dropped:
+        messages not queued since the queue was full
+    """
+    queued: int = 0
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+    dropped: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class DirectMessageQueue:
+    """
+    Send direct messages to members in the background, at
+    most 'concurrency' at a time. A failed send is retried
+    with a growing delay, unless Discord refused it, which
+    it does to members not accepting direct messages.
+
+    :concurrency:
+        messages sent at the same time
+
+    :retries:
+        attempts to send a message after the first one
+
+    :backoff:
+        seconds before the first retry, doubled for every
+        retry after it
+
+    :max_pending:
+        messages allowed to wait, later ones are dropped
+    """
+
+    def __init__(self, concurrency = 4, retries = 3, backoff = 1.0, max_pending = 10000):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_pending = max_pending
+        self.stats = DirectMessageStats()
+        self._queue: asyncio.Queue = None
+        self._workers = []
+
+    def _start(self) -> None:
+        self._queue = asyncio.Queue(self.max_pending)
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._work()) for _ in range(self.concurrency)]
+
+    def post(self, member, message: str) -> bool:
+        """
+        Queue a direct message without waiting for it to be
+        sent.
+        :param member:
+            discord.Member or discord.User
+        :param message:
+            string
+        :returns:
+            bool, False if the queue was full
+        """
+        if not message:
+            return True
+        if self._queue is None:
+            self._start()
+        try:
+            self._queue.put_nowait((member, message))
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            return False
+        self.stats.queued += 1
+        return True
+
+    @staticmethod
+    def _refused(error: Exception) -> bool:
+        # discord.Forbidden and discord.NotFound, which are
+        # not worth retrying.
+        return getattr(error, 'status', None) in (403, 404)
+
+    async def _send(self, member, message: str) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.timed('discord_dm_seconds'):
+                    channel = member.dm_channel or await member.create_dm()
+                    await channel.send(message)
+                self.stats.sent += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._refused(e) or attempt == self.retries:
+                    self.stats.failed += 1
+                    return
+                self.stats.retried += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def _work(self) -> None:
+        while True:
+            member, message = await self._queue.get()
+            try:
+                await self._send(member, message)
+            finally:
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        """
+        Wait until every queued message is sent or given up.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def close(self) -> None:
+        """
+        Stop sending. Messages still queued are dropped.
+        """
+        for worker in self._workers:
+            worker.cancel()
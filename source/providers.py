@@ -0,0 +1,386 @@
+import asyncio
+import csv
+import json
+import metrics
+import os
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from custom_errs import ApiHandleError
+from snapshot import Snapshot, normalize_country_name, parse_count, parse_rate
+from streaming import CHUNK_SIZE, parse_chunks_async
+
+"""
+Details:
+    2020-04-16
+
+Module details:
+    Pluggable sources of country statistics.
+
+Synposis:
+    A single upstream api is a single point of failure and
+    latency. A provider fetches the statistics from one source
+    and normalizes them into the format of the Corona Monitor
+    API, so that the rest of the bot is unaware of where they
+    came from. A ProviderGroup fetches every source at once,
+    each within its own timeout, and merges the results field
+    by field, the most recently taken value winning. A refresh
+    waits for the first source to answer and a short grace
+    period for the others, rather than for the slowest. Sources
+    answering late are merged into the next refresh instead.
+"""
+
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+FIELDS = Snapshot.COLUMNS + Snapshot.RATE_COLUMNS
+
+
+def parse_timestamp(value) -> datetime:
+    """
+    Parse a timestamp given as epoch seconds or milliseconds,
+    an ISO 8601 string or in the format of the Corona Monitor
+    API. Returns None if it cannot be parsed.
+    """
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    if isinstance(value, str):
+        for parse in (lambda i: datetime.strptime(i, TIMESTAMP_FORMAT), datetime.fromisoformat):
+            try:
+                parsed = parse(value.strip().replace('Z', '+00:00'))
+            except ValueError:
+                continue
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone().replace(tzinfo = None)
+            return parsed
+    return None
+
+
+def format_value(field: str, value) -> str:
+    """
+    Format a value the way the Corona Monitor API does,
+    like '12,345' for counts and '1,234.5' for rates.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if field in Snapshot.RATE_COLUMNS:
+        return f'{value:,.1f}'
+    return f'{int(value):,}'
+
+
+def check_response(response) -> dict:
+    """
+    Return a response if it holds a list of countries. Error
+    messages returned by an api with a status of 200, such as
+    {"message": "You are not subscribed to this API."}, and
+    dumps of another shape must not replace good responses.
+    :raises:
+        ApiHandleError if the countries are missing
+    """
+    countries = response.get('countries_stat') if isinstance(response, dict) else None
+    if not isinstance(countries, list) or not countries:
+        raise ApiHandleError(f'The response holds no countries: {str(response)[:200]}')
+    return response
+
+
+def is_missing(field: str, value) -> bool:
+    parse = parse_rate if field in Snapshot.RATE_COLUMNS else parse_count
+    return parse(value) is None
+
+
+class Provider:
+    """
+    Base class of the sources. Subclasses implement
+    _fetch, returning a response in the format of the
+    Corona Monitor API. Subclasses parsing the rows as
+    they are received set streams_rows, and hand every
+    row to on_row in _fetch.
+
+    :name:
+        name of the source, recorded as the provenance of
+        the values it provides
+
+    :timeout:
+        seconds to wait for the source
+    """
+
+    streams_rows = False
+
+    def __init__(self, name: str, timeout = 10):
+        self.name = name
+        self.timeout = timeout
+
+    async def _fetch(self, session, on_row = None) -> dict:
+        raise NotImplementedError
+
+    async def fetch(self, session, on_row = None) -> dict:
+        """
+        Return the statistics of the source.
+        :param session:
+            aiohttp.ClientSession to make requests with
+        :param on_row:
+            optional callable taking every row of the
+            response, such as SnapshotBuilder.add
+        :returns:
+            dict, with the keys 'countries_stat' and
+            'statistic_taken_at'
+        :raises:
+            asyncio.TimeoutError if the source does not
+            answer within the timeout, ApiHandleError if
+            the response holds no countries
+        """
+        response = check_response(await asyncio.wait_for(self._fetch(session, on_row), self.timeout))
+        if on_row is not None and not self.streams_rows:
+            for row in response['countries_stat']:
+                on_row(row)
+        return response
+
+    async def close(self) -> None:
+        pass
+
+
+class RapidApiProvider(Provider):
+    """
+    The Corona Monitor API at RapidAPI, which responses
+    are already in the expected format.
+    """
+
+    streams_rows = True
+
+    def __init__(self, uri: str, host: str, key: str, name = 'rapidapi', timeout = 10):
+        super().__init__(name, timeout)
+        self.uri = uri
+        self._headers = {'x-rapidapi-host': host, 'x-rapidapi-key': key}
+
+    async def _fetch(self, session, on_row = None) -> dict:
+        async with session.get(self.uri, headers = self._headers) as response:
+            response.raise_for_status()
+            return await parse_chunks_async(response.content.iter_chunked(CHUNK_SIZE), on_row = on_row)
+
+
+class RestProvider(Provider):
+    """
+    Any REST api listing statistics per country, with its
+    fields mapped onto those of the Corona Monitor API.
+
+    :fields:
+        dict mapping 'country_name' and any of FIELDS to the
+        field names used by the api
+
+    :rows_key:
+        key of the country list in the response, None if the
+        response is the list itself
+
+    :taken_at:
+        field name of the timestamp, looked up in the response
+        and otherwise in every row, the latest row winning
+    """
+
+    def __init__(self, uri: str, fields: dict, name = 'rest', rows_key: str = None,
+                 taken_at: str = None, headers: dict = None, timeout = 10):
+        super().__init__(name, timeout)
+        self.uri = uri
+        self.fields = fields
+        self.rows_key = rows_key
+        self.taken_at = taken_at
+        self._headers = headers or {}
+
+    async def _fetch(self, session, on_row = None) -> dict:
+        async with session.get(self.uri, headers = self._headers) as response:
+            response.raise_for_status()
+            payload = await response.json(content_type = None)
+        return self.normalize(payload)
+
+    def normalize(self, payload) -> dict:
+        rows = payload[self.rows_key] if self.rows_key else payload
+        taken_at = None
+        if self.taken_at and isinstance(payload, dict):
+            taken_at = parse_timestamp(payload.get(self.taken_at))
+
+        countries = []
+        for row in rows:
+            countries.append({field: format_value(field, row.get(source))
+                              for field, source in self.fields.items()})
+            if self.taken_at and not isinstance(payload, dict):
+                row_taken_at = parse_timestamp(row.get(self.taken_at))
+                if row_taken_at and (taken_at is None or row_taken_at > taken_at):
+                    taken_at = row_taken_at
+
+        taken_at = taken_at or datetime.now()
+        return {'countries_stat': countries, 'statistic_taken_at': taken_at.strftime(TIMESTAMP_FORMAT)}
+
+
+class FileProvider(Provider):
+    """
+    A local dump of the statistics, either a JSON file in
+    the format of the Corona Monitor API or a CSV file with
+    a header row naming the same fields. Without a timestamp
+    in the file, its modification time is used.
+    """
+
+    def __init__(self, path: str, name = 'file', timeout = 5):
+        super().__init__(name, timeout)
+        self.path = path
+
+    async def _fetch(self, session, on_row = None) -> dict:
+        return await asyncio.get_running_loop().run_in_executor(None, self.read)
+
+    def read(self) -> dict:
+        with open(self.path, 'r', encoding = 'utf-8', newline = '') as f:
+            if self.path.endswith('.csv'):
+                response = {'countries_stat': list(csv.DictReader(f))}
+            else:
+                response = json.loads(f.read())
+        if not response.get('statistic_taken_at'):
+            taken_at = datetime.fromtimestamp(os.stat(self.path).st_mtime)
+            response['statistic_taken_at'] = taken_at.strftime(TIMESTAMP_FORMAT)
+        return response
+
+
+def merge_responses(responses: dict) -> dict:
+    """
+    Merge the responses of several sources into one. For
+    every country and field the value of the source whose
+    statistics were taken most recently wins, unless it is
+    missing there. Every row records the source of each of
+    its fields under 'provenance', and the response records
+    when the statistics of each source were taken under
+    'sources'.
+    :param responses:
+        dict mapping source names to responses
+    :returns:
+        dict
+    """
+    taken = {name: parse_timestamp(response.get('statistic_taken_at')) or datetime.min
+             for name, response in responses.items()}
+    merged = {}
+    for name in sorted(responses, key = lambda i: taken[i]):
+        for row in responses[name].get('countries_stat', ()):
+            key = normalize_country_name(row['country_name'])
+            merged_row = merged.get(key)
+            if merged_row is None:
+                merged_row = merged[key] = {'country_name': row['country_name'], 'provenance': {}}
+            for field, value in row.items():
+                if field in ('country_name', 'provenance'):
+                    continue
+                if field in FIELDS and is_missing(field, value) and field in merged_row:
+                    continue
+                merged_row[field] = value
+                merged_row['provenance'][field] = name
+
+    latest = max(taken.values(), default = datetime.min)
+    return {
+        'countries_stat': list(merged.values()),
+        'statistic_taken_at': latest.strftime(TIMESTAMP_FORMAT) if latest != datetime.min else None,
+        'sources': {name: responses[name].get('statistic_taken_at') for name in responses}
+    }
+
+
+@dataclass
+class ProviderStats:
+    successes: int = 0
+    failures: int = 0
+    last_latency: float = None
+    last_error: str = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class ProviderGroup:
+    """
+    Fetch several providers concurrently and merge their
+    responses, see merge_responses.
+
+    A fetch returns as soon as one provider has answered and
+    the others have had grace seconds more to do so. It fails
+    if every provider fails. Providers still running
+    are left to finish in the background, and their response
+    is merged into the next fetch. The most recent response
+    of every provider is kept, so that a provider failing
+    falls back on the others and on its own previous values.
+
+    :providers:
+        list of Provider
+
+    :grace:
+        seconds to wait for the other providers once the
+        first has answered
+
+    :stats:
+        dict mapping provider names to ProviderStats
+    """
+
+    def __init__(self, providers: list, grace = 0.5):
+        self.providers = providers
+        self.grace = grace
+        self.stats = {i.name: ProviderStats() for i in providers}
+        self._responses = {}
+        self._inflight = {}
+
+    async def _fetch_one(self, provider: Provider, session) -> None:
+        stats = self.stats[provider.name]
+        started = time.monotonic()
+        try:
+            response = await provider.fetch(session)
+        except Exception as e:
+            stats.failures += 1
+            stats.last_error = repr(e)
+            raise
+        stats.successes += 1
+        stats.last_latency = time.monotonic() - started
+        metrics.observe('corona_provider_seconds', stats.last_latency, provider = provider.name)
+        self._responses[provider.name] = response
+
+    def _start(self, session) -> list:
+        loop = asyncio.get_running_loop()
+        tasks = []
+        for provider in self.providers:
+            task = self._inflight.get(provider.name)
+            if task is None or task.done() or task.get_loop() is not loop:
+                task = loop.create_task(self._fetch_one(provider, session))
+                task.add_done_callback(ProviderGroup._retrieve_exception)
+                self._inflight[provider.name] = task
+            tasks.append(task)
+        return tasks
+
+    @staticmethod
+    def _retrieve_exception(task: asyncio.Task) -> None:
+        # Failures are recorded in the stats of the provider.
+        if not task.cancelled():
+            task.exception()
+
+    async def fetch(self, session, on_row = None) -> dict:
+        """
+        Return the merged response of the providers.
+        :param session:
+            aiohttp.ClientSession shared by the providers
+        :param on_row:
+            optional callable taking every merged row
+        :returns:
+            dict, in the format of the Corona Monitor API
+        :raises:
+            ApiHandleError if every provider failed
+        """
+        pending = set(self._start(session))
+        answered = False
+        while pending and not answered:
+            done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+            answered = any(not i.cancelled() and i.exception() is None for i in done)
+        if pending:
+            await asyncio.wait(pending, timeout = self.grace)
+
+        if not answered:
+            errors = ', '.join(f'{name}: {i.last_error}' for name, i in self.stats.items())
+            raise ApiHandleError(f'No provider returned data. {errors}')
+        response = merge_responses(self._responses)
+        if on_row is not None:
+            for row in response['countries_stat']:
+                on_row(row)
+        return response
+
+    async def close(self) -> None:
+        """
+        Cancel the fetches still running.
+        """
+        for task in self._inflight.values():
+            task.cancel()
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+"""
+Details:
+    2020-04-07
+
+Module details:
+    Token bucket rate limiting.
+
+Synposis:
+    A token bucket holds up to 'capacity' tokens and is
+    refilled with 'rate' tokens per second. Every action
+    takes one token, so bursts up to the capacity pass
+    immediately while the sustained rate is bounded.
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket starting out full.
+
+    :rate:
+        tokens added per second
+
+    :capacity:
+        maximum number of tokens held
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token if there is one.
+        :returns:
+            bool, whether a token was taken
+        """
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """
+        Return the seconds until a token is available.
+        :returns:
+            float
+        """
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    @property
+    def full(self) -> bool:
+        """
+        Whether the bucket has refilled to its capacity, in
+        which case it is as good as a new one.
+        """
+        self._refill()
+        return self._tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+        """
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime
+from ipc import Publisher
+from outbound import scheduled_messages
+from scheduling import QuietHours, SchedulerRunner
+
+"""
+Details:
+    2020-04-17
+
+Module details:
+    The data refresh process of a sharded deployment.
+
+Synposis:
+    The refresh worker owns the api handle and runs the
+    scheduled jobs, change detection included, on behalf of
+    every shard process. Each new snapshot is published as a
+    retained 'snapshot' event, and the messages of the jobs
+    as 'messages' events. The shards deliver the messages to
+    the channels they serve, see CoronaBotClient.
+"""
+
+
+class RefreshWorker:
+    """
+    :api_handle:
+        AsyncApiHandle refreshing the snapshots
+
+    :scheduler:
+        Scheduler holding the jobs to run
+
+    :publisher:
+        ipc.Publisher the events are published through
+
+    :default_channel:
+        channel of jobs returning a message only
+
+    :quiet_hours:
+        optional QuietHours during which no jobs run
+    """
+
+    def __init__(self, api_handle, scheduler, publisher: Publisher, default_channel: int,
+                 quiet_hours: QuietHours = None):
+        self.api_handle = api_handle
+        self.scheduler = scheduler
+        self.publisher = publisher
+        self.default_channel = default_channel
+        self.quiet_hours = quiet_hours
+        self._loop = None
+
+    def _publish_snapshot(self, snapshot, fetched_at: datetime) -> None:
+        self.publisher.publish({
+            'type': 'snapshot',
+            'response': snapshot.raw,
+            'fetched_at': fetched_at.isoformat()
+        }, retain = True)
+
+    def publish_snapshot(self, snapshot) -> None:
+        """
+        Publish a snapshot, used as a listener on the api
+        handle. Safe to call from any thread. The snapshot is
+        published with the time the api handle fetched it,
+        read before another response can replace it.
+        """
+        self._loop.call_soon_threadsafe(self._publish_snapshot, snapshot, self.api_handle.fetched_at)
+
+    async def publish_result(self, method_return) -> None:
+        """
+        Publish the messages returned by a scheduled job.
+        """
+        messages = scheduled_messages(method_return, self.default_channel)
+        if messages:
+            self.publisher.publish({
+                'type': 'messages',
+                'messages': [{'channel': channel, 'message': message} for channel, message in messages]
+            })
+
+    async def run(self, keep_running = lambda: True) -> None:
+        """
+        Publish the current snapshot and every new one, and
+        run the scheduled jobs until keep_running returns False.
+        """
+        self._loop = asyncio.get_running_loop()
+        await self.publisher.start()
+        try:
+            try:
+                snapshot = await self.api_handle.fetch_snapshot_async()
+                self._publish_snapshot(snapshot, self.api_handle.fetched_at)
+            except Exception:
+                pass
+            self.api_handle.add_listener(self.publish_snapshot)
+            self.api_handle.start_background_refresh()
+
+            runner = SchedulerRunner(self.scheduler, quiet_hours = self.quiet_hours)
+            await runner.run(self.publish_result, keep_running)
+        finally:
+            await self.api_handle.close()
+            await self.publisher.close()
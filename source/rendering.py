@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+"""
+Details:
+    2020-04-22
+
+Module details:
+    Rendering of the messages pushed for changed values.
+
+Synposis:
+    Every change the ChangeFeed detects becomes a message in
+    Swedish, such as 'Totalt 4 947 har smittats av COVID-19 i
+    Sverige'. Rather than formatting each message on its own
+    with the string from the api, the changes of a snapshot are
+    rendered together from their integer values: the numbers of
+    a metric are formatted with Swedish thousand separators in
+    one pass, in the manner they are parsed in countrytable, and
+    the name of every country is translated once.
+"""
+
+
+# Swedish groups thousands with a space, a no-break space
+# so that a number is never split over two lines.
+THOUSANDS_SEPARATOR = '\u00a0'
+
+
+def format_counts(values) -> list:
+    """
+    Format integers with Swedish thousand separators,
+    like '12 345'.
+    :param values:
+        sequence of int
+    :returns:
+        list of strings
+    """
+    if not values:
+        return []
+    return '\n'.join(map('{:,}'.format, values)).replace(',', THOUSANDS_SEPARATOR).split('\n')
+
+
+def format_count(value: int) -> str:
+    return format_counts((value,))[0]
+
+
+def new_word(count: int) -> str:
+    """
+    Return the word for new agreeing with a count of cases,
+    'nya' fall or 'nytt' fall.
+    """
+    return 'nya' if count > 1 else 'nytt'
+
+
+class ChangeRenderer:
+    """
+    Render the messages of the changes detected in a snapshot,
+    used as the render of a ChangeFeed.
+
+    :templates:
+        dict mapping metrics to format strings, with the fields
+        'value', 'country' and optionally 'new', see new_word.
+        Changes of other metrics are not rendered.
+
+    :country_name:
+        callable returning the name shown for a country, given
+        its normalized English name as indexed in Snapshot, or
+        None if the changes of the country are not rendered
+    """
+
+    def __init__(self, templates: dict, country_name):
+        self.templates = templates
+        self.country_name = country_name
+
+    def render_many(self, changes: list, snapshot) -> list:
+        """
+        Render a list of changes.
+        :param changes:
+            list of changes.Change
+        :param snapshot:
+            the Snapshot the changes were detected in
+        :returns:
+            list holding a message, or None, per change
+        """
+        names = {}
+        by_metric = defaultdict(list)
+        for i, change in enumerate(changes):
+            if change.metric not in self.templates:
+                continue
+            if change.country not in names:
+                names[change.country] = self.country_name(change.country)
+            if names[change.country] is not None:
+                by_metric[change.metric].append(i)
+
+        messages = [None] * len(changes)
+        for metric, indices in by_metric.items():
+            template = self.templates[metric]
+            counts = [changes[i].current for i in indices]
+            for i, count, value in zip(indices, counts, format_counts(counts)):
+                messages[i] = template.format(
+                    value = value, country = names[changes[i].country], new = new_word(count))
+        return messages
+
+    def __call__(self, change, snapshot) -> str:
+        return self.render_many([change], snapshot)[0]
@@ -0,0 +1,130 @@
+import functools
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+"""
+Details:
+    2020-04-13
+
+Module details:
+    Memoization of chat responses between data refreshes.
+
+Synposis:
+    The same questions are asked over and over, and as long
+    as the api handle has not installed a new snapshot the
+    answer to them does not change. Responses are kept in a
+    bounded LRU cache keyed by the method answering, the
+    normalized query and the version of the snapshot. The
+    cache is emptied whenever a new snapshot is installed.
+"""
+
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def as_dict(self) -> dict:
+        return dict(asdict(self), hit_rate = self.hit_rate)
+
+
+class ResponseCache:
+    """
+    Thread safe LRU cache of responses.
+
+    :max_size:
+        number of responses kept before the least recently
+        used is evicted
+
+    :version:
+        version of the snapshot the cached responses were
+        computed from
+    """
+
+    def __init__(self, max_size = 256):
+        self.max_size = max_size
+        self.version = 0
+        self.stats = ResponseCacheStats()
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def invalidate(self, snapshot = None) -> None:
+        """
+        Drop every cached response. Used as a listener on the
+        api handle, being called with the new snapshot.
+        :param snapshot:
+            the Snapshot installed, or None
+        """
+        with self._lock:
+            self._responses.clear()
+            self.version = snapshot.version if snapshot is not None else self.version + 1
+            self.stats.invalidations += 1
+
+    def get(self, key):
+        """
+        Return the response cached for key under the current
+        version, or None.
+        """
+        with self._lock:
+            response = self._responses.get((key, self.version))
+            if response is None:
+                self.stats.misses += 1
+                return None
+            self._responses.move_to_end((key, self.version))
+            self.stats.hits += 1
+            return response
+
+    def put(self, key, response, version: int) -> None:
+        """
+        Cache a response computed under given version. It is
+        discarded if the cache has been invalidated since.
+        """
+        with self._lock:
+            if version != self.version:
+                return
+            self._responses[(key, version)] = response
+            self._responses.move_to_end((key, version))
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last = False)
+                self.stats.evictions += 1
+
+
+def memoized_response(key = lambda *args: args):
+    """
+    Decorate a feature method to have its responses cached
+    in the ResponseCache found on the feature as the attribute
+    'response_cache'. Calls with keyword arguments, and None
+    responses, are not cached.
+    :param key:
+        callable taking the arguments of the method, returning
+        the normalized query the response depends on
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'response_cache', None)
+            if cache is None or kwargs:
+                return func(self, *args, **kwargs)
+
+            cache_key = (func.__name__, key(*args))
+            response = cache.get(cache_key)
+            if response is not None:
+                return response
+            version = cache.version
+            response = func(self, *args, **kwargs)
+            if response is not None:
+                cache.put(cache_key, response, version)
+            return response
+        return wrapper
+    return decorator
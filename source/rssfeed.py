@@ -0,0 +1,108 @@
+import metrics
+import re
+from collections import OrderedDict
+from startup import lazy_import
+
+feedparser = lazy_import('feedparser')
+
+"""
+Details:
+    2020-04-08
+
+Module details:
+    Incremental polling of an RSS feed.
+
+Synposis:
+    The news feed is polled every minute but rarely changes.
+    The poller sends the ETag and Last-Modified values of the
+    previous response, so an unchanged feed is answered with
+    304 Not Modified and nothing is downloaded or parsed. It
+    remembers which entries it has seen, so that every new
+    entry is returned and not only the newest one.
+"""
+
+
+_HTML_TAG = re.compile('<.*?>')
+
+
+def strip_html(text: str) -> str:
+    """
+    Remove html tags from a string.
+    :param text:
+        string
+    :returns:
+        string
+    """
+    return _HTML_TAG.sub('', text)
+
+
+class RssPoller:
+    """
+    Poll an RSS feed for entries not seen before. Entries
+    present at the first successful poll only set the baseline
+    and are not returned, in the manner of PollCache(
+    silent_first_call = True).
+
+    :uri:
+        URI of the feed
+
+    :max_seen:
+        number of entry ids remembered, the oldest are
+        forgotten first
+    """
+
+    def __init__(self, uri: str, max_seen = 500):
+        self.uri = uri
+        self.max_seen = max_seen
+        self._etag = None
+        self._modified = None
+        self._seen = OrderedDict()
+        self._primed = False
+
+    @staticmethod
+    def entry_id(entry) -> str:
+        return entry.get('id') or entry.get('link') or entry.get('title')
+
+    def _remember(self, entry_id: str) -> None:
+        self._seen[entry_id] = None
+        while len(self._seen) > self.max_seen:
+            self._seen.popitem(last = False)
+
+    @staticmethod
+    def _parsed(feed) -> bool:
+        """
+        Whether a feed was fetched and parsed without error.
+        Feeds read from a local file have no status.
+        """
+        return feed.get('status', 200) == 200 and not feed.get('bozo') and bool(feed.entries)
+
+    @metrics.timed('rss_poll_seconds')
+    def poll(self) -> list:
+        """
+        Return the entries published since the last poll,
+        oldest first.
+        :returns:
+            list of feedparser entries
+        """
+        feed = feedparser.parse(self.uri, etag = self._etag, modified = self._modified)
+        if feed.get('status') == 304:
+            return []
+        if not self._primed and not self._parsed(feed):
+            # Nothing is known to be seen until a poll succeeds,
+            # or the first good poll would return every entry.
+            return []
+        self._etag = feed.get('etag', self._etag)
+        self._modified = feed.get('modified', self._modified)
+
+        new_entries = []
+        for entry in feed.entries:
+            entry_id = self.entry_id(entry)
+            if entry_id in self._seen:
+                continue
+            self._remember(entry_id)
+            new_entries.append(entry)
+
+        if not self._primed:
+            self._primed = True
+            return []
+        return new_entries[::-1]
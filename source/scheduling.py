@@ -0,0 +1,160 @@
+import asyncio
+import metrics
+from datetime import datetime, time, timedelta
+
+"""
+Details:
+    2020-04-05
+
+Module details:
+    Asyncio integration of the Scheduler.
+
+Synposis:
+    Every job the bot schedules runs on a minute or daily
+    interval, so rather than checking for pending jobs many
+    times a second the runner sleeps until the next job is
+    due. Jobs falling within the quiet hours are held back
+    until the quiet hours end instead of having their result
+    thrown away. Due jobs run concurrently, in an executor,
+    and their results are handed to a coroutine callback.
+    The runner also wakes up when a job finishes, as its 
+    next run has then been scheduled.
+"""
+
+
+def job_name(job) -> str:
+    """
+    Return the name of the function a scheduled job calls.
+    """
+    func = getattr(job, 'job_func', job)
+    func = getattr(func, 'func', func)
+    return getattr(func, '__name__', type(func).__name__)
+
+
+class QuietHours:
+    """
+    A daily window during which no scheduled jobs run.
+    The window may pass midnight, like 22:00 to 08:00.
+    """
+
+    def __init__(self, start: time, end: time):
+        self.start = start
+        self.end = end
+
+    def __contains__(self, moment: datetime) -> bool:
+        clock = moment.time()
+        if self.start <= self.end:
+            return self.start <= clock < self.end
+        return clock >= self.start or clock < self.end
+
+    def defer(self, moment: datetime) -> datetime:
+        """
+        Return the moment itself if it is outside the quiet
+        hours, otherwise the moment the quiet hours end.
+        :param moment:
+            datetime
+        :returns:
+            datetime
+        """
+        if moment not in self:
+            return moment
+        end = datetime.combine(moment.date(), self.end)
+        if end <= moment:
+            end += timedelta(days = 1)
+        return end
+
+
+class SchedulerRunner:
+    """
+    Run the jobs of a Scheduler on the event loop without
+    polling it.
+
+    :scheduler:
+        the schedule.Scheduler holding the jobs
+
+    :quiet_hours:
+        QuietHours during which jobs are held back, or None
+
+    :max_idle:
+        the longest the runner sleeps, in seconds, so that
+        jobs added after it started are picked up
+
+    :executor:
+        concurrent.futures.Executor the jobs run in, None for
+        the default executor of the loop
+    """
+
+    def __init__(self, scheduler, quiet_hours: QuietHours = None, max_idle = 60, executor = None):
+        self.scheduler = scheduler
+        self.quiet_hours = quiet_hours
+        self.max_idle = max_idle
+        self.executor = executor
+        self._running = set()
+        self._job_finished = asyncio.Event()
+
+    def seconds_until_due(self, now: datetime) -> float:
+        """
+        Return the seconds until the next job is due to run,
+        taking the quiet hours into account.
+        :param now:
+            datetime
+        :returns:
+            float
+        """
+        pending = [job.next_run for job in self.scheduler.jobs if job not in self._running]
+        if not pending:
+            return self.max_idle
+        due = min(pending)
+        if self.quiet_hours is not None:
+            due = self.quiet_hours.defer(max(due, now))
+        return min(max((due - now).total_seconds(), 0), self.max_idle)
+
+    def due_jobs(self, now: datetime) -> list:
+        """
+        Return the jobs that should run now and are not
+        already running.
+        :param now:
+            datetime
+        :returns:
+            list
+        """
+        if self.quiet_hours is not None and now in self.quiet_hours:
+            return []
+        return [job for job in self.scheduler.jobs if job.should_run and job not in self._running]
+
+    async def _run_job(self, job, on_result) -> None:
+        loop = asyncio.get_running_loop()
+        self._running.add(job)
+        try:
+            with metrics.timed('scheduler_job_seconds', job = job_name(job)):
+                result = await loop.run_in_executor(self.executor, job.run)
+            if result:
+                await on_result(result)
+        except Exception as e:
+            loop.call_exception_handler({
+                'message': f'Scheduled job {job} failed',
+                'exception': e
+            })
+        finally:
+            self._running.discard(job)
+            self._job_finished.set()
+
+    async def run(self, on_result, keep_running = lambda: True) -> None:
+        """
+        Run due jobs until keep_running returns False.
+        :param on_result:
+            coroutine function awaited with the return value
+            of every job returning something
+        :param keep_running:
+            callable returning whether to keep running
+        """
+        loop = asyncio.get_running_loop()
+        while keep_running():
+            self._job_finished.clear()
+            try:
+                timeout = self.seconds_until_due(datetime.now())
+                await asyncio.wait_for(self._job_finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            for job in self.due_jobs(datetime.now()):
+                loop.create_task(self._run_job(job, on_result))
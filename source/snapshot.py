@@ -0,0 +1,293 @@
+import itertools
+from types import MappingProxyType
+from typing import NamedTuple
+from aggregation import ColumnRanking
+from countrytable import CountryTable
+
+"""
+Details:
+    2020-04-02
+
+Module details:
+    Immutable, indexed view of a Corona Monitor API response.
+
+Synposis:
+    The API returns every country as a dictionary full of
+    comma formatted strings. Parsing them and scanning the
+    list on every query is wasteful, since the data only
+    changes when ApiHandle refreshes its cache. A Snapshot
+    is built once per refresh and answers every lookup,
+    total and ranking query in constant time. The numbers
+    are held in the typed columns of a CountryTable, and a
+    CountryStat is only made for the countries looked up.
+"""
+
+
+def normalize_country_name(name: str) -> str:
+    """
+    Return the key under which a country is indexed
+    in a Snapshot.
+    :param name:
+        string, country name as given by the API
+    :returns:
+        string
+    """
+    return name.strip().lower()
+
+
+def parse_count(value) -> int:
+    """
+    Parse a count from the API, formatted like '12,345',
+    into an integer. Values that are missing or not
+    numeric, such as 'N/A' or '', are returned as None.
+    :param value:
+        string or int from the API response
+    :returns:
+        int or None
+    """
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(value.replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+def parse_rate(value) -> float:
+    """
+    Parse a rate from the API, such as cases per million
+    inhabitants formatted like '1,234.5', into a float.
+    Missing values are returned as None.
+    :param value:
+        string or number from the API response
+    :returns:
+        float or None
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value.replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+class CountryStat(NamedTuple):
+    """
+    Parsed statistics for a single country. Counts that
+    the API reported as missing are None. The untouched
+    API row is kept under 'raw' for display purposes.
+    """
+    name: str
+    cases: int
+    deaths: int
+    total_recovered: int
+    new_deaths: int
+    new_cases: int
+    serious_critical: int
+    active_cases: int
+    total_cases_per_1m_population: float
+    deaths_per_1m_population: float
+    raw: MappingProxyType
+
+
+class Snapshot:
+    """
+    Read only representation of one API response. Countries
+    are indexed by their normalized name, counts are parsed
+    to integers and rates to floats. Should a country appear
+    more than once in the response, its last row is used. Every column is ranked
+    upon construction, giving global totals, top and bottom
+    lists and percentiles without further scans.
+
+    :taken_at:
+        the 'statistic_taken_at' string from the API, telling
+        when the statistics were taken.
+
+    :raw:
+        the response the snapshot was built from.
+
+    :version:
+        int, increasing with every snapshot built, telling
+        snapshots apart without comparing their contents.
+    """
+
+    COLUMNS = (
+        'cases',
+        'deaths',
+        'total_recovered',
+        'new_deaths',
+        'new_cases',
+        'serious_critical',
+        'active_cases'
+    )
+
+    RATE_COLUMNS = (
+        'total_cases_per_1m_population',
+        'deaths_per_1m_population'
+    )
+
+    __slots__ = ('_raw', '_rows', '_table', '_rankings', '_version')
+
+    _versions = itertools.count(1)
+
+    def __init__(self, response: dict, rows: dict = None):
+        """
+        :param response:
+            dict, the api response
+        :param rows:
+            optional dict of the rows of the response keyed by
+            their normalized country name, as collected by a
+            SnapshotBuilder while the response was received
+        """
+        if rows is None:
+            rows = {}
+            for row in response.get('countries_stat', ()):
+                rows[normalize_country_name(row['country_name'])] = row
+        keys = tuple(rows)
+        rows = tuple(rows.values())
+        table = CountryTable(keys, tuple(row['country_name'] for row in rows), rows,
+                             Snapshot.COLUMNS, Snapshot.RATE_COLUMNS)
+
+        rankings = {}
+        for column in Snapshot.COLUMNS:
+            rankings[column] = ColumnRanking(table.present(column))
+        for column in Snapshot.RATE_COLUMNS:
+            rankings[column] = ColumnRanking(table.present(column), 'd')
+
+        self._raw = response
+        self._rows = rows
+        self._table = table
+        self._rankings = MappingProxyType(rankings)
+        self._version = next(Snapshot._versions)
+
+    def _stat(self, row: int) -> CountryStat:
+        table = self._table
+        return CountryStat(
+            table.names[row],
+            *(table.value(row, column) for column in Snapshot.COLUMNS + Snapshot.RATE_COLUMNS),
+            MappingProxyType(self._rows[row]))
+
+    def __getitem__(self, country: str) -> CountryStat:
+        return self._stat(self._table.index[normalize_country_name(country)])
+
+    def __contains__(self, country: str) -> bool:
+        return normalize_country_name(country) in self._table.index
+
+    def __iter__(self):
+        return (self._stat(row) for row in range(len(self._table)))
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    @property
+    def raw(self) -> dict:
+        return self._raw
+
+    @property
+    def table(self) -> CountryTable:
+        return self._table
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def taken_at(self) -> str:
+        return self._raw.get('statistic_taken_at')
+
+    def items(self):
+        """
+        Return (normalized country name, CountryStat) pairs.
+        """
+        return ((key, self._stat(row)) for row, key in enumerate(self._table.keys))
+
+    def get(self, country: str, default = None) -> CountryStat:
+        row = self._table.index.get(normalize_country_name(country))
+        return default if row is None else self._stat(row)
+
+    def ranking(self, column: str) -> ColumnRanking:
+        """
+        Return the ranking of a column.
+        :param column:
+            string, one of Snapshot.COLUMNS or Snapshot.RATE_COLUMNS
+        :returns:
+            ColumnRanking
+        """
+        return self._rankings[column]
+
+    def total(self, column: str) -> int:
+        """
+        Return the global sum for given column, countries
+        with missing values excluded.
+        :param column:
+            string, one of Snapshot.COLUMNS
+        :returns:
+            int
+        """
+        return self._rankings[column].total
+
+    def top(self, column: str, k: int) -> list:
+        """
+        Return the k countries with the highest values in
+        column, highest first.
+        :param column:
+            string, one of Snapshot.COLUMNS or Snapshot.RATE_COLUMNS
+        :param k:
+            int
+        :returns:
+            list of CountryStat
+        """
+        return [self[key] for key, _ in self._rankings[column].top(k)]
+
+    def bottom(self, column: str, k: int) -> list:
+        """
+        Return the k countries with the lowest values in
+        column, lowest first.
+        :param column:
+            string, one of Snapshot.COLUMNS or Snapshot.RATE_COLUMNS
+        :param k:
+            int
+        :returns:
+            list of CountryStat
+        """
+        return [self[key] for key, _ in self._rankings[column].bottom(k)]
+
+    def highest(self, column: str) -> CountryStat:
+        """
+        Return the country with the highest value in column.
+        :param column:
+            string, one of Snapshot.COLUMNS
+        :returns:
+            CountryStat
+        """
+        return self.top(column, 1)[0]
+
+    def lowest(self, column: str) -> CountryStat:
+        """
+        Return the country with the lowest value in column.
+        :param column:
+            string, one of Snapshot.COLUMNS
+        :returns:
+            CountryStat
+        """
+        return self.bottom(column, 1)[0]
+
+
+class SnapshotBuilder:
+    """
+    Index the rows of a response as they are received, see
+    streaming.ResponseStream, and build the Snapshot once the
+    whole response is in.
+    """
+
+    def __init__(self):
+        self._rows = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, row: dict) -> None:
+        self._rows[normalize_country_name(row['country_name'])] = row
+
+    def build(self, response: dict) -> Snapshot:
+        return Snapshot(response, rows = self._rows)
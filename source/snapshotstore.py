@@ -0,0 +1,137 @@
+import json
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+
+"""
+Details:
+    2020-04-09
+
+Module details:
+    Persistent store for api snapshots and published values.
+
+Synposis:
+    Without persistence every restart begins with a blocking
+    call to the api, and change detection starts over from a
+    silent baseline so that anything which changed during the
+    downtime is never published. The store keeps the most
+    recent api responses and the last published value per
+    country and metric in a local SQLite database, so that
+    the cache is warm on startup without touching the network
+    and change detection resumes where it stopped.
+"""
+
+
+class SnapshotStore:
+    """
+    SQLite backed store. Responses are kept compressed and
+    only the 'keep' most recent distinct ones are retained.
+    The store may be used from several threads.
+
+    :path:
+        path to the database file, ':memory:' for a store
+        which is not persisted
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fetched_at TEXT NOT NULL,
+            payload BLOB NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS published (
+            country TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            value INTEGER,
+            PRIMARY KEY (country, metric))"""
+    )
+
+    def __init__(self, path: str, keep = 10):
+        self.path = path
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread = False)
+        with self._lock, self._connection:
+            for statement in SnapshotStore.SCHEMA:
+                self._connection.execute(statement)
+        self._last_payload = self._latest_payload()
+
+    def _latest_payload(self) -> bytes:
+        row = self._connection.execute(
+            'SELECT payload FROM snapshots ORDER BY id DESC LIMIT 1').fetchone()
+        return row[0] if row else None
+
+    def save_snapshot(self, response: dict, fetched_at: datetime) -> bool:
+        """
+        Store an api response, unless it is identical to the
+        most recently stored one.
+        :param response:
+            dict, the api response
+        :param fetched_at:
+            datetime, when the response was received
+        :returns:
+            bool, whether the response was stored
+        """
+        payload = zlib.compress(json.dumps(response, separators = (',', ':')).encode('utf-8'))
+        with self._lock, self._connection:
+            if payload == self._last_payload:
+                return False
+            self._connection.execute(
+                'INSERT INTO snapshots (fetched_at, payload) VALUES (?, ?)',
+                (fetched_at.isoformat(), payload))
+            self._connection.execute(
+                'DELETE FROM snapshots WHERE id NOT IN '
+                '(SELECT id FROM snapshots ORDER BY id DESC LIMIT ?)', (self.keep,))
+            self._last_payload = payload
+        return True
+
+    def latest(self) -> tuple:
+        """
+        Return the most recently stored response and when it
+        was received, or None if nothing has been stored.
+        :returns:
+            tuple (dict, datetime) or None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT payload, fetched_at FROM snapshots ORDER BY id DESC LIMIT 1').fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0])), datetime.fromisoformat(row[1])
+
+    def history(self) -> list:
+        """
+        Return the stored responses, oldest first, with when
+        they were received.
+        :returns:
+            list of tuples (dict, datetime)
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT payload, fetched_at FROM snapshots ORDER BY id').fetchall()
+        return [(json.loads(zlib.decompress(payload)), datetime.fromisoformat(fetched_at))
+                for payload, fetched_at in rows]
+
+    def published(self) -> dict:
+        """
+        Return the last published value per country and metric.
+        :returns:
+            dict keyed by (country, metric)
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT country, metric, value FROM published').fetchall()
+        return {(country, metric): value for country, metric, value in rows}
+
+    def set_published(self, values) -> None:
+        """
+        Record published values.
+        :param values:
+            iterable of (country, metric, value)
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO published (country, metric, value) VALUES (?, ?, ?)', values)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,111 @@
+import importlib.util
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Details:
+    2020-04-19
+
+Module details:
+    Fast startup of the bot.
+
+Synposis:
+    The time from starting the process to being connected
+    to the Discord gateway is spent importing modules and
+    reading files. Modules only needed later, such as the
+    http clients and the RSS parser, are imported lazily on
+    first use, the files are loaded in parallel threads, and
+    every phase of the startup is timed so that the time to
+    connect after a crash or a deploy can be followed.
+"""
+
+
+# perf_counter when this module was first imported. Imported
+# before anything else by client.py, it marks the start of
+# the imports.
+STARTED = time.perf_counter()
+
+
+def lazy_import(name: str):
+    """
+    Return a module which is not executed until one of its
+    attributes is first used. Modules already imported are
+    returned as they are.
+    :param name:
+        string, the name of the module
+    :raises:
+        ModuleNotFoundError if the module is not installed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name = name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load_parallel(loaders: dict, max_workers = 8) -> dict:
+    """
+    Call every loader in a thread of its own and return
+    their results once all of them are done. Loading files
+    and opening databases mostly waits for the disk, and
+    does so side by side.
+    :param loaders:
+        dict mapping names to callables taking no arguments
+    :returns:
+        dict mapping the names to what the loaders returned
+    :raises:
+        the first exception raised by a loader
+    """
+    with ThreadPoolExecutor(max_workers = min(max_workers, len(loaders) or 1)) as executor:
+        futures = {name: executor.submit(loader) for name, loader in loaders.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+class StartupTimer:
+    """
+    Time the phases of the startup. Each call to mark ends
+    the phase which began with the previous one.
+
+    :started:
+        perf_counter at which the first phase began
+    """
+
+    def __init__(self, started: float = None):
+        self.started = STARTED if started is None else started
+        self.phases = {}
+        self._last = self.started
+
+    def mark(self, phase: str) -> float:
+        """
+        End a phase and return its duration in seconds.
+        Marking a phase again adds to its duration.
+        """
+        now = time.perf_counter()
+        duration = now - self._last
+        self.phases[phase] = self.phases.get(phase, 0) + duration
+        self._last = now
+        return duration
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def report(self) -> str:
+        phases = ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in self.phases.items())
+        return f'Startup took {self.total:.3f}s: {phases}'
+
+    def publish(self, registry) -> None:
+        """
+        Expose the durations as the gauge startup_seconds
+        of a metrics registry, labelled by phase.
+        """
+        for phase in self.phases:
+            registry.gauge('startup_seconds', lambda phase = phase: self.phases[phase], phase = phase)
+        registry.gauge('startup_seconds', lambda: self.total, phase = 'total')
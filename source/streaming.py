@@ -0,0 +1,243 @@
+import codecs
+import json
+import re
+
+"""
+Details:
+    2020-04-21
+
+Module details:
+    Incremental parsing of api responses.
+
+Synposis:
+    Reading the whole body of a response before parsing it
+    holds the bytes, the decoded text and the parsed objects
+    in memory at once, and nothing can be used until the last
+    byte has arrived. A ResponseStream is instead fed the body
+    chunk by chunk as it is received. The rows of the country
+    list are decoded one at a time with the raw_decode method
+    of the standard JSON decoder as soon as they are complete,
+    and handed on, so that the snapshot is indexed while the
+    rest of the body is still on its way. Only the row being
+    received is buffered.
+"""
+
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_START, _KEY, _FIRST_KEY, _COLON, _VALUE, _AFTER_VALUE, _ROW, _FIRST_ROW, _AFTER_ROW, _END = range(10)
+
+
+class ResponseStream:
+    """
+    Parse a JSON object fed in chunks, decoding the elements
+    of the list under rows_key one by one. Values under other
+    keys are decoded whole.
+
+    :rows_key:
+        key of the list of rows in the object
+
+    :on_row:
+        optional callable taking every row as it is decoded
+
+    :rows:
+        list of the rows decoded so far
+    """
+
+    def __init__(self, rows_key = 'countries_stat', on_row = None):
+        self.rows_key = rows_key
+        self.on_row = on_row
+        self.rows = []
+        self._response = {}
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._pending = []
+        self._pending_length = 0
+        self._retry_at = 0
+        self._state = _START
+        self._key = None
+        self._closed = False
+
+    def _error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self._buffer, self._pos)
+
+    def _decode(self):
+        """
+        Decode the value at the current position, returned
+        in a tuple of one. Returns None, leaving the position
+        as it is, if the value is not complete yet.
+        """
+        buffer, pos = self._buffer, self._pos
+        try:
+            value, end = self._decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if self._closed:
+                raise
+            end = len(buffer)
+        if end == len(buffer) and not self._closed:
+            # A number at the end of the buffer may go on in the
+            # next chunk. Rather than decode a large value again
+            # for every chunk, wait until what is left of the
+            # buffer has doubled.
+            self._retry_at = 2 * (len(buffer) - pos)
+            return None
+        self._pos = end
+        return (value,)
+
+    def _decode_rows(self) -> bool:
+        """
+        Decode every complete row in the buffer in a single
+        call, which is faster than decoding them one by one
+        and shares the keys of the rows between them. The
+        rows are taken to end at the last '},' in the buffer,
+        which is right unless it is within a string or a
+        nested object, in which case they fail to decode.
+        :returns:
+            bool, whether any rows were decoded
+        """
+        buffer, pos = self._buffer, self._pos
+        end = buffer.rfind('},', pos)
+        if end == -1:
+            return False
+        try:
+            rows = json.loads(f'[{buffer[pos:end + 1]}]')
+        except json.JSONDecodeError:
+            return False
+        self.rows.extend(rows)
+        if self.on_row is not None:
+            for row in rows:
+                self.on_row(row)
+        self._pos = end + 1
+        self._state = _AFTER_ROW
+        return True
+
+    def _expect(self, char: str, expected: str, state: int) -> None:
+        if char != expected:
+            raise self._error(f'Expected {expected!r}')
+        self._pos += 1
+        self._state = state
+
+    def _advance(self) -> bool:
+        """
+        Parse the next token. Returns False if more data
+        is needed.
+        """
+        buffer = self._buffer
+        self._pos = _WHITESPACE.match(buffer, self._pos).end()
+        if self._pos == len(buffer):
+            return False
+        char, state = buffer[self._pos], self._state
+
+        if state == _START:
+            self._expect(char, '{', _FIRST_KEY)
+        elif state in (_FIRST_KEY, _AFTER_VALUE) and char == '}':
+            self._expect(char, '}', _END)
+        elif state == _AFTER_VALUE:
+            self._expect(char, ',', _KEY)
+        elif state in (_KEY, _FIRST_KEY):
+            if char != '"':
+                raise self._error('Expected a key')
+            decoded = self._decode()
+            if decoded is None:
+                return False
+            self._key = decoded[0]
+            self._state = _COLON
+        elif state == _COLON:
+            self._expect(char, ':', _VALUE)
+        elif state == _VALUE:
+            if self._key == self.rows_key and char == '[':
+                self._response[self._key] = self.rows
+                self._expect(char, '[', _FIRST_ROW)
+                return True
+            decoded = self._decode()
+            if decoded is None:
+                return False
+            self._response[self._key] = decoded[0]
+            self._state = _AFTER_VALUE
+        elif state in (_FIRST_ROW, _AFTER_ROW) and char == ']':
+            self._expect(char, ']', _AFTER_VALUE)
+        elif state == _AFTER_ROW:
+            self._expect(char, ',', _ROW)
+        elif state in (_ROW, _FIRST_ROW):
+            if self._decode_rows():
+                return True
+            decoded = self._decode()
+            if decoded is None:
+                return False
+            self.rows.append(decoded[0])
+            if self.on_row is not None:
+                self.on_row(decoded[0])
+            self._state = _AFTER_ROW
+        else:
+            raise self._error('Extra data')
+        return True
+
+    def _run(self) -> None:
+        if len(self._buffer) - self._pos + self._pending_length < self._retry_at and not self._closed:
+            return
+        self._buffer = self._buffer[self._pos:] + ''.join(self._pending)
+        self._pos = 0
+        self._pending.clear()
+        self._pending_length = 0
+        self._retry_at = 0
+        while self._advance():
+            pass
+
+    def feed(self, chunk) -> int:
+        """
+        Parse the next chunk of the body.
+        :param chunk:
+            bytes, utf-8 encoded, or string
+        :returns:
+            int, the number of rows decoded so far
+        :raises:
+            json.JSONDecodeError if the body is not valid JSON
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._text.decode(chunk)
+        self._pending.append(chunk)
+        self._pending_length += len(chunk)
+        self._run()
+        return len(self.rows)
+
+    def close(self) -> dict:
+        """
+        Parse what is left of the body and return the parsed
+        object, holding the rows under rows_key.
+        :raises:
+            json.JSONDecodeError if the body is incomplete or
+            not valid JSON
+        """
+        self._pending.append(self._text.decode(b'', final = True))
+        self._closed = True
+        self._run()
+        if self._state != _END:
+            raise self._error('Incomplete response')
+        return self._response
+
+
+def parse_chunks(chunks, rows_key = 'countries_stat', on_row = None) -> dict:
+    """
+    Parse a response from an iterable of chunks, such as
+    requests.Response.iter_content, see ResponseStream.
+    """
+    stream = ResponseStream(rows_key, on_row)
+    for chunk in chunks:
+        stream.feed(chunk)
+    return stream.close()
+
+
+async def parse_chunks_async(chunks, rows_key = 'countries_stat', on_row = None) -> dict:
+    """
+    Parse a response from an asynchronous iterable of chunks,
+    such as aiohttp.StreamReader.iter_chunked, see
+    ResponseStream.
+    """
+    stream = ResponseStream(rows_key, on_row)
+    async for chunk in chunks:
+        stream.feed(chunk)
+    return stream.close()
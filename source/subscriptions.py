@@ -0,0 +1,192 @@
+import sqlite3
+import threading
+from collections import defaultdict
+
+"""
+Details:
+    2020-04-18
+
+Module details:
+    Persistent registry of what is pushed to which channel.
+
+Synposis:
+    Channels subscribe to changes of a metric, either for one
+    country or for every country, optionally with exceptions.
+    The subscriptions are kept in a SQLite database and indexed
+    in memory by (country, metric), so that finding the channels
+    a change is pushed to is a dictionary lookup however many
+    subscriptions there are. The registry replaces StaticRouter
+    as the router of the ChangeFeed. Other processes sharing
+    the database, such as the shards of the bot, may change
+    the subscriptions; the index is then rebuilt.
+"""
+
+
+ALL_COUNTRIES = '*'
+
+
+class SubscriptionRegistry:
+    """
+    SQLite backed subscriptions, usable from several threads.
+    Countries are normalized English country names, as
+    indexed in Snapshot, or ALL_COUNTRIES.
+
+    :path:
+        path to the database file, ':memory:' for a registry
+        which is not persisted
+    """
+
+    SCHEMA = """CREATE TABLE IF NOT EXISTS subscriptions (
+        channel INTEGER NOT NULL,
+        country TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        excluded INTEGER NOT NULL DEFAULT 0,
+        guild INTEGER,
+        PRIMARY KEY (channel, country, metric))"""
+
+    # PRAGMA user_version of a database whose initial
+    # subscriptions have been made, see seed.
+    SEEDED = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread = False)
+        with self._lock, self._connection:
+            existed = self._connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'subscriptions'").fetchone()
+            self._connection.execute(SubscriptionRegistry.SCHEMA)
+            if existed and self._user_version() < SubscriptionRegistry.SEEDED:
+                # Databases from before the seeding was recorded
+                # were seeded when they were created.
+                self._set_user_version(SubscriptionRegistry.SEEDED)
+            self._load()
+
+    def _data_version(self) -> int:
+        return self._connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def _user_version(self) -> int:
+        return self._connection.execute('PRAGMA user_version').fetchone()[0]
+
+    def _set_user_version(self, version: int) -> None:
+        self._connection.execute(f'PRAGMA user_version = {int(version)}')
+
+    def _load(self) -> None:
+        by_key = defaultdict(set)
+        every_country = defaultdict(set)
+        excluded = set()
+        rows = self._connection.execute('SELECT channel, country, metric, excluded FROM subscriptions')
+        for channel, country, metric, is_excluded in rows:
+            if is_excluded:
+                excluded.add((channel, country, metric))
+            elif country == ALL_COUNTRIES:
+                every_country[metric].add(channel)
+            else:
+                by_key[(country, metric)].add(channel)
+        self._by_key = dict(by_key)
+        self._every_country = dict(every_country)
+        self._excluded = excluded
+        self._count = sum(map(len, by_key.values())) + sum(map(len, every_country.values()))
+        self._version = self._data_version()
+
+    def _reload_if_changed(self) -> None:
+        # data_version only changes when another connection,
+        # such as another process, has committed.
+        if self._data_version() != self._version:
+            self._load()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, channel: int, metric: str, country: str = ALL_COUNTRIES, guild: int = None) -> None:
+        """
+        Subscribe a channel to a metric for a country, or for
+        every country. An exception for the country is lifted.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO subscriptions (channel, country, metric, excluded, guild) '
+                'VALUES (?, ?, ?, 0, ?)', (channel, country, metric, guild))
+            self._load()
+
+    def remove(self, channel: int, metric: str, country: str = ALL_COUNTRIES) -> bool:
+        """
+        Unsubscribe a channel from a metric for a country, or
+        for every country. If the channel is subscribed for
+        every country, the country is made an exception.
+        :returns:
+            bool, whether the subscriptions changed
+        """
+        with self._lock, self._connection:
+            self._reload_if_changed()
+            if country == ALL_COUNTRIES:
+                changed = self._connection.execute(
+                    'DELETE FROM subscriptions WHERE channel = ? AND metric = ? AND (country = ? OR excluded = 1)',
+                    (channel, metric, country)).rowcount
+            elif channel in self._every_country.get(metric, ()):
+                changed = (channel, country, metric) not in self._excluded
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO subscriptions (channel, country, metric, excluded) '
+                    'VALUES (?, ?, ?, 1)', (channel, country, metric))
+            else:
+                changed = self._connection.execute(
+                    'DELETE FROM subscriptions WHERE channel = ? AND metric = ? AND country = ?',
+                    (channel, metric, country)).rowcount
+            self._load()
+        return bool(changed)
+
+    def seed(self, setup) -> bool:
+        """
+        Make the initial subscriptions of a new database. They
+        are made once only, so that subscriptions removed in the
+        chat are not made again when the bot restarts, even if
+        none are left.
+        :param setup:
+            callable taking the registry and making the initial
+            subscriptions through add and remove
+        :returns:
+            bool, whether setup was called
+        """
+        with self._lock:
+            if self._user_version() >= SubscriptionRegistry.SEEDED:
+                return False
+        setup(self)
+        with self._lock, self._connection:
+            self._set_user_version(SubscriptionRegistry.SEEDED)
+        return True
+
+    def for_channel(self, channel: int) -> list:
+        """
+        Return the subscriptions of a channel as (country,
+        metric, excluded) tuples, ordered by metric and country.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT country, metric, excluded FROM subscriptions WHERE channel = ? '
+                'ORDER BY metric, country', (channel,)).fetchall()
+        return [(country, metric, bool(excluded)) for country, metric, excluded in rows]
+
+    def channels_for(self, country: str, metric: str) -> list:
+        with self._lock:
+            channels = set(self._by_key.get((country, metric), ()))
+            for channel in self._every_country.get(metric, ()):
+                if (channel, country, metric) not in self._excluded:
+                    channels.add(channel)
+        return list(channels)
+
+    @property
+    def metrics(self) -> tuple:
+        """
+        The metrics any channel is subscribed to. Read once
+        per poll of the ChangeFeed, subscriptions changed by
+        other processes are picked up here.
+        """
+        with self._lock:
+            self._reload_if_changed()
+            metrics = set(self._every_country)
+            metrics.update(metric for _, metric in self._by_key)
+        return tuple(sorted(metrics))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,179 @@
+import json
+import metrics
+import os
+import re
+import time
+from difflib import get_close_matches
+from types import MappingProxyType
+
+"""
+Details:
+    2020-04-03
+
+Module details:
+    In-memory registry for the country name translations.
+
+Synposis:
+    The Corona Monitor API names countries in English while
+    users ask in Swedish. The translation file is loaded once
+    and kept in memory as read only tables for both directions.
+    It is reloaded when the file is modified on disk, so that
+    new countries can be added without restarting the bot.
+"""
+
+
+_COMPACT = re.compile(r"[\s.\-']+")
+
+
+def compact_key(name: str) -> str:
+    """
+    Return a name stripped of case, whitespace and
+    punctuation, used for alias lookups so that for
+    example 'syd korea' finds 'sydkorea'.
+    :param name:
+        string
+    :returns:
+        string
+    """
+    return _COMPACT.sub('', name.lower())
+
+
+class TranslationTable:
+    """
+    One direction of the translation file. Looks up exact
+    names first, then aliases and compacted names and last
+    the closest match by similarity above 'cutoff'.
+    """
+
+    MAX_FUZZY_MATCHES = 1024
+
+    def __init__(self, translations: dict, aliases: dict = None, cutoff = 0.85):
+        exact = {key.strip().lower(): value for key, value in translations.items()}
+        compacted = {compact_key(key): value for key, value in exact.items()}
+        for alias, key in (aliases or {}).items():
+            compacted[compact_key(alias)] = exact[key.strip().lower()]
+
+        self._exact = MappingProxyType(exact)
+        self._compacted = MappingProxyType(compacted)
+        self._fuzzy_matches = {}
+        self.cutoff = cutoff
+
+    def __getitem__(self, name: str) -> str:
+        name = name.strip().lower()
+        try:
+            return self._exact[name]
+        except KeyError:
+            pass
+
+        key = compact_key(name)
+        try:
+            return self._compacted[key]
+        except KeyError:
+            pass
+
+        if key not in self._fuzzy_matches:
+            if len(self._fuzzy_matches) >= TranslationTable.MAX_FUZZY_MATCHES:
+                self._fuzzy_matches.clear()
+            matches = get_close_matches(key, self._compacted.keys(), n = 1, cutoff = self.cutoff)
+            self._fuzzy_matches[key] = matches[0] if matches else None
+        if self._fuzzy_matches[key] is None:
+            raise KeyError(name)
+        return self._compacted[self._fuzzy_matches[key]]
+
+    def __contains__(self, name: str) -> bool:
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._exact)
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    @property
+    def mapping(self) -> MappingProxyType:
+        return self._exact
+
+
+class TranslationRegistry:
+    """
+    Load the translation file once and serve lookups from
+    memory. The modification time of the file is checked at
+    most every 'check_interval' seconds and the tables are
+    rebuilt if it has changed. Should a reload fail, the
+    previously loaded tables are kept.
+
+    The file is expected to hold the keys 'swe_to_eng' and
+    'eng_to_swe', and optionally 'aliases' mapping alternative
+    Swedish names to a key in 'swe_to_eng'.
+    """
+
+    def __init__(self, path: str, check_interval = 5):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._next_check = 0
+        self._tables = None
+        try:
+            self._load()
+        except Exception as e:
+            raise Exception(f'Could not load translation file. {e}')
+
+    @metrics.timed('translations_seconds')
+    def _load(self) -> None:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, 'r', encoding = 'utf-8') as f:
+            translation = json.loads(f.read())
+
+        swe_to_eng = TranslationTable(translation['swe_to_eng'], translation.get('aliases', {}))
+        eng_to_swe = TranslationTable(translation['eng_to_swe'])
+        self._tables = (swe_to_eng, eng_to_swe)
+        self._mtime = mtime
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the translation file if it was modified since
+        it was last loaded.
+        :returns:
+            bool, True if the tables were reloaded
+        """
+        self._next_check = time.monotonic() + self.check_interval
+        try:
+            if os.stat(self.path).st_mtime == self._mtime:
+                return False
+            self._load()
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def _current(self) -> tuple:
+        if time.monotonic() >= self._next_check:
+            self.reload_if_changed()
+        return self._tables
+
+    @property
+    def swe_to_eng(self) -> TranslationTable:
+        return self._current()[0]
+
+    @property
+    def eng_to_swe(self) -> TranslationTable:
+        return self._current()[1]
+
+    @metrics.timed('translations_seconds')
+    def translate(self, country: str, from_language: str) -> str:
+        """
+        Translate a country name.
+        :param country:
+            string, country to translate
+        :param from_language:
+            string, 'swedish' to translate to English,
+            anything else to translate to Swedish.
+        :returns:
+            string
+        """
+        if from_language == 'swedish':
+            return self.swe_to_eng[country]
+        return self.eng_to_swe[country]
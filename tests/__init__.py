@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The bot is run from within the source directory and its
+# modules import each other by name, so mirror that here.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'source'))
@@ -0,0 +1,349 @@
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import unittest
+import urllib.request
+from datetime import datetime, timedelta
+from pathlib import Path
+from tests.fakeapi import FakeServer, TRANSLATION_FILE, grow, rss_feed, synthetic_response
+from tests.test_intents import CALLBACKS
+from changes import ChangeFeed, StaticRouter
+from history import HistoryStore
+from intents import IntentMatcher
+from rendering import ChangeRenderer
+from countrytable import parse_column
+from snapshot import Snapshot, SnapshotBuilder, parse_count
+from streaming import CHUNK_SIZE, ResponseStream
+from snapshotstore import SnapshotStore
+
+"""
+Details:
+    2020-04-15
+
+Module details:
+    Offline benchmarks of the Corona feature.
+
+Synposis:
+    Measure query latency, one minute of the scheduled jobs
+    set up in client.py, memory per snapshot and startup time
+    against FakeServer, with the API response scaled up to
+    BENCHMARK_COUNTRIES synthetic countries. Benchmarks needing
+    a dependency that is not installed are skipped. Run with
+
+        python -m unittest tests.benchmark_corona -v
+
+    The results are printed, and written as JSON to the path
+    in BENCHMARK_RESULTS if set, to compare between runs.
+"""
+
+
+COUNTRIES = int(os.getenv('BENCHMARK_COUNTRIES', 5000))
+SOURCE_DIR = Path(__file__).resolve().parent.parent / 'source'
+RESULTS = {}
+
+
+def installed(*modules) -> bool:
+    return all(importlib.util.find_spec(i) is not None for i in modules)
+
+
+def measure(func, number = 100, repeat = 5) -> dict:
+    """
+    Return the best and median time of a call to func,
+    in seconds, pytest-benchmark style.
+    """
+    times = [i / number for i in timeit.repeat(func, number = number, repeat = repeat)]
+    return {'min': min(times), 'median': statistics.median(times)}
+
+
+def report(name: str, value, unit = 's') -> None:
+    """
+    Print and record a result. Times, in seconds, are
+    printed in microseconds.
+    """
+    RESULTS[name] = {'value': value, 'unit': unit}
+    if unit == 's':
+        values = value if isinstance(value, dict) else {'time': value}
+        value, unit = ', '.join(f'{key} {i * 1e6:,.1f}' for key, i in values.items()), 'us'
+    print(f'\n{name}: {value} {unit}')
+
+
+def tearDownModule():
+    path = os.getenv('BENCHMARK_RESULTS')
+    if path:
+        with open(path, 'w', encoding = 'utf-8') as f:
+            f.write(json.dumps({'countries': COUNTRIES, 'results': RESULTS}, indent = 2))
+
+
+class LocalApiHandle:
+    """
+    Fetch snapshots from FakeServer with the standard library,
+    for the benchmarks to run where requests is not installed.
+    """
+
+    def __init__(self, uri: str):
+        self.uri = uri
+
+    def fetch_snapshot(self) -> Snapshot:
+        with urllib.request.urlopen(self.uri) as response:
+            return Snapshot(json.loads(response.read()))
+
+
+class benchmark_snapshot(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.response = synthetic_response(COUNTRIES)
+        cls.snapshot = Snapshot(cls.response)
+
+    def test_build_snapshot(self):
+        report('snapshot build', measure(lambda: Snapshot(self.response), number = 3, repeat = 3))
+
+    def test_memory_per_snapshot(self):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        snapshot = Snapshot(self.response)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        size = sum(i.size_diff for i in after.compare_to(before, 'filename'))
+        self.assertEqual(len(snapshot), COUNTRIES)
+        report('snapshot memory', size, 'bytes')
+        report('snapshot memory per country', size // COUNTRIES, 'bytes')
+        report('snapshot table per country', snapshot.table.nbytes // COUNTRIES, 'bytes')
+
+    def test_memory_of_response(self):
+        body = json.dumps(self.response)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        response = json.loads(body)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        size = sum(i.size_diff for i in after.compare_to(before, 'filename'))
+        self.assertEqual(len(response['countries_stat']), COUNTRIES)
+        report('response dicts per country', size // COUNTRIES, 'bytes')
+
+    def test_parse_columns(self):
+        rows = self.response['countries_stat']
+        parse_values = lambda: [[parse_count(row.get(column)) for row in rows] for column in Snapshot.COLUMNS]
+        parse_columns = lambda: [parse_column([row.get(column) for row in rows]) for column in Snapshot.COLUMNS]
+        report('parse counts value by value', measure(parse_values, number = 3, repeat = 3))
+        report('parse counts column by column', measure(parse_columns, number = 3, repeat = 3))
+
+    def test_streaming_parse(self):
+        body = json.dumps(self.response).encode('utf-8')
+        chunks = [body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)]
+
+        def read_then_parse():
+            return Snapshot(json.loads(b''.join(chunks).decode('utf-8')))
+
+        def stream():
+            builder = SnapshotBuilder()
+            stream = ResponseStream(on_row = builder.add)
+            first_row = None
+            for chunk in chunks:
+                if stream.feed(chunk) and first_row is None:
+                    first_row = timeit.default_timer()
+            return builder.build(stream.close()), first_row
+
+        for name, parse in (('read then parse', read_then_parse), ('streaming parse', stream)):
+            tracemalloc.start()
+            parse()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            report(f'{name} peak memory', peak, 'bytes')
+            report(f'{name} to snapshot', measure(parse, number = 3, repeat = 3))
+
+        started = timeit.default_timer()
+        _, first_row = stream()
+        report('streaming parse to first row', first_row - started)
+
+    def test_snapshot_queries(self):
+        self.assertIsNotNone(self.snapshot['sweden'])
+        report('snapshot lookup', measure(lambda: self.snapshot['Sweden'].cases, number = 10000))
+        report('snapshot top 10', measure(lambda: self.snapshot.top('deaths', 10), number = 10000))
+        report('snapshot total', measure(lambda: self.snapshot.total('cases'), number = 10000))
+
+
+@unittest.skipUnless(installed('requests', 'aiohttp'), 'requests and aiohttp are required')
+class benchmark_client(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import coronafeatureclient
+        cls.coronafeatureclient = coronafeatureclient
+        cls.server = FakeServer(synthetic_response(COUNTRIES))
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_fetch(self):
+        api_handle = self.coronafeatureclient.ApiHandle(self.server.uri('/api'), standby_hours = 0)
+        report('api fetch and parse', measure(api_handle.fetch_snapshot, number = 1, repeat = 5))
+
+    def test_query_latency(self):
+        api_handle = self.coronafeatureclient.ApiHandle(self.server.uri('/api'))
+        history = HistoryStore()
+        client = self.coronafeatureclient.Client(api_handle, str(TRANSLATION_FILE), history = history)
+        api_handle.fetch()
+
+        report('client country query', measure(lambda: client.get_by_query('cases', 'sverige')))
+        report('client fuzzy country query', measure(lambda: client.get_by_query('cases', 'sverigge')))
+        report('client total', measure(client.get_total_deaths))
+        report('client top 10', measure(lambda: client.get_top('deaths', 10)))
+        report('client trend', measure(lambda: client.get_trend('cases', 'sverige')))
+
+
+@unittest.skipUnless(installed('requests', 'aiohttp', 'discord', 'CommandIntegrator', 'feedparser'),
+                     'the dependencies of the feature are required')
+class benchmark_feature(unittest.TestCase):
+
+    class Message:
+
+        def __init__(self, text: str):
+            self.content = text.split()
+
+    def test_feature_latency(self):
+        from features.CoronaSpreadFeature import CoronaSpreadFeature
+        with FakeServer(synthetic_response(COUNTRIES), rss_feed(20)) as server:
+            started = timeit.default_timer()
+            feature = CoronaSpreadFeature(
+                CORONA_API_URI = server.uri('/api'),
+                CORONA_API_RAPIDAPI_HOST = 'localhost',
+                CORONA_API_RAPIDAPI_KEY = 'key',
+                FOLKHALSOMYNDIGHET_RSS = server.uri('/rss'),
+                translation_file_path = str(TRANSLATION_FILE))
+            report('feature construction', timeit.default_timer() - started)
+
+            message = benchmark_feature.Message('!hur många har dött i sverige')
+            feature.get_deaths_by_country(message)
+            report('feature country query', measure(lambda: feature.get_deaths_by_country(message)))
+            top = benchmark_feature.Message('!topp 10 länder med flest döda')
+            report('feature top 10', measure(lambda: feature.get_top_countries(top)))
+
+
+class benchmark_intents(unittest.TestCase):
+    """
+    Resolve the callback of a message with 500 registered
+    phrases, compiled into an IntentMatcher and, where
+    CommandIntegrator is installed, by the phrase by phrase
+    scan of FeatureCommandParserBase.
+    """
+
+    class Message:
+
+        def __init__(self, text: str):
+            self.content = text.split()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.callbacks = dict(CALLBACKS)
+        for i in range(500):
+            cls.callbacks[str({f'nyckel{i}': (f'ord{i}', f'term{i}')})] = i
+        cls.message = benchmark_intents.Message('hur många döda finns det i sverige')
+
+    def test_compiled_matcher(self):
+        matcher = IntentMatcher.compile(self.callbacks)
+        words = [i.lower() for i in self.message.content]
+        report('intent matcher', measure(lambda: matcher.match(words), number = 1000))
+
+    @unittest.skipUnless(installed('CommandIntegrator', 'discord'), 'CommandIntegrator is required')
+    def test_phrase_scan(self):
+        import CommandIntegrator as ci
+        parser = ci.FeatureCommandParserBase()
+        parser.callbacks = self.callbacks
+        report('phrase scan', measure(lambda: parser.get_callback(self.message), number = 1000))
+
+
+class benchmark_scheduled_minute(unittest.TestCase):
+    """
+    One minute of the jobs scheduled in client.py: the change
+    feed polls a new snapshot in which a tenth of the countries
+    changed, and the RSS feed is polled.
+    """
+
+    def test_one_minute_of_jobs(self):
+        response = synthetic_response(COUNTRIES)
+        router = StaticRouter()
+        router.add('cases', channel = 1, countries = ('sweden',))
+        router.add('deaths', channel = 2, exclude = ('sweden',))
+        render = ChangeRenderer({'cases': '{country}: {value}', 'deaths': '{country}: {value}'}, str.capitalize)
+
+        with FakeServer(response, rss_feed(20)) as server:
+            feed = ChangeFeed(LocalApiHandle(server.uri('/api')), router, render)
+            feed.poll()
+            rss_poller = None
+            if installed('feedparser'):
+                from rssfeed import RssPoller
+                rss_poller = RssPoller(server.uri('/rss'))
+                rss_poller.poll()
+
+            durations = []
+            for minute in range(1, 6):
+                response = grow(response, seed = minute)
+                server.response = response
+                started = timeit.default_timer()
+                pushed = feed.poll()
+                if rss_poller is not None:
+                    rss_poller.poll()
+                durations.append(timeit.default_timer() - started)
+                self.assertTrue(pushed)
+
+        report('one minute of scheduled jobs', {'min': min(durations), 'median': statistics.median(durations)})
+
+
+class benchmark_startup(unittest.TestCase):
+    """
+    Time the startup of the backend objects created in
+    client.py, from stores holding a week of snapshots,
+    in a fresh interpreter.
+    """
+
+    STARTUP = '\n'.join((
+        'import json, sys, time',
+        'started = time.perf_counter()',
+        'from snapshotstore import SnapshotStore',
+        'from history import HistoryStore',
+        'from translations import TranslationRegistry',
+        'from snapshot import Snapshot',
+        'imported = time.perf_counter()',
+        'store = SnapshotStore(sys.argv[1])',
+        'snapshot = Snapshot(store.latest()[0])',
+        'restored = time.perf_counter()',
+        'history = HistoryStore(sys.argv[2])',
+        'loaded = time.perf_counter()',
+        'translations = TranslationRegistry(sys.argv[3])',
+        'done = time.perf_counter()',
+        'print(json.dumps({"imports": imported - started, "snapshot store": restored - imported,',
+        '    "history": loaded - restored, "translations": done - loaded, "total": done - started}))'
+    ))
+
+    def test_startup(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store_path = os.path.join(directory, 'snapshots.db')
+            history_path = os.path.join(directory, 'history.bin')
+            store = SnapshotStore(store_path)
+            history = HistoryStore(history_path)
+            response = synthetic_response(COUNTRIES)
+            start = datetime(2020, 4, 8)
+            for day in range(8):
+                response = grow(response, seed = day)
+                store.save_snapshot(response, start + timedelta(days = day))
+                history.append(Snapshot(response), start + timedelta(days = day))
+            store.close()
+
+            output = subprocess.run(
+                [sys.executable, '-c', benchmark_startup.STARTUP, store_path, history_path, str(TRANSLATION_FILE)],
+                cwd = SOURCE_DIR, capture_output = True, text = True, check = True).stdout
+        for phase, seconds in json.loads(output).items():
+            report(f'startup {phase}', seconds)
+
+
+if __name__ == '__main__':
+    unittest.main()
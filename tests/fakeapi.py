@@ -0,0 +1,190 @@
+import json
+import random
+import threading
+from datetime import datetime
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+"""
+Details:
+    2020-04-15
+
+Module details:
+    Local stand-ins for the Corona Monitor API and the RSS
+    feed of Folkhälsomyndigheten.
+
+Synposis:
+    The benchmarks must not depend on RapidAPI or the network.
+    FakeServer serves an API response and an RSS feed from a
+    thread on localhost, in the format recorded from the real
+    services. The response is scaled up with synthetic countries
+    to measure how the bot copes with far larger payloads.
+"""
+
+
+TRANSLATION_FILE = Path(__file__).resolve().parent.parent / 'source' / 'country_eng_swe_translations.json'
+
+# A row as recorded from the Corona Monitor API.
+RECORDED_ROW = {
+    'country_name': 'Sweden',
+    'cases': '3,069',
+    'deaths': '105',
+    'region': '',
+    'total_recovered': '16',
+    'new_deaths': '13',
+    'new_cases': '328',
+    'serious_critical': '111',
+    'active_cases': '2,948',
+    'total_cases_per_1m_population': '303.9',
+    'deaths_per_1m_population': '10.4'
+}
+
+
+def country_names(count: int) -> list:
+    """
+    Return count country names, starting with every country
+    in the translation file and continuing with synthetic ones.
+    """
+    with open(TRANSLATION_FILE, 'r', encoding = 'utf-8') as f:
+        names = [i.title() for i in json.loads(f.read())['eng_to_swe']]
+    names.extend(f'Country {i:05}' for i in range(max(0, count - len(names))))
+    return names[:count]
+
+
+def synthetic_response(count: int, seed = 0, taken_at: datetime = None) -> dict:
+    """
+    Return an API response holding count countries, with
+    values formatted like the recorded response. Every tenth
+    country lacks some values, reported as 'N/A' or ''.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i, name in enumerate(country_names(count)):
+        cases = rng.randint(0, 100000)
+        deaths = rng.randint(0, cases // 10 + 1)
+        recovered = rng.randint(0, cases)
+        row = dict(RECORDED_ROW,
+            country_name = name,
+            cases = f'{cases:,}',
+            deaths = f'{deaths:,}',
+            total_recovered = f'{recovered:,}',
+            new_deaths = f'{rng.randint(0, 50):,}',
+            new_cases = f'{rng.randint(0, 500):,}',
+            serious_critical = f'{rng.randint(0, 300):,}',
+            active_cases = f'{cases - deaths - recovered:,}',
+            total_cases_per_1m_population = f'{rng.uniform(0, 5000):,.1f}',
+            deaths_per_1m_population = f'{rng.uniform(0, 500):,.1f}')
+        if i % 10 == 9:
+            row['total_recovered'] = 'N/A'
+            row['serious_critical'] = ''
+        rows.append(row)
+    taken_at = taken_at or datetime(2020, 4, 15, 12, 0, 0)
+    return {'countries_stat': rows, 'statistic_taken_at': taken_at.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def grow(response: dict, seed = 0, share = 0.1) -> dict:
+    """
+    Return a copy of a response where the cases and deaths
+    have increased for a share of the countries.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for row in response['countries_stat']:
+        row = dict(row)
+        if rng.random() < share:
+            for column in ('cases', 'deaths'):
+                row[column] = f'{int(row[column].replace(",", "")) + rng.randint(1, 100):,}'
+        rows.append(row)
+    return dict(response, countries_stat = rows)
+
+
+def rss_feed(count: int, published: datetime = None) -> bytes:
+    """
+    Return an RSS document with count news items, newest first.
+    """
+    published = format_datetime(published or datetime(2020, 4, 15, 12, 0, 0))
+    items = ''.join(
+        f'<item><title>Nyhet {i}</title><link>https://example.org/nyheter/{i}</link>'
+        f'<guid>https://example.org/nyheter/{i}</guid><pubDate>{published}</pubDate>'
+        f'<description>&lt;p&gt;Uppdaterad information {i}.&lt;/p&gt;</description></item>'
+        for i in range(count - 1, -1, -1))
+    return (f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel>'
+            f'<title>Folkhälsomyndigheten</title>{items}</channel></rss>').encode('utf-8')
+
+
+class FakeServer:
+    """
+    Serve an API response on /api and an RSS feed on /rss
+    from a thread on localhost. The RSS feed honors the
+    If-None-Match header. Replace response or rss to change
+    what is served, and read requests for the number of
+    requests made per path.
+    """
+
+    def __init__(self, response: dict, rss: bytes = b''):
+        self.response = response
+        self.rss = rss
+        self.requests = {}
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def response(self) -> dict:
+        return self._response
+
+    @response.setter
+    def response(self, value: dict) -> None:
+        self._response = value
+        self._body = json.dumps(value).encode('utf-8')
+
+    def uri(self, path: str) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}{path}'
+
+    def start(self) -> None:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                fake.requests[self.path] = fake.requests.get(self.path, 0) + 1
+                if self.path == '/api':
+                    self._reply(fake._body, 'application/json')
+                elif self.path == '/rss':
+                    etag = f'"{hash(fake.rss)}"'
+                    if self.headers.get('If-None-Match') == etag:
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    self._reply(fake.rss, 'application/rss+xml', etag)
+                else:
+                    self.send_error(404)
+
+            def _reply(self, body: bytes, content_type: str, etag: str = None):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if etag:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,146 @@
+import asyncio
+import time
+import unittest
+from admission import AdmissionControl
+from dispatch import CommandDispatcher
+
+
+class test_admissionControl(unittest.TestCase):
+
+    def test_user_is_limited_and_told_once(self):
+        admission = AdmissionControl(user_rate = 0.01, user_burst = 2)
+
+        async def answer():
+            return 'svar'
+
+        async def main():
+            return [await admission.run('spammare', 'kanal', f'!hur många {i}', answer) for i in range(5)]
+
+        responses = asyncio.run(main())
+        self.assertEqual(responses, ['svar', 'svar', AdmissionControl.LIMITED_RESPONSE, None, None])
+        self.assertEqual(admission.stats.admitted, 2)
+        self.assertEqual(admission.stats.limited, 3)
+        self.assertEqual(admission.stats.replied, 1)
+        self.assertEqual(asyncio.run(admission.run('någon annan', 'kanal', '!hur många', answer)), 'svar')
+
+    def test_channel_is_limited(self):
+        admission = AdmissionControl(channel_rate = 0.01, channel_burst = 1)
+
+        async def answer():
+            return 'svar'
+
+        async def main():
+            return [await admission.run(user, 'kanal', '!hur många', answer) for user in range(3)]
+
+        self.assertEqual(asyncio.run(main()), ['svar', AdmissionControl.BUSY_RESPONSE, None])
+
+    def test_identical_queries_in_progress_are_answered_once(self):
+        admission = AdmissionControl()
+        runs = []
+
+        async def answer():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            return 'svar'
+
+        async def main():
+            return await asyncio.gather(
+                admission.run('användare', 'kanal', '!hur många   i Sverige', answer),
+                admission.run('användare', 'kanal', '!Hur många i sverige', answer),
+                admission.run('annan användare', 'kanal', '!hur många i sverige', answer),
+                admission.run('tredje användare', 'annan kanal', '!hur många i sverige', answer))
+
+        self.assertEqual(asyncio.run(main()), ['svar', None, 'svar', 'svar'])
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(admission.stats.deduplicated, 2)
+        self.assertEqual(admission.stats.repeated, 1)
+        self.assertEqual(admission.in_flight, 0)
+
+    def test_personal_commands_are_not_shared(self):
+        admission = AdmissionControl(personal_words = ('prenumerera',))
+        runs = []
+
+        async def answer():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            return 'svar'
+
+        async def main():
+            return await asyncio.gather(
+                admission.run('ansvarig', 'kanal', '!prenumerera på döda', answer),
+                admission.run('användare', 'kanal', '!prenumerera på döda', answer),
+                admission.run('ansvarig', 'annan kanal', '!prenumerera på döda', answer))
+
+        self.assertEqual(asyncio.run(main()), ['svar'] * 3)
+        self.assertEqual(len(runs), 3)
+
+    def test_waiting_for_a_failed_answer_raises(self):
+        admission = AdmissionControl()
+
+        async def answer():
+            await asyncio.sleep(0.01)
+            raise ValueError('trasigt')
+
+        async def main():
+            return await asyncio.gather(
+                admission.run(1, 'kanal', '!hur', answer),
+                admission.run(2, 'kanal', '!hur', answer), return_exceptions = True)
+
+        self.assertTrue(all(isinstance(i, ValueError) for i in asyncio.run(main())))
+
+    def test_commands_beyond_capacity_are_shed(self):
+        admission = AdmissionControl(max_in_flight = 2)
+
+        async def answer():
+            await asyncio.sleep(0.05)
+            return 'svar'
+
+        async def main():
+            return await asyncio.gather(*[admission.run(user, 'kanal', f'!hur {user}', answer) for user in range(4)])
+
+        self.assertEqual(asyncio.run(main()), ['svar', 'svar', AdmissionControl.BUSY_RESPONSE, None])
+        self.assertEqual(admission.stats.shed, 2)
+
+    def test_idle_buckets_are_pruned(self):
+        admission = AdmissionControl(user_rate = 1000, channel_rate = 1000, prune_interval = 0)
+
+        async def answer():
+            return 'svar'
+
+        async def main():
+            for user in range(100):
+                await admission.run(user, user, '!hur', answer)
+            await asyncio.sleep(0.01)
+            await admission.run('användare', 'kanal', '!hur', answer)
+
+        asyncio.run(main())
+        self.assertEqual(admission.tracked, 2)
+
+    def test_flood_does_not_delay_other_users(self):
+        dispatcher = CommandDispatcher(max_workers = 2)
+        admission = AdmissionControl(max_in_flight = 8)
+
+        def expensive():
+            time.sleep(0.05)
+            return 'svar'
+
+        async def command(user, content):
+            started = time.monotonic()
+            response = await admission.run(user, 'kanal', content, lambda: dispatcher.dispatch(expensive))
+            return response, time.monotonic() - started
+
+        async def main():
+            flood = [asyncio.ensure_future(command('spammare', f'!hur {i}')) for i in range(200)]
+            await asyncio.sleep(0)
+            answered = await command('användare', '!hur')
+            await asyncio.gather(*flood)
+            return answered
+
+        response, elapsed = asyncio.run(main())
+        dispatcher.shutdown()
+        self.assertEqual(response, 'svar')
+        self.assertLess(elapsed, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from assets import AssetCache
+
+
+class test_assets(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'greeting.dat')
+        self.write('Hejsan!', mtime = 1000)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, text: str, mtime: int) -> None:
+        with open(self.path, 'w', encoding = 'utf-8') as f:
+            f.write(text)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_reloaded_when_modified(self):
+        assets = AssetCache(self.directory.name, check_interval = 0)
+        self.assertEqual(assets.get('greeting.dat'), 'Hejsan!')
+        self.write('Välkommen!', mtime = 2000)
+        self.assertEqual(asyncio.run(assets.get_async('greeting.dat')), 'Välkommen!')
+
+    def test_not_checked_within_interval(self):
+        assets = AssetCache(self.directory.name, check_interval = 60)
+        assets.get('greeting.dat')
+        self.write('Välkommen!', mtime = 2000)
+        self.assertEqual(assets.get('greeting.dat'), 'Hejsan!')
+
+    def test_kept_when_removed(self):
+        assets = AssetCache(self.directory.name, check_interval = 0)
+        assets.get('greeting.dat')
+        os.remove(self.path)
+        self.assertEqual(assets.get('greeting.dat'), 'Hejsan!')
+        with self.assertRaises(OSError):
+            assets.get('missing.dat')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+from snapshot import Snapshot
+from changes import ChangeFeed, StaticRouter, diff_since, diff_snapshots, diff_values, snapshot_values
+
+
+def make_snapshot(sweden_cases: str, norway_deaths: str) -> Snapshot:
+    return Snapshot({'countries_stat': [
+        {'country_name': 'Sweden', 'cases': sweden_cases, 'deaths': '10'},
+        {'country_name': 'Norway', 'cases': '500', 'deaths': norway_deaths}
+    ]})
+
+
+class FakeApiHandle:
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def fetch_snapshot(self):
+        return self.snapshot
+
+
+class test_changes(unittest.TestCase):
+
+    def test_diff_reports_only_changed_values(self):
+        changes = diff_snapshots(make_snapshot('1,000', '5'), make_snapshot('1,200', '5'), ('cases', 'deaths'))
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].country, 'sweden')
+        self.assertEqual((changes[0].previous, changes[0].current), (1000, 1200))
+
+    def test_missing_values_are_not_changes(self):
+        changes = diff_snapshots(make_snapshot('1,000', '5'), make_snapshot('1,000', 'N/A'), ('deaths',))
+        self.assertEqual(changes, [])
+
+    def test_feed_groups_messages_per_channel(self):
+        router = StaticRouter()
+        router.add('cases', channel = 1, countries = ('sweden',))
+        router.add('cases', channel = 2, exclude = ('sweden',))
+        router.add('deaths', channel = 2, exclude = ('sweden',))
+
+        api_handle = FakeApiHandle(make_snapshot('1,000', '5'))
+        feed = ChangeFeed(api_handle, router, lambda change, snapshot: f'{change.country} {change.current}')
+        self.assertEqual(feed.poll(), [])
+
+        api_handle.snapshot = make_snapshot('1,200', '6')
+        self.assertEqual(feed.poll(), [
+            {'channel': 1, 'result': ['sweden 1200']},
+            {'channel': 2, 'result': ['norway 6']}
+        ])
+        self.assertEqual(feed.poll(), [])
+
+    def test_diff_since_previous_snapshot_matches_full_diff(self):
+        previous = Snapshot({'countries_stat': [
+            {'country_name': 'Sweden', 'cases': '1,000', 'deaths': 'N/A'},
+            {'country_name': 'Norway', 'cases': '500', 'deaths': '5'},
+            {'country_name': 'Denmark', 'cases': '300', 'deaths': '3'}
+        ]})
+        current = Snapshot({'countries_stat': [
+            {'country_name': 'Finland', 'cases': '50', 'deaths': '1'},
+            {'country_name': 'Norway', 'cases': '500', 'deaths': '6'},
+            {'country_name': 'Sweden', 'cases': '1,200', 'deaths': '10'}
+        ]})
+        baseline = snapshot_values(previous, ('cases', 'deaths'))
+        changes = diff_since(baseline, previous, current, ('cases', 'deaths'))
+        self.assertEqual(changes, diff_values(baseline, current, ('cases', 'deaths')))
+        self.assertEqual([(i.country, i.metric) for i in changes],
+                         [('finland', 'cases'), ('finland', 'deaths'), ('norway', 'deaths'),
+                          ('sweden', 'cases'), ('sweden', 'deaths')])
+
+    def test_feed_renders_all_changes_at_once(self):
+        router = StaticRouter()
+        router.add('cases', channel = 1)
+
+        class Renderer:
+            calls = []
+
+            def render_many(self, changes, snapshot):
+                Renderer.calls.append(len(changes))
+                return [f'{i.country} {i.current}' for i in changes]
+
+        api_handle = FakeApiHandle(make_snapshot('1,000', '5'))
+        feed = ChangeFeed(api_handle, router, Renderer())
+        feed.poll()
+        api_handle.snapshot = Snapshot({'countries_stat': [
+            {'country_name': 'Norway', 'cases': '600'},
+            {'country_name': 'Sweden', 'cases': '1,200'}
+        ]})
+        self.assertEqual(feed.poll(), [{'channel': 1, 'result': ['norway 600', 'sweden 1200']}])
+        self.assertEqual(Renderer.calls, [2])
+
+    def test_newly_routed_metric_is_primed_silently(self):
+        router = StaticRouter()
+        router.add('cases', channel = 1)
+        render = lambda change, snapshot: f'{change.country} {change.metric} {change.current}'
+
+        api_handle = FakeApiHandle(make_snapshot('1,000', '5'))
+        feed = ChangeFeed(api_handle, router, render)
+        feed.poll()
+
+        router.add('deaths', channel = 1)
+        api_handle.snapshot = make_snapshot('1,200', '5')
+        self.assertEqual(feed.poll(), [{'channel': 1, 'result': ['sweden cases 1200']}])
+
+        api_handle.snapshot = make_snapshot('1,200', '6')
+        self.assertEqual(feed.poll(), [{'channel': 1, 'result': ['norway deaths 6']}])
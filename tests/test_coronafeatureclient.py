@@ -0,0 +1,290 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+import coronafeatureclient
+import metrics
+from coronafeatureclient import ApiHandle, AsyncApiHandle, Client
+from custom_errs import ApiHandleError
+from providers import Provider, ProviderGroup
+from tests.fakeapi import TRANSLATION_FILE, synthetic_response
+
+
+URI = 'https://example.com/api'
+
+
+class FakeResponse:
+    """
+    Stand-in for a streamed requests.Response.
+    """
+
+    def __init__(self, body: dict, status = 200):
+        self.body = json.dumps(body).encode('utf-8')
+        self.status = status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise coronafeatureclient.requests.HTTPError(f'{self.status} Error')
+
+    def iter_content(self, chunk_size):
+        return (self.body[i:i + chunk_size] for i in range(0, len(self.body), chunk_size))
+
+
+class FakeProvider:
+    """
+    Provider answering after a delay, counting its requests.
+    """
+
+    def __init__(self, delay = 0.05, countries = 5, fail = False):
+        self.delay = delay
+        self.countries = countries
+        self.fail = fail
+        self.requests = 0
+        self.sessions = []
+
+    async def fetch(self, session, on_row = None) -> dict:
+        self.requests += 1
+        self.sessions.append(session)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ApiHandleError('No provider returned data')
+        response = synthetic_response(self.countries)
+        for row in response['countries_stat'] if on_row else ():
+            on_row(row)
+        return response
+
+    async def close(self) -> None:
+        pass
+
+
+class test_apiHandle(unittest.TestCase):
+
+    def fetch(self, handle: ApiHandle, response: FakeResponse):
+        with mock.patch.object(coronafeatureclient.requests, 'get', lambda *args, **kwargs: response):
+            return handle.fetch()
+
+    def test_error_responses_do_not_replace_the_cache(self):
+        handle = ApiHandle(URI, standby_hours = 0)
+        installed = []
+        handle.add_listener(installed.append)
+        good = synthetic_response(5)
+        self.assertEqual(self.fetch(handle, FakeResponse(good)), good)
+
+        error = {'message': 'You are not subscribed to this API.'}
+        for response in (FakeResponse(error, status = 403), FakeResponse(error)):
+            handle._retry_at = 0
+            self.assertEqual(self.fetch(handle, response), good)
+        self.assertEqual(len(installed), 1)
+        self.assertEqual(len(handle.fetch_snapshot()), 5)
+        self.assertEqual(handle.stats.refresh_errors, 2)
+        self.assertEqual(handle.stats.stale_serves, 3)
+
+    def test_error_response_without_cache_raises(self):
+        handle = ApiHandle(URI)
+        with self.assertRaises(ApiHandleError):
+            self.fetch(handle, FakeResponse({'message': 'Too many requests'}))
+        self.assertIsNone(handle._cached_response)
+
+
+class test_asyncApiHandle(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_request(self):
+        provider = FakeProvider()
+        handle = AsyncApiHandle(None, standby_hours = 0, provider = provider)
+
+        async def main():
+            try:
+                return await asyncio.gather(*[handle.fetch_async() for _ in range(10)])
+            finally:
+                await handle.close()
+
+        responses = asyncio.run(main())
+        self.assertEqual(provider.requests, 1)
+        self.assertTrue(all(i is responses[0] for i in responses))
+        self.assertEqual(handle.stats.misses, 10)
+        self.assertEqual(handle.stats.refreshes, 1)
+
+    def test_timeout_is_applied(self):
+        provider = FakeProvider(delay = 1)
+        handle = AsyncApiHandle(None, timeout = 0.1, provider = provider)
+
+        async def main():
+            refresh = handle._refresh()
+            started = time.monotonic()
+            try:
+                # Called from another thread, fetch waits for the
+                # request on the loop for no longer than the timeout.
+                with self.assertRaises(TimeoutError):
+                    await asyncio.get_running_loop().run_in_executor(None, handle.fetch)
+                return time.monotonic() - started
+            finally:
+                refresh.cancel()
+                await handle.close()
+
+        self.assertLess(asyncio.run(main()), 0.5)
+        self.assertEqual(provider.sessions[0].timeout.total, 0.1)
+
+    def test_client_wrapper_returns_data(self):
+        handle = AsyncApiHandle(None, provider = FakeProvider(countries = 20))
+        client = Client(handle, str(TRANSLATION_FILE))
+        results = []
+        # Without an event loop, as in a scheduled job run on
+        # a thread of its own.
+        thread = threading.Thread(target = lambda: results.append(client.get_total_deaths()))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [handle.fetch_snapshot().total('deaths')])
+        self.assertGreater(results[0], 0)
+        self.assertTrue(handle._session.closed)
+
+    def test_provider_error_body_keeps_last_good_response(self):
+        class RapidApi(Provider):
+            result = synthetic_response(5)
+
+            async def _fetch(self, session, on_row = None) -> dict:
+                return self.result
+
+        provider = RapidApi('rapidapi')
+        handle = AsyncApiHandle(None, standby_hours = 0, provider = ProviderGroup([provider]))
+        installed = []
+        handle.add_listener(installed.append)
+
+        async def main():
+            try:
+                good = await handle.fetch_async()
+                provider.result = {'message': 'You are not subscribed to this API.'}
+                handle._retry_at = 0
+                return good, await handle.fetch_async()
+            finally:
+                await handle.close()
+
+        good, after = asyncio.run(main())
+        self.assertIs(after, good)
+        self.assertEqual(len(installed), 1)
+        self.assertEqual(len(installed[0]), 5)
+        self.assertEqual(handle.stats.refresh_errors, 1)
+
+    def test_store_written_in_a_thread(self):
+        threads = []
+
+        class FakeStore:
+            def latest(self):
+                return None
+
+            def save_snapshot(self, response, fetched_at):
+                threads.append(threading.current_thread())
+
+        handle = AsyncApiHandle(None, provider = FakeProvider(), store = FakeStore())
+
+        async def main():
+            try:
+                await handle.fetch_async()
+                await asyncio.sleep(0.05)
+            finally:
+                await handle.close()
+
+        asyncio.run(main())
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    def test_sync_fetch_is_timed_once(self):
+        handle = AsyncApiHandle(URI, standby_hours = 0)
+        histogram = lambda: metrics.registry.histogram('corona_api_fetch_seconds', function = 'fetch')
+        before = histogram().count if histogram() else 0
+        with mock.patch.object(coronafeatureclient.requests, 'get', lambda *args, **kwargs: FakeResponse(synthetic_response(5))):
+            handle.fetch()
+        self.assertEqual(histogram().count - before, 1)
+
+
+class test_staleWhileRevalidate(unittest.TestCase):
+
+    @staticmethod
+    def expire(handle: ApiHandle, age: timedelta) -> None:
+        handle._install(handle._cached_response, fetched_at = datetime.now() - age)
+
+    def test_last_good_response_served_during_and_after_failed_refresh(self):
+        provider = FakeProvider()
+        handle = AsyncApiHandle(None, stale_while_revalidate = True, provider = provider)
+
+        async def main():
+            try:
+                good = await handle.fetch_async()
+                provider.fail = True
+                test_staleWhileRevalidate.expire(handle, timedelta(hours = 3))
+                during = await handle.fetch_async()
+                self.assertFalse(handle._inflight.done())
+                await asyncio.sleep(0.1)
+                after = await handle.fetch_async()
+                return good, during, after
+            finally:
+                await handle.close()
+
+        good, during, after = asyncio.run(main())
+        self.assertIs(during, good)
+        self.assertIs(after, good)
+        self.assertEqual(handle.stats.stale_serves, 2)
+        self.assertEqual(handle.stats.refresh_errors, 1)
+        self.assertEqual(provider.requests, 2)
+
+    def test_backoff_grows_within_max_backoff(self):
+        handle = ApiHandle(URI, timeout = 10, max_backoff = 60)
+        for failures in range(1, 10):
+            handle._record_failure()
+            delay = handle._retry_at - time.monotonic()
+            backoff = min(60, 10 * 2 ** (failures - 1))
+            self.assertGreaterEqual(delay, backoff / 2 - 1)
+            self.assertLessEqual(delay, backoff)
+        self.assertLessEqual(handle._retry_at - time.monotonic(), 60)
+
+    def test_standby_longer_than_a_day(self):
+        handle = ApiHandle(URI, standby_hours = 2)
+        handle._install(synthetic_response(5), fetched_at = datetime.now())
+        test_staleWhileRevalidate.expire(handle, timedelta(hours = 25))
+        self.assertTrue(handle._is_expired())
+
+        handle = ApiHandle(URI, standby_hours = 48)
+        handle._install(synthetic_response(5), fetched_at = datetime.now())
+        test_staleWhileRevalidate.expire(handle, timedelta(hours = 30))
+        self.assertFalse(handle._is_expired())
+        test_staleWhileRevalidate.expire(handle, timedelta(hours = 49))
+        self.assertTrue(handle._is_expired())
+
+    def test_background_refresh_before_expiry(self):
+        ages = []
+        handle = None
+
+        class Provider(FakeProvider):
+            async def fetch(self, session, on_row = None) -> dict:
+                ages.append(handle._age())
+                return await super().fetch(session, on_row)
+
+        # Expires after 0.2 seconds, refreshed after 0.1.
+        handle = AsyncApiHandle(None, standby_hours = 0.2 / 3600, refresh_ahead = 0.5,
+                                provider = Provider(delay = 0))
+        handle._install(synthetic_response(5), fetched_at = datetime.now())
+
+        async def main():
+            handle.start_background_refresh()
+            try:
+                await asyncio.sleep(0.15)
+            finally:
+                await handle.close()
+
+        asyncio.run(main())
+        self.assertEqual(len(ages), 1)
+        self.assertLess(ages[0], 0.2)
+        self.assertEqual(handle.stats.refreshes, 1)
+        self.assertEqual(handle.stats.stale_serves, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
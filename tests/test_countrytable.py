@@ -0,0 +1,36 @@
+import unittest
+from array import array
+from countrytable import CountryTable, parse_column
+
+
+class test_countrytable(unittest.TestCase):
+
+    def test_parse_column(self):
+        column, missing = parse_column(['12,345', 'N/A', '', None, 7, '1,000,000'])
+        self.assertEqual(column, array('q', [12345, 0, 0, 0, 7, 1000000]))
+        self.assertEqual(missing, bytearray([0, 1, 1, 1, 0, 0]))
+
+    def test_parse_rates_and_empty_columns(self):
+        column, missing = parse_column(['2,429.6', '0.5'], 'd')
+        self.assertEqual(list(column), [2429.6, 0.5])
+        self.assertFalse(any(missing))
+        self.assertEqual(parse_column([]), (array('q'), bytearray()))
+
+    def test_value_holding_the_separator(self):
+        column, missing = parse_column(['1\n2', '3'])
+        self.assertEqual(list(missing), [1, 0])
+        self.assertEqual(column[1], 3)
+
+    def test_table(self):
+        rows = [{'cases': '10', 'deaths': 'N/A'}, {'cases': '20', 'deaths': '2'}]
+        table = CountryTable(('sweden', 'norway'), ('Sweden', 'Norway'), rows, ('cases', 'deaths'))
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.value(table.index['norway'], 'deaths'), 2)
+        self.assertIsNone(table.value(table.index['sweden'], 'deaths'))
+        self.assertEqual(list(table.present('deaths')), [('norway', 2)])
+        self.assertEqual(list(table.present('cases')), [('sweden', 10), ('norway', 20)])
+        self.assertGreater(table.nbytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
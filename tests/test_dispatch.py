@@ -0,0 +1,86 @@
+import asyncio
+import time
+import unittest
+from dispatch import CommandDispatcher
+
+
+class test_commandDispatcher(unittest.TestCase):
+
+    def test_command_of(self):
+        self.assertEqual(CommandDispatcher.command_of('!Hur många har dött i sverige'), 'hur')
+        self.assertEqual(CommandDispatcher.command_of(''), '')
+
+    def test_blocking_callbacks_run_concurrently(self):
+        dispatcher = CommandDispatcher(max_workers = 4)
+
+        def blocking():
+            time.sleep(0.1)
+            return 'svar'
+
+        async def main():
+            started = time.monotonic()
+            results = await asyncio.gather(*[dispatcher.dispatch(blocking) for _ in range(4)])
+            return results, time.monotonic() - started
+
+        results, elapsed = asyncio.run(main())
+        dispatcher.shutdown()
+        self.assertEqual(results, ['svar'] * 4)
+        self.assertLess(elapsed, 0.3)
+
+    def test_awaitable_results_are_awaited_on_the_loop(self):
+        dispatcher = CommandDispatcher()
+
+        async def answer():
+            return 'asynkront'
+
+        self.assertEqual(asyncio.run(dispatcher.dispatch(answer)), 'asynkront')
+        self.assertEqual(asyncio.run(dispatcher.dispatch(lambda: answer())), 'asynkront')
+        dispatcher.shutdown()
+
+    def test_per_command_timeout(self):
+        dispatcher = CommandDispatcher(timeout = 5, timeouts = {'hur': 0.05})
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(dispatcher.dispatch(time.sleep, 0.2, command = 'hur'))
+        dispatcher.shutdown()
+
+    def test_timed_out_blocking_callbacks_keep_their_slot(self):
+        dispatcher = CommandDispatcher(max_workers = 2, timeout = 0.05)
+        released = []
+
+        def stuck():
+            time.sleep(0.3)
+            released.append(time.monotonic())
+
+        async def main():
+            for result in await asyncio.gather(dispatcher.dispatch(stuck), dispatcher.dispatch(stuck),
+                                               return_exceptions = True):
+                self.assertIsInstance(result, asyncio.TimeoutError)
+            # Both threads are still busy, so a further command
+            # times out waiting for a slot, not queued in the pool.
+            started = time.monotonic()
+            with self.assertRaises(asyncio.TimeoutError):
+                await dispatcher.dispatch(lambda: 'svar')
+            waited = time.monotonic() - started
+            await asyncio.sleep(0.3)
+            return waited, await dispatcher.dispatch(lambda: 'svar')
+
+        waited, result = asyncio.run(main())
+        dispatcher.shutdown()
+        self.assertLess(waited, 0.2)
+        self.assertEqual(len(released), 2)
+        self.assertEqual(result, 'svar')
+
+    def test_timed_out_coroutines_are_cancelled(self):
+        dispatcher = CommandDispatcher(max_workers = 1, timeout = 0.05)
+
+        async def stuck():
+            await asyncio.sleep(10)
+
+        async def main():
+            with self.assertRaises(asyncio.TimeoutError):
+                await dispatcher.dispatch(stuck)
+            await asyncio.sleep(0)
+            return await dispatcher.dispatch(lambda: 'svar')
+
+        self.assertEqual(asyncio.run(main()), 'svar')
+        dispatcher.shutdown()
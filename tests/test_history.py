@@ -0,0 +1,74 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from snapshot import Snapshot
+from history import HistoryStore
+
+
+START = datetime(2020, 4, 1, 12, 0)
+
+
+def make_snapshot(cases: int) -> Snapshot:
+    return Snapshot({'countries_stat': [
+        {'country_name': 'Sweden', 'cases': f'{cases:,}', 'deaths': 'N/A'}
+    ]})
+
+
+class test_historyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'history.bin')
+        self.history = HistoryStore(self.path)
+        for day in range(8):
+            self.history.append(make_snapshot(round(1000 * 2 ** (day / 7))), START + timedelta(days = day))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_increase_and_average(self):
+        self.assertEqual(self.history.increase('sweden', 'cases', days = 7), 1000)
+        self.assertAlmostEqual(self.history.average_increase('sweden', 'cases', days = 7), 1000 / 7)
+        self.assertEqual(len(self.history.daily_increases('sweden', 'cases', days = 7)), 7)
+
+    def test_doubling_time(self):
+        self.assertAlmostEqual(self.history.doubling_time('sweden', 'cases', days = 7), 7, places = 1)
+
+    def test_lacking_history(self):
+        self.assertIsNone(self.history.increase('sweden', 'cases', days = 30))
+        self.assertIsNone(self.history.latest('sweden', 'deaths'))
+        self.assertRaises(KeyError, self.history.series, 'narnia', 'cases')
+
+    def test_only_newer_snapshots_are_appended(self):
+        self.assertFalse(self.history.append(make_snapshot(1), START))
+
+    def test_reloaded_from_disk(self):
+        reloaded = HistoryStore(self.path)
+        self.assertEqual(reloaded.series('sweden', 'cases'), self.history.series('sweden', 'cases'))
+        self.assertEqual(reloaded.latest('sweden', 'cases'), 2000)
+
+    def test_appended_on_the_loop_written_in_a_thread(self):
+        threads = []
+        write = HistoryStore._write
+
+        def recording_write(store, records, countries):
+            threads.append(threading.current_thread())
+            write(store, records, countries)
+
+        async def main():
+            for day in range(8, 12):
+                self.history.append(make_snapshot(2000 + day), START + timedelta(days = day))
+
+        with mock.patch.object(HistoryStore, '_write', recording_write):
+            asyncio.run(main())
+            self.history.close()
+        self.assertEqual(len(threads), 4)
+        self.assertNotIn(threading.main_thread(), threads)
+        reloaded = HistoryStore(self.path)
+        self.assertEqual(reloaded.series('sweden', 'cases'), self.history.series('sweden', 'cases'))
+        self.assertEqual(reloaded.latest('sweden', 'cases'), 2011)
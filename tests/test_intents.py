@@ -0,0 +1,66 @@
+import unittest
+from intents import IntentMatcher
+
+
+CALLBACKS = {
+    str({'totalt': ('dött', 'omkommit', 'döda')}): 'total_deaths',
+    str({'totalt': ('smittade', 'smittats', 'sjuka')}): 'total_cases',
+    str({'har': ('dött', 'omkommit', 'döda')}): 'deaths_by_country',
+    str({'flest': ('döda', 'dödsfall')}): 'most_deaths',
+    str({'topp': ('döda', 'dödsfall', 'smittade')}): 'top_countries',
+    'döda': 'deaths_by_country_word',
+    'smittade': 'cases_by_country_word'
+}
+
+
+def scan_phrases(phrases: list, words: list):
+    """
+    Reference matcher reading the message word by word and
+    testing every registered phrase against each word.
+    """
+    for word in words:
+        for trigger, callback in phrases:
+            if isinstance(trigger, dict) and word in trigger and any(i in words for i in trigger[word]):
+                return callback
+        for trigger, callback in phrases:
+            if trigger == word:
+                return callback
+
+
+class test_intentMatcher(unittest.TestCase):
+
+    matcher = IntentMatcher.compile(CALLBACKS)
+
+    def test_compound_triggers(self):
+        self.assertEqual(test_intentMatcher.matcher.match('totalt antal döda'.split()), 'total_deaths')
+        self.assertEqual(test_intentMatcher.matcher.match('var finns flest döda'.split()), 'most_deaths')
+
+    def test_compound_before_single_words(self):
+        self.assertEqual(test_intentMatcher.matcher.match('hur många har dött i sverige'.split()), 'deaths_by_country')
+        self.assertEqual(test_intentMatcher.matcher.match('döda i sverige'.split()), 'deaths_by_country_word')
+
+    def test_first_word_of_the_message_wins(self):
+        # most_deaths is registered first, but 'topp' comes
+        # before 'flest' in the message.
+        words = 'topp 10 länder med flest döda'.split()
+        self.assertEqual(test_intentMatcher.matcher.match(words), 'top_countries')
+        self.assertEqual(test_intentMatcher.matcher.match('hur många har totalt dött'.split()), 'deaths_by_country')
+
+    def test_qualifier_must_belong_to_keyword(self):
+        self.assertEqual(test_intentMatcher.matcher.match('flest smittade'.split()), 'cases_by_country_word')
+        self.assertIsNone(test_intentMatcher.matcher.match('totalt'.split()))
+
+    def test_same_callbacks_as_phrase_scan(self):
+        callbacks = dict(CALLBACKS)
+        for i in range(500):
+            callbacks[str({f'nyckel{i}': (f'ord{i}', 'döda')})] = i
+        phrases = [(IntentMatcher.parse_trigger(key), value) for key, value in callbacks.items()]
+        matcher = IntentMatcher.compile(callbacks)
+        for message in ('hur många döda finns det i sverige', 'topp 10 länder med flest döda',
+                        'ord3 nyckel3 döda', 'döda nyckel7', 'smittade totalt', 'inget alls', ''):
+            words = message.split()
+            self.assertEqual(matcher.match(words), scan_phrases(phrases, words), message)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from ipc import Publisher, Subscriber
+from refreshworker import RefreshWorker
+
+
+class test_ipc(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'refresh.sock')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_subscribers_receive_retained_and_later_events(self):
+        received = []
+
+        async def exchange():
+            publisher = Publisher(self.path)
+            await publisher.start()
+            publisher.publish({'type': 'snapshot', 'response': {'countries_stat': []}}, retain = True)
+            publisher.publish({'type': 'messages', 'messages': ['lost']})
+
+            subscribers = [Subscriber(self.path, {
+                'snapshot': received.append,
+                'messages': received.append
+            }) for _ in range(2)]
+            tasks = [asyncio.create_task(i.run()) for i in subscribers]
+            while publisher.subscribers < 2:
+                await asyncio.sleep(0.01)
+            publisher.publish({'type': 'messages', 'messages': ['hej']})
+            while len(received) < 4:
+                await asyncio.sleep(0.01)
+            for task in tasks:
+                task.cancel()
+            await publisher.close()
+
+        asyncio.run(asyncio.wait_for(exchange(), 5))
+        self.assertEqual([i['type'] for i in received].count('snapshot'), 2)
+        self.assertEqual([i for i in received if i['type'] == 'messages'], [{'type': 'messages', 'messages': ['hej']}] * 2)
+
+    def test_subscriber_reconnects(self):
+        received = []
+
+        async def exchange():
+            subscriber = Subscriber(self.path, {'messages': received.append}, max_backoff = 0.05)
+            task = asyncio.create_task(subscriber.run())
+            await asyncio.sleep(0.1)
+            for i in range(2):
+                publisher = Publisher(self.path)
+                await publisher.start()
+                while publisher.subscribers < 1:
+                    await asyncio.sleep(0.01)
+                publisher.publish({'type': 'messages', 'messages': [i]})
+                while len(received) < i + 1:
+                    await asyncio.sleep(0.01)
+                await publisher.close()
+            task.cancel()
+
+        asyncio.run(asyncio.wait_for(exchange(), 5))
+        self.assertEqual([i['messages'] for i in received], [[0], [1]])
+
+    def test_worker_publishes_job_results_per_channel(self):
+        published = []
+
+        class FakePublisher:
+            def publish(self, event, retain = False):
+                published.append(event)
+
+        worker = RefreshWorker(None, None, FakePublisher(), default_channel = 1)
+        asyncio.run(worker.publish_result([{'channel': 2, 'result': ['a', 'b']}]))
+        asyncio.run(worker.publish_result('c'))
+        asyncio.run(worker.publish_result(None))
+        self.assertEqual(published[0]['messages'], [{'channel': 2, 'message': 'a'}, {'channel': 2, 'message': 'b'}])
+        self.assertEqual(published[1]['messages'], [{'channel': 1, 'message': 'c'}])
+        self.assertEqual(len(published), 2)
+
+    def test_worker_publishes_when_the_snapshot_was_fetched(self):
+        published = []
+        fetched_at = datetime(2020, 4, 17, 8, 30)
+
+        class FakePublisher:
+            def publish(self, event, retain = False):
+                published.append(event)
+
+        class FakeApiHandle:
+            fetched_at = None
+
+        class FakeSnapshot:
+            raw = {'countries_stat': []}
+
+        async def main():
+            worker._loop = asyncio.get_running_loop()
+            api_handle.fetched_at = fetched_at
+            worker.publish_snapshot(FakeSnapshot())
+            # Replaced before the event is published.
+            api_handle.fetched_at = datetime.now()
+            await asyncio.sleep(0)
+
+        api_handle = FakeApiHandle()
+        worker = RefreshWorker(api_handle, None, FakePublisher(), default_channel = 1)
+        asyncio.run(main())
+        self.assertEqual(published, [{'type': 'snapshot', 'response': {'countries_stat': []},
+                                      'fetched_at': '2020-04-17T08:30:00'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
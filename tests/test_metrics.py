@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+from metrics import Histogram, MetricsRegistry, serve
+
+
+class test_metrics(unittest.TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram(buckets = (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [(0.1, 2), (1, 3), (float('inf'), 4)])
+        self.assertEqual(histogram.count, 4)
+
+    def test_timed_functions_are_labelled_by_name(self):
+        registry = MetricsRegistry()
+
+        @registry.timed('handler_seconds')
+        def handler():
+            return 1
+
+        @registry.timed('handler_seconds')
+        async def async_handler():
+            return 2
+
+        self.assertEqual(handler(), 1)
+        self.assertEqual(asyncio.run(async_handler()), 2)
+        self.assertEqual(registry.histogram('handler_seconds', function = 'handler').count, 1)
+        self.assertEqual(registry.histogram('handler_seconds', function = 'async_handler').count, 1)
+
+    def test_failures_are_timed(self):
+        registry = MetricsRegistry()
+        with self.assertRaises(ValueError):
+            with registry.timed('block_seconds', block = 'x'):
+                raise ValueError()
+        self.assertEqual(registry.histogram('block_seconds', block = 'x').count, 1)
+
+    def test_render_prometheus_text(self):
+        registry = MetricsRegistry(buckets = (1,))
+        registry.observe('send_seconds', 0.5, channel = 'a')
+        registry.gauge('queue_depth', lambda: 3)
+        registry.gauge('broken', lambda: 1 / 0)
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE send_seconds histogram', lines)
+        self.assertIn('send_seconds_bucket{channel="a",le="1.0"} 1', lines)
+        self.assertIn('send_seconds_bucket{channel="a",le="+Inf"} 1', lines)
+        self.assertIn('send_seconds_count{channel="a"} 1', lines)
+        self.assertIn('queue_depth 3', lines)
+        self.assertFalse(any(i.startswith('broken ') for i in lines))
+
+    def test_serve_answers_with_metrics(self):
+        registry = MetricsRegistry()
+        registry.observe('on_message_seconds', 0.2)
+
+        async def scrape():
+            server = await serve(port = 0, registry = registry)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response.decode('utf-8')
+
+        response = asyncio.run(scrape())
+        self.assertTrue(response.startswith('HTTP/1.1 200 OK'))
+        self.assertIn('on_message_seconds_count 1', response)
+
+
+if __name__ == '__main__':
+    unittest.main()
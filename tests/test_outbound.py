@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+from outbound import DirectMessageQueue, Priority, SendQueue, split_message
+from ratelimit import TokenBucket
+
+
+class FakeChannel:
+
+    def __init__(self, id):
+        self.id = id
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class FakeMember:
+
+    def __init__(self, failures = 0, status = 500):
+        self.dm_channel = None
+        self.failures = failures
+        self.status = status
+        self.attempts = 0
+        self.sent = []
+
+    async def create_dm(self):
+        self.dm_channel = self
+        return self
+
+    async def send(self, message):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            error = Exception('send failed')
+            error.status = self.status
+            raise error
+        self.sent.append(message)
+
+
+class test_sendQueue(unittest.TestCase):
+
+    def test_split_message_on_line_breaks(self):
+        self.assertEqual(split_message('aaaa\nbbbb\ncc', 9), ['aaaa\nbbbb', 'cc'])
+        self.assertEqual(split_message('abcdefgh', 3), ['abc', 'def', 'gh'])
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate = 1, capacity = 2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.assertGreater(bucket.delay(), 0)
+
+    def test_bulk_messages_are_merged_and_replies_go_first(self):
+        channel = FakeChannel(1)
+        queue = SendQueue(lambda id: channel, max_length = 30, rate = 100, burst = 1)
+
+        async def main():
+            await queue.send(channel, 'först')
+            for i in range(5):
+                queue.post(1, f'ändring {i}')
+            await queue.send(channel, 'svar')
+            while queue.depth():
+                await asyncio.sleep(0.01)
+            queue.close()
+
+        asyncio.run(main())
+        self.assertEqual(channel.sent, ['först', 'svar', 'ändring 0\nändring 1\nändring 2', 'ändring 3\nändring 4'])
+        self.assertEqual(queue.stats.delivered, 7)
+        self.assertEqual(queue.stats.sent, 4)
+
+
+class test_directMessageQueue(unittest.TestCase):
+
+    def test_messages_are_sent_with_retries(self):
+        members = [FakeMember() for _ in range(20)]
+        flaky, refusing = FakeMember(failures = 2), FakeMember(failures = 1, status = 403)
+        queue = DirectMessageQueue(concurrency = 3, retries = 2, backoff = 0.001)
+
+        async def main():
+            for member in members + [flaky, refusing]:
+                queue.post(member, 'hej')
+            await queue.join()
+            queue.close()
+
+        asyncio.run(main())
+        self.assertTrue(all(i.sent == ['hej'] for i in members + [flaky]))
+        self.assertEqual((refusing.attempts, refusing.sent), (1, []))
+        self.assertEqual(queue.stats.as_dict(), {'queued': 22, 'sent': 21, 'retried': 2, 'failed': 1, 'dropped': 0})
+
+    def test_full_queue_drops_messages(self):
+        queue = DirectMessageQueue(concurrency = 1, max_pending = 2)
+
+        async def main():
+            return [queue.post(FakeMember(), 'hej') for _ in range(4)]
+
+        self.assertEqual(asyncio.run(main()), [True, True, False, False])
+        self.assertEqual(queue.stats.dropped, 2)
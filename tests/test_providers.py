@@ -0,0 +1,131 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from custom_errs import ApiHandleError
+from providers import FileProvider, Provider, ProviderGroup, RestProvider, merge_responses
+from snapshot import Snapshot
+
+
+def response(taken_at: str, **cases) -> dict:
+    return {
+        'statistic_taken_at': taken_at,
+        'countries_stat': [{'country_name': name, 'cases': value, 'deaths': '1'} for name, value in cases.items()]
+    }
+
+
+class FakeProvider(Provider):
+
+    def __init__(self, name: str, result, delay = 0.0, timeout = 1):
+        super().__init__(name, timeout)
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+
+    async def _fetch(self, session, on_row = None) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class test_providers(unittest.TestCase):
+
+    def test_latest_source_wins_and_missing_values_fall_back(self):
+        merged = merge_responses({
+            'old': response('2020-04-01 10:00:00', Sweden = '100', Norway = '50'),
+            'new': response('2020-04-02 10:00:00', Sweden = '120', Norway = 'N/A')
+        })
+        snapshot = Snapshot(merged)
+        self.assertEqual(snapshot['sweden'].cases, 120)
+        self.assertEqual(snapshot['norway'].cases, 50)
+        self.assertEqual(snapshot['sweden'].raw['provenance']['cases'], 'new')
+        self.assertEqual(snapshot['norway'].raw['provenance']['cases'], 'old')
+        self.assertEqual(merged['statistic_taken_at'], '2020-04-02 10:00:00')
+
+    def test_rest_provider_normalizes_fields(self):
+        provider = RestProvider('https://example.org', taken_at = 'updated', fields = {
+            'country_name': 'country', 'cases': 'cases', 'deaths_per_1m_population': 'deathsPerOneMillion'})
+        normalized = provider.normalize([
+            {'country': 'Sweden', 'cases': 12345, 'deathsPerOneMillion': 10.44, 'updated': 1586000000000},
+            {'country': 'Norway', 'cases': None, 'deathsPerOneMillion': 2, 'updated': 1585000000000}
+        ])
+        snapshot = Snapshot(normalized)
+        self.assertEqual(normalized['countries_stat'][0]['cases'], '12,345')
+        self.assertEqual(snapshot['sweden'].deaths_per_1m_population, 10.4)
+        self.assertIsNone(snapshot['norway'].cases)
+
+    def test_file_provider_reads_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.csv')
+            with open(path, 'w', encoding = 'utf-8') as f:
+                f.write('country_name,cases,deaths\nSweden,"1,000",10\n')
+            dump = FileProvider(path).read()
+        self.assertEqual(Snapshot(dump)['sweden'].cases, 1000)
+        self.assertIsNotNone(dump['statistic_taken_at'])
+
+    def test_fetch_waits_for_the_fastest_source_only(self):
+        fast = FakeProvider('fast', response('2020-04-01 10:00:00', Sweden = '100'))
+        slow = FakeProvider('slow', response('2020-04-02 10:00:00', Sweden = '200'), delay = 0.5)
+        group = ProviderGroup([fast, slow], grace = 0.05)
+
+        async def refresh_twice():
+            started = time.monotonic()
+            first = await group.fetch(None)
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(0.6)
+            second = await group.fetch(None)
+            return first, elapsed, second
+
+        first, elapsed, second = asyncio.run(refresh_twice())
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual(Snapshot(first)['sweden'].cases, 100)
+        self.assertEqual(Snapshot(second)['sweden'].cases, 200)
+        self.assertEqual(group.stats['slow'].successes, 1)
+
+    def test_failing_source_falls_back_on_the_others(self):
+        down = FakeProvider('down', ConnectionError('down'))
+        hanging = FakeProvider('hanging', None, delay = 5, timeout = 0.05)
+        up = FakeProvider('up', response('2020-04-01 10:00:00', Sweden = '100'), delay = 0.01)
+        group = ProviderGroup([down, hanging, up], grace = 0.1)
+        merged = asyncio.run(group.fetch(None))
+        self.assertEqual(Snapshot(merged)['sweden'].cases, 100)
+        self.assertEqual(group.stats['down'].failures, 1)
+        self.assertEqual(group.stats['hanging'].failures, 1)
+
+    def test_every_source_failing_raises(self):
+        group = ProviderGroup([FakeProvider('down', ConnectionError('down'))])
+        with self.assertRaises(ApiHandleError):
+            asyncio.run(group.fetch(None))
+
+    def test_responses_without_countries_are_failures(self):
+        provider = FakeProvider('rapidapi', response('2020-04-01 10:00:00', Sweden = '100'))
+        group = ProviderGroup([provider])
+        asyncio.run(group.fetch(None))
+
+        for result in ({'message': 'You are not subscribed to this API.'}, {'countries_stat': []}):
+            provider.result = result
+            with self.assertRaises(ApiHandleError):
+                asyncio.run(group.fetch(None))
+        self.assertEqual(group.stats['rapidapi'].successes, 1)
+        self.assertEqual(group.stats['rapidapi'].failures, 2)
+        self.assertEqual(group._responses['rapidapi']['countries_stat'][0]['cases'], '100')
+
+    def test_merged_rows_are_handed_on(self):
+        group = ProviderGroup([
+            FakeProvider('old', response('2020-04-01 10:00:00', Sweden = '100', Norway = '50')),
+            FakeProvider('new', response('2020-04-02 10:00:00', Sweden = '120'))], grace = 0.1)
+        rows = []
+        merged = asyncio.run(group.fetch(None, on_row = rows.append))
+        self.assertEqual(rows, merged['countries_stat'])
+
+        provider = FakeProvider('file', response('2020-04-01 10:00:00', Sweden = '100'))
+        rows = []
+        asyncio.run(provider.fetch(None, on_row = rows.append))
+        self.assertEqual([i['country_name'] for i in rows], ['Sweden'])
+
+
+if __name__ == '__main__':
+    unittest.main()
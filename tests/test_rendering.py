@@ -0,0 +1,44 @@
+import unittest
+from changes import Change
+from rendering import THOUSANDS_SEPARATOR, ChangeRenderer, format_count, format_counts, new_word
+from snapshot import Snapshot
+
+
+class test_rendering(unittest.TestCase):
+
+    def test_swedish_thousand_separators(self):
+        self.assertEqual(format_counts([4947, 215417, 12, 1000000]),
+                         ['4\u00a0947', '215\u00a0417', '12', '1\u00a0000\u00a0000'])
+        self.assertEqual(format_count(-1234), '-1\u00a0234')
+        self.assertEqual(format_counts([]), [])
+        self.assertEqual(THOUSANDS_SEPARATOR, '\u00a0')
+
+    def test_new_word(self):
+        self.assertEqual([new_word(i) for i in (0, 1, 2)], ['nytt', 'nytt', 'nya'])
+
+    def test_renders_changes_together(self):
+        names = {'sweden': 'Sverige'}
+        looked_up = []
+
+        def country_name(country):
+            looked_up.append(country)
+            return names.get(country)
+
+        renderer = ChangeRenderer({
+            'cases': 'Totalt {value} har smittats i {country}',
+            'new_cases': '{value} {new} fall i {country}'
+        }, country_name)
+        changes = [
+            Change('sweden', 'cases', 4000, 4947),
+            Change('sweden', 'new_cases', 0, 1),
+            Change('narnia', 'cases', None, 10),
+            Change('sweden', 'deaths', 200, 239)
+        ]
+        self.assertEqual(renderer.render_many(changes, Snapshot({})), [
+            'Totalt 4\u00a0947 har smittats i Sverige', '1 nytt fall i Sverige', None, None])
+        self.assertEqual(looked_up, ['sweden', 'narnia'])
+        self.assertEqual(renderer(changes[0], Snapshot({})), 'Totalt 4\u00a0947 har smittats i Sverige')
+
+
+if __name__ == '__main__':
+    unittest.main()
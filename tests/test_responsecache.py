@@ -0,0 +1,68 @@
+import unittest
+from snapshot import Snapshot
+from responsecache import ResponseCache, memoized_response
+
+
+class FakeFeature:
+
+    def __init__(self):
+        self.response_cache = ResponseCache(max_size = 2)
+        self.calls = 0
+
+    @memoized_response(key = lambda country: country.lower())
+    def get_cases_by_country(self, country):
+        self.calls += 1
+        return f'{country} {self.calls}'
+
+    @memoized_response()
+    def get_nothing(self):
+        self.calls += 1
+        return None
+
+
+class test_responsecache(unittest.TestCase):
+
+    def test_hits_are_served_without_calling(self):
+        feature = FakeFeature()
+        self.assertEqual(feature.get_cases_by_country('Sverige'), 'Sverige 1')
+        self.assertEqual(feature.get_cases_by_country('sverige'), 'Sverige 1')
+        self.assertEqual(feature.calls, 1)
+        self.assertEqual(feature.response_cache.stats.hit_rate, 0.5)
+
+    def test_new_snapshot_invalidates(self):
+        feature = FakeFeature()
+        feature.get_cases_by_country('Sverige')
+        snapshot = Snapshot({'countries_stat': []})
+        feature.response_cache.invalidate(snapshot)
+        self.assertEqual(feature.response_cache.version, snapshot.version)
+        self.assertEqual(feature.get_cases_by_country('Sverige'), 'Sverige 2')
+
+    def test_least_recently_used_is_evicted(self):
+        feature = FakeFeature()
+        feature.get_cases_by_country('Sverige')
+        feature.get_cases_by_country('Norge')
+        feature.get_cases_by_country('Sverige')
+        feature.get_cases_by_country('Danmark')
+        self.assertEqual(feature.response_cache.stats.evictions, 1)
+        self.assertEqual(feature.get_cases_by_country('Sverige'), 'Sverige 1')
+        self.assertEqual(feature.get_cases_by_country('Norge'), 'Norge 4')
+
+    def test_responses_from_before_invalidation_are_discarded(self):
+        cache = ResponseCache()
+        version = cache.version
+        cache.invalidate()
+        cache.put('key', 'stale', version)
+        self.assertIsNone(cache.get('key'))
+
+    def test_none_and_keyword_calls_are_not_cached(self):
+        feature = FakeFeature()
+        feature.get_nothing()
+        feature.get_nothing()
+        feature.get_cases_by_country(country = 'Sverige')
+        feature.get_cases_by_country(country = 'Sverige')
+        self.assertEqual(feature.calls, 4)
+        self.assertEqual(len(feature.response_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
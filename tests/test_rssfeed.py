@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+import rssfeed
+from rssfeed import RssPoller
+
+
+class FakeFeed(dict):
+    """
+    Result of feedparser.parse, a dictionary whose entries
+    are also read as an attribute.
+    """
+
+    def __init__(self, entries = (), **values):
+        super().__init__(entries = list(entries), **values)
+
+    @property
+    def entries(self):
+        return self['entries']
+
+
+def entry(number: int) -> dict:
+    return {'id': f'nyhet-{number}', 'title': f'Nyhet {number}'}
+
+
+class test_rssPoller(unittest.TestCase):
+
+    def poll(self, poller: RssPoller, feed: FakeFeed, calls: list = None) -> list:
+        def parse(uri, etag = None, modified = None):
+            if calls is not None:
+                calls.append((etag, modified))
+            return feed
+        with mock.patch.object(rssfeed.feedparser, 'parse', parse):
+            return poller.poll()
+
+    def test_not_modified_keeps_validators(self):
+        poller = RssPoller('https://example.com/feed')
+        self.poll(poller, FakeFeed([entry(1)], status = 200, etag = '"a"', modified = 'Mon, 20 Apr 2020'))
+
+        calls = []
+        self.assertEqual(self.poll(poller, FakeFeed(status = 304), calls), [])
+        self.poll(poller, FakeFeed(status = 304), calls)
+        self.assertEqual(calls, [('"a"', 'Mon, 20 Apr 2020')] * 2)
+
+    def test_new_entries_oldest_first_and_not_repeated(self):
+        poller = RssPoller('https://example.com/feed')
+        self.assertEqual(self.poll(poller, FakeFeed([entry(1)], status = 200)), [])
+
+        # Feeds list the newest entry first.
+        feed = FakeFeed([entry(3), entry(2), entry(1)], status = 200)
+        self.assertEqual(self.poll(poller, feed), [entry(2), entry(3)])
+        self.assertEqual(self.poll(poller, feed), [])
+
+    def test_failed_first_poll_does_not_prime(self):
+        poller = RssPoller('https://example.com/feed')
+        self.assertEqual(self.poll(poller, FakeFeed(bozo = 1)), [])
+        self.assertEqual(self.poll(poller, FakeFeed([entry(1)], status = 503)), [])
+
+        feed = FakeFeed([entry(2), entry(1)], status = 200)
+        self.assertEqual(self.poll(poller, feed), [])
+        self.assertEqual(self.poll(poller, FakeFeed([entry(3), entry(2), entry(1)], status = 200)), [entry(3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+from datetime import datetime, time, timedelta
+from scheduling import QuietHours, SchedulerRunner
+
+
+class FakeJob:
+
+    def __init__(self, next_run: datetime, result):
+        self.next_run = next_run
+        self.result = result
+        self.runs = 0
+
+    @property
+    def should_run(self):
+        return datetime.now() >= self.next_run
+
+    def run(self):
+        self.runs += 1
+        self.next_run = datetime.now() + timedelta(minutes = 1)
+        return self.result
+
+
+class FakeScheduler:
+
+    def __init__(self, *jobs):
+        self.jobs = list(jobs)
+
+
+class test_quietHours(unittest.TestCase):
+
+    quiet_hours = QuietHours(time(22), time(8))
+
+    def test_window_passing_midnight(self):
+        self.assertIn(datetime(2020, 4, 5, 23, 30), test_quietHours.quiet_hours)
+        self.assertIn(datetime(2020, 4, 5, 7, 59), test_quietHours.quiet_hours)
+        self.assertNotIn(datetime(2020, 4, 5, 8, 0), test_quietHours.quiet_hours)
+        self.assertNotIn(datetime(2020, 4, 5, 21, 50), test_quietHours.quiet_hours)
+
+    def test_defer_to_end_of_window(self):
+        self.assertEqual(test_quietHours.quiet_hours.defer(datetime(2020, 4, 5, 23, 0)), datetime(2020, 4, 6, 8, 0))
+        self.assertEqual(test_quietHours.quiet_hours.defer(datetime(2020, 4, 6, 3, 0)), datetime(2020, 4, 6, 8, 0))
+        self.assertEqual(test_quietHours.quiet_hours.defer(datetime(2020, 4, 6, 12, 0)), datetime(2020, 4, 6, 12, 0))
+
+
+class test_schedulerRunner(unittest.TestCase):
+
+    def test_sleeps_until_next_job(self):
+        now = datetime(2020, 4, 5, 12, 0)
+        runner = SchedulerRunner(FakeScheduler(FakeJob(now + timedelta(seconds = 30), None)))
+        self.assertEqual(runner.seconds_until_due(now), 30)
+
+    def test_quiet_hours_hold_jobs_back(self):
+        now = datetime(2020, 4, 5, 7, 0)
+        job = FakeJob(now, None)
+        runner = SchedulerRunner(FakeScheduler(job), quiet_hours = QuietHours(time(22), time(8)), max_idle = 7200)
+        self.assertEqual(runner.seconds_until_due(now), 3600)
+        self.assertEqual(runner.due_jobs(now), [])
+
+    def test_runs_due_jobs_and_hands_over_results(self):
+        results = []
+        job = FakeJob(datetime.now(), 'hello')
+        idle = FakeJob(datetime.now() + timedelta(hours = 1), 'not yet')
+        runner = SchedulerRunner(FakeScheduler(job, idle), max_idle = 0.05)
+
+        async def on_result(result):
+            results.append(result)
+
+        async def main():
+            stop_at = asyncio.get_running_loop().time() + 0.2
+            await runner.run(on_result, keep_running = lambda: asyncio.get_running_loop().time() < stop_at)
+
+        asyncio.run(main())
+        self.assertEqual(results, ['hello'])
+        self.assertEqual((job.runs, idle.runs), (1, 0))
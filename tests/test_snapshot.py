@@ -0,0 +1,64 @@
+import unittest
+from snapshot import Snapshot, parse_count
+
+
+RESPONSE = {
+    'statistic_taken_at': '2020-04-02 10:00:02',
+    'countries_stat': [
+        {'country_name': 'USA', 'cases': '215,417', 'deaths': '5,116',
+         'total_recovered': '8,878', 'new_cases': '1,234'},
+        {'country_name': 'Sweden', 'cases': '4,947', 'deaths': '239',
+         'total_recovered': 'N/A', 'new_cases': '512'},
+        {'country_name': 'Diamond Princess', 'cases': '712', 'deaths': '11',
+         'total_recovered': '603', 'new_cases': ''}
+    ]
+}
+
+
+class test_snapshot(unittest.TestCase):
+
+    snapshot = Snapshot(RESPONSE)
+
+    def test_parse_count(self):
+        self.assertEqual(parse_count('12,345'), 12345)
+        self.assertIsNone(parse_count('N/A'))
+        self.assertIsNone(parse_count(''))
+
+    def test_lookup_is_case_insensitive(self):
+        self.assertEqual(test_snapshot.snapshot['sweden'].cases, 4947)
+        self.assertEqual(test_snapshot.snapshot['SWEDEN'].raw['cases'], '4,947')
+        self.assertIn('diamond princess', test_snapshot.snapshot)
+        self.assertRaises(KeyError, lambda: test_snapshot.snapshot['narnia'])
+
+    def test_totals_skip_missing_values(self):
+        self.assertEqual(test_snapshot.snapshot.total('cases'), 215417 + 4947 + 712)
+        self.assertEqual(test_snapshot.snapshot.total('total_recovered'), 8878 + 603)
+
+    def test_rankings(self):
+        self.assertEqual(test_snapshot.snapshot.highest('deaths').name, 'USA')
+        self.assertEqual(test_snapshot.snapshot.lowest('total_recovered').name, 'Diamond Princess')
+
+    def test_source_response_is_not_mutated(self):
+        self.assertEqual(RESPONSE['countries_stat'][0]['country_name'], 'USA')
+        self.assertEqual(test_snapshot.snapshot.taken_at, '2020-04-02 10:00:02')
+
+    def test_top_and_bottom(self):
+        self.assertEqual([i.name for i in test_snapshot.snapshot.top('cases', 2)], ['USA', 'Sweden'])
+        self.assertEqual([i.name for i in test_snapshot.snapshot.bottom('cases', 5)], ['Diamond Princess', 'Sweden', 'USA'])
+
+    def test_ranking_percentile(self):
+        ranking = test_snapshot.snapshot.ranking('deaths')
+        self.assertEqual(ranking.percentile(100), 5116)
+        self.assertEqual(ranking.percentile(0), 11)
+        self.assertEqual(ranking.percentile(50), 239)
+        self.assertEqual(ranking.rank_of('sweden'), 2)
+
+    def test_last_row_of_a_country_is_used(self):
+        snapshot = Snapshot({'countries_stat': [
+            {'country_name': 'Sweden', 'cases': '1'},
+            {'country_name': 'sweden ', 'cases': '2'}
+        ]})
+        self.assertEqual(len(snapshot), 1)
+        self.assertEqual(snapshot['Sweden'].cases, 2)
+        self.assertEqual(snapshot.total('cases'), 2)
+        self.assertIsNone(snapshot.get('narnia'))
@@ -0,0 +1,50 @@
+import unittest
+from datetime import datetime
+from snapshot import Snapshot
+from snapshotstore import SnapshotStore
+from changes import ChangeFeed, StaticRouter
+
+
+def make_response(cases: str) -> dict:
+    return {'statistic_taken_at': '2020-04-09 10:00:00',
+            'countries_stat': [{'country_name': 'Sweden', 'cases': cases}]}
+
+
+class FakeApiHandle:
+
+    def __init__(self, response):
+        self.snapshot = Snapshot(response)
+
+    def fetch_snapshot(self):
+        return self.snapshot
+
+
+class test_snapshotStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SnapshotStore(':memory:', keep = 2)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_keeps_latest_distinct_snapshots(self):
+        fetched_at = datetime(2020, 4, 9, 10, 0)
+        self.assertIsNone(self.store.latest())
+        self.assertTrue(self.store.save_snapshot(make_response('1'), fetched_at))
+        self.assertFalse(self.store.save_snapshot(make_response('1'), fetched_at))
+        self.store.save_snapshot(make_response('2'), fetched_at)
+        self.store.save_snapshot(make_response('3'), fetched_at)
+        self.assertEqual(self.store.latest(), (make_response('3'), fetched_at))
+        self.assertEqual([i[0]['countries_stat'][0]['cases'] for i in self.store.history()], ['2', '3'])
+
+    def test_change_detection_resumes_after_restart(self):
+        router = StaticRouter()
+        router.add('cases', channel = 1)
+        render = lambda change, snapshot: f'{change.country} {change.current}'
+
+        feed = ChangeFeed(FakeApiHandle(make_response('100')), router, render, store = self.store)
+        self.assertEqual(feed.poll(), [])
+
+        restarted = ChangeFeed(FakeApiHandle(make_response('150')), router, render, store = self.store)
+        self.assertEqual(restarted.poll(), [{'channel': 1, 'result': ['sweden 150']}])
+        self.assertEqual(self.store.published(), {('sweden', 'cases'): 150})
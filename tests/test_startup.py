@@ -0,0 +1,69 @@
+import builtins
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from metrics import MetricsRegistry
+from startup import StartupTimer, lazy_import, load_parallel
+
+
+class test_startup(unittest.TestCase):
+
+    def test_lazy_import_runs_module_on_first_use(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'lazily_imported.py'), 'w') as f:
+                f.write('import builtins\nbuiltins.lazily_imported_runs = True\nvalue = 42\n')
+            sys.path.insert(0, directory)
+            try:
+                module = lazy_import('lazily_imported')
+                self.assertFalse(hasattr(builtins, 'lazily_imported_runs'))
+                self.assertEqual(module.value, 42)
+                self.assertIs(lazy_import('lazily_imported'), module)
+            finally:
+                sys.path.remove(directory)
+                sys.modules.pop('lazily_imported', None)
+                builtins.__dict__.pop('lazily_imported_runs', None)
+
+    def test_lazy_import_of_missing_module_fails_at_once(self):
+        with self.assertRaises(ModuleNotFoundError):
+            lazy_import('no_such_module_anywhere')
+
+    def test_load_parallel(self):
+        threads = set()
+
+        def loader(value):
+            def load():
+                threads.add(threading.get_ident())
+                time.sleep(0.05)
+                return value
+            return load
+
+        loaded = load_parallel({'a': loader(1), 'b': loader(2), 'c': loader(3)})
+        self.assertEqual(loaded, {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(len(threads), 3)
+
+        def fail():
+            raise ValueError('broken settings')
+        with self.assertRaises(ValueError):
+            load_parallel({'a': loader(1), 'b': fail})
+
+    def test_timer_phases(self):
+        timer = StartupTimer(started = time.perf_counter())
+        time.sleep(0.01)
+        timer.mark('imports')
+        timer.mark('config')
+        self.assertGreaterEqual(timer.phases['imports'], 0.01)
+        self.assertAlmostEqual(timer.total, sum(timer.phases.values()))
+        self.assertTrue(timer.report().startswith('Startup took'))
+
+        registry = MetricsRegistry()
+        timer.publish(registry)
+        rendered = registry.render()
+        self.assertIn('startup_seconds{phase="imports"}', rendered)
+        self.assertIn('startup_seconds{phase="total"}', rendered)
+
+
+if __name__ == '__main__':
+    unittest.main()
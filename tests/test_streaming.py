@@ -0,0 +1,66 @@
+import asyncio
+import json
+import unittest
+from snapshot import Snapshot, SnapshotBuilder
+from streaming import ResponseStream, parse_chunks, parse_chunks_async
+
+
+RESPONSE = {
+    'countries_stat': [
+        {'country_name': 'Sweden', 'cases': '4,947', 'deaths': '239'},
+        {'country_name': 'Åland "},{" öar', 'cases': '11', 'deaths': 'N/A'},
+        {'country_name': 'USA', 'cases': '215,417', 'deaths': '5,116', 'regions': {'ny': {'cases': 1}}}
+    ],
+    'statistic_taken_at': '2020-04-02 10:00:02',
+    'series': [[i, i * 1.5] for i in range(100)],
+    'total': 123456789,
+    'note': None
+}
+
+
+def chunked(body: bytes, size: int) -> list:
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class test_streaming(unittest.TestCase):
+
+    body = json.dumps(RESPONSE, ensure_ascii = False).encode('utf-8')
+
+    def test_any_chunk_size_gives_the_same_response(self):
+        for size in (1, 2, 5, 64, len(test_streaming.body)):
+            response = parse_chunks(chunked(test_streaming.body, size))
+            self.assertEqual(response, RESPONSE)
+            self.assertEqual(list(response), list(RESPONSE))
+
+    def test_rows_are_handed_on_before_the_end(self):
+        rows = []
+        stream = ResponseStream(on_row = rows.append)
+        chunks = chunked(test_streaming.body, 16)
+        for chunk in chunks[:len(chunks) // 2]:
+            stream.feed(chunk)
+        self.assertEqual(rows, RESPONSE['countries_stat'])
+        for chunk in chunks[len(chunks) // 2:]:
+            stream.feed(chunk)
+        self.assertEqual(stream.close(), RESPONSE)
+
+    def test_builder_gives_the_same_snapshot(self):
+        builder = SnapshotBuilder()
+        response = asyncio.run(parse_chunks_async(self.chunks_async(), on_row = builder.add))
+        snapshot, expected = builder.build(response), Snapshot(RESPONSE)
+        self.assertEqual(len(builder), 3)
+        self.assertEqual(list(snapshot), list(expected))
+        self.assertEqual(snapshot.total('cases'), expected.total('cases'))
+
+    async def chunks_async(self):
+        for chunk in chunked(test_streaming.body, 7):
+            yield chunk
+
+    def test_invalid_and_incomplete_responses(self):
+        for body in (b'{"a": 1,}', b'{"countries_stat": [{}, ]}', b'{"countries_stat": [{}',
+                     b'[1]', b'{"a": 1} x', b'{"a" 1}', b'{"a": tru}'):
+            with self.assertRaises(json.JSONDecodeError, msg = body):
+                parse_chunks(chunked(body, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
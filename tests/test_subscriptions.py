@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from changes import ChangeFeed
+from snapshot import Snapshot
+from subscriptions import ALL_COUNTRIES, SubscriptionRegistry
+
+
+class FakeApiHandle:
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def fetch_snapshot(self):
+        return self.snapshot
+
+
+class test_subscriptions(unittest.TestCase):
+
+    def test_country_and_all_country_subscriptions(self):
+        registry = SubscriptionRegistry(':memory:')
+        registry.add(1, 'cases', 'sweden')
+        registry.add(2, 'cases')
+        registry.remove(2, 'cases', 'sweden')
+        registry.add(3, 'deaths')
+
+        self.assertEqual(registry.channels_for('sweden', 'cases'), [1])
+        self.assertEqual(registry.channels_for('norway', 'cases'), [2])
+        self.assertEqual(registry.channels_for('norway', 'deaths'), [3])
+        self.assertEqual(registry.channels_for('norway', 'total_recovered'), [])
+        self.assertEqual(registry.metrics, ('cases', 'deaths'))
+        self.assertEqual(len(registry), 3)
+
+    def test_resubscribing_lifts_an_exception(self):
+        registry = SubscriptionRegistry(':memory:')
+        registry.add(2, 'cases')
+        self.assertTrue(registry.remove(2, 'cases', 'sweden'))
+        self.assertFalse(registry.remove(2, 'cases', 'sweden'))
+        registry.add(2, 'cases', 'sweden')
+        self.assertEqual(registry.channels_for('sweden', 'cases'), [2])
+
+    def test_unsubscribing_all_countries_drops_exceptions(self):
+        registry = SubscriptionRegistry(':memory:')
+        registry.add(2, 'cases')
+        registry.remove(2, 'cases', 'sweden')
+        self.assertTrue(registry.remove(2, 'cases', ALL_COUNTRIES))
+        self.assertEqual(registry.for_channel(2), [])
+        self.assertFalse(registry.remove(2, 'cases', 'norway'))
+
+    def test_changes_by_other_processes_are_picked_up(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'subscriptions.db')
+            worker, shard = SubscriptionRegistry(path), SubscriptionRegistry(path)
+            self.assertEqual(worker.metrics, ())
+            shard.add(5, 'deaths', 'norway', guild = 9)
+            self.assertEqual(worker.metrics, ('deaths',))
+            self.assertEqual(worker.channels_for('norway', 'deaths'), [5])
+            worker.close()
+            shard.close()
+
+    def test_seeded_once_even_when_emptied(self):
+        def setup(registry):
+            registry.add(1, 'cases', 'sweden')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'subscriptions.db')
+            registry = SubscriptionRegistry(path)
+            self.assertTrue(registry.seed(setup))
+            self.assertEqual(registry.channels_for('sweden', 'cases'), [1])
+            registry.remove(1, 'cases', 'sweden')
+            registry.close()
+
+            registry = SubscriptionRegistry(path)
+            self.assertFalse(registry.seed(setup))
+            self.assertEqual(len(registry), 0)
+            registry.close()
+
+    def test_databases_from_before_seeding_are_not_seeded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'subscriptions.db')
+            connection = sqlite3.connect(path)
+            connection.execute(SubscriptionRegistry.SCHEMA)
+            connection.close()
+
+            registry = SubscriptionRegistry(path)
+            self.assertFalse(registry.seed(lambda registry: registry.add(1, 'cases')))
+            self.assertEqual(len(registry), 0)
+            registry.close()
+
+    def test_feed_pushes_to_subscribed_channels_only(self):
+        registry = SubscriptionRegistry(':memory:')
+        registry.add(1, 'cases', 'sweden')
+        registry.add(2, 'deaths')
+
+        def snapshot(cases: str, deaths: str) -> Snapshot:
+            return Snapshot({'countries_stat': [
+                {'country_name': 'Sweden', 'cases': cases, 'deaths': deaths},
+                {'country_name': 'Norway', 'cases': cases, 'deaths': deaths}
+            ]})
+
+        api_handle = FakeApiHandle(snapshot('10', '1'))
+        feed = ChangeFeed(api_handle, registry, lambda change, _: f'{change.country} {change.metric}')
+        feed.poll()
+        api_handle.snapshot = snapshot('20', '2')
+        pushed = {i['channel']: sorted(i['result']) for i in feed.poll()}
+        self.assertEqual(pushed, {1: ['sweden cases'], 2: ['norway deaths', 'sweden deaths']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import json
+import tempfile
+import unittest
+from translations import TranslationRegistry
+
+
+TRANSLATIONS = {
+    'swe_to_eng': {'sydkorea': 's. korea', 'sverige': 'sweden', 'hong kong': 'hong kong'},
+    'eng_to_swe': {'s. korea': 'sydkorea', 'sweden': 'sverige', 'hong kong': 'hong kong'}
+}
+
+
+class test_translationRegistry(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix = '.json')
+        with os.fdopen(fd, 'w', encoding = 'utf-8') as f:
+            json.dump(TRANSLATIONS, f)
+        self.registry = TranslationRegistry(self.path, check_interval = 0)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_both_directions(self):
+        self.assertEqual(self.registry.translate('Sverige', 'swedish'), 'sweden')
+        self.assertEqual(self.registry.translate('S. Korea', 'english'), 'sydkorea')
+
+    def test_alias_and_fuzzy_lookup(self):
+        self.assertEqual(self.registry.translate('syd korea', 'swedish'), 's. korea')
+        self.assertEqual(self.registry.translate('hongkong', 'swedish'), 'hong kong')
+        self.assertEqual(self.registry.translate('sveriges', 'swedish'), 'sweden')
+        self.assertRaises(KeyError, self.registry.translate, 'narnia', 'swedish')
+
+    def test_reload_on_change(self):
+        translations = dict(TRANSLATIONS, swe_to_eng = {'norge': 'norway'})
+        with open(self.path, 'w', encoding = 'utf-8') as f:
+            json.dump(translations, f)
+        os.utime(self.path, (0, 0))
+        self.assertEqual(self.registry.translate('norge', 'swedish'), 'norway')
+
+    def test_failed_reload_keeps_tables(self):
+        with open(self.path, 'w', encoding = 'utf-8') as f:
+            f.write('{')
+        os.utime(self.path, (0, 0))
+        self.assertEqual(self.registry.translate('sverige', 'swedish'), 'sweden')